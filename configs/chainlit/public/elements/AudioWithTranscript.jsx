@@ -3,7 +3,7 @@ import { ScrollArea } from "@/components/ui/scroll-area"
 import { Button } from "@/components/ui/button"
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "@/components/ui/tooltip"
 import { Download } from "lucide-react"
-import { useRef } from "react"
+import { useRef, useEffect } from "react"
 
 export default function AudioWithTranscript() {
     const audioRef = useRef(null);
@@ -15,6 +15,13 @@ export default function AudioWithTranscript() {
         }
     };
 
+    // Seek to the segment of a clicked segment link of an answer
+    useEffect(() => {
+        if (props.seek) {
+            handleSegmentClick(props.seek.start);
+        }
+    }, [props.seek]);
+
     const formatTimestamp = (seconds) => {
         const mins = Math.floor(seconds / 60);
         const secs = Math.floor(seconds % 60);
@@ -80,7 +87,9 @@ export default function AudioWithTranscript() {
                             <div
                                 key={segment.id}
                                 onClick={() => handleSegmentClick(segment.start)}
-                                className="flex gap-2 hover:bg-muted p-2 rounded-md cursor-pointer"
+                                className={`flex gap-2 hover:bg-muted p-2 rounded-md cursor-pointer ${
+                                    props.highlightedSegmentIds?.includes(segment.id) ? "bg-muted" : ""
+                                }`}
                             >
                                 <span className="text-sm text-muted-foreground whitespace-nowrap">
                                     [{formatTimestamp(segment.start)}]
@@ -46,6 +46,13 @@ export default function VideoWithTranscript() {
         }
     };
 
+    // Seek to the segment of a clicked segment link of an answer
+    useEffect(() => {
+        if (props.seek) {
+            handleSegmentClick(props.seek.start);
+        }
+    }, [props.seek]);
+
     const formatTimestamp = (seconds) => {
         const mins = Math.floor(seconds / 60);
         const secs = Math.floor(seconds % 60);
@@ -117,7 +124,9 @@ export default function VideoWithTranscript() {
                             <div
                                 key={segment.id}
                                 onClick={() => handleSegmentClick(segment.start)}
-                                className="flex gap-2 hover:bg-muted p-2 rounded-md cursor-pointer"
+                                className={`flex gap-2 hover:bg-muted p-2 rounded-md cursor-pointer ${
+                                    props.highlightedSegmentIds?.includes(segment.id) ? "bg-muted" : ""
+                                }`}
                             >
                                 <span className="text-sm text-muted-foreground whitespace-nowrap">
                                     [{formatTimestamp(segment.start)}]
@@ -0,0 +1,125 @@
+"""Benchmark the write throughput of the SQLite connection profiles.
+
+Concurrent writers insert Chainlit steps, one transaction per step like the data layer,
+while readers load the steps of a thread. The default SQLite pragmas are compared with
+the tuned profile of `get_sqlite_pragmas()`.
+
+Examples:
+    $ uv run src/podflix/db/benchmark_sqlite.py --writers 8 --steps 200
+
+The module contains the following:
+
+- `run_benchmark(pragmas, writers, steps, readers)` - Benchmarks a connection profile.
+- `main()` - Compares the default and the tuned profile.
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from podflix.db.db_factory import SQLiteDBInterface, get_sqlite_pragmas
+from podflix.db.migrations import MigrationRunner
+
+INSERT_STEP_SQL = sa.text(
+    """
+    INSERT INTO steps ("id", "name", "type", "threadId", "streaming", "output", "createdAt")
+    VALUES (:id, 'benchmark', 'assistant_message', :thread_id, false, :output, :created_at)
+    """
+)
+SELECT_STEPS_SQL = sa.text(
+    """
+    SELECT "id", "output" FROM steps
+    WHERE "threadId" = :thread_id ORDER BY "createdAt" DESC LIMIT 50
+    """
+)
+
+
+async def run_benchmark(
+    pragmas: dict[str, str | int], writers: int, steps: int, readers: int
+) -> float:
+    """Benchmark the step inserts of a connection profile on a fresh database.
+
+    Args:
+        pragmas: The pragmas of the profile, an empty dict keeps the SQLite defaults.
+        writers: Number of concurrent writers, each with its own thread.
+        steps: Number of steps inserted by each writer.
+        readers: Number of concurrent readers loading the steps of the threads.
+
+    Returns:
+        The inserted steps per second.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_interface = SQLiteDBInterface(Path(tmp_dir) / "db.sqlite", pragmas=pragmas)
+        MigrationRunner(db_interface.create_engine()).upgrade()
+
+        engine = create_async_engine(
+            db_interface.async_connection(), pool_size=writers + readers
+        )
+        db_interface.configure_engine(engine.sync_engine)
+
+        thread_ids = [str(uuid4()) for _ in range(writers)]
+        done = asyncio.Event()
+
+        async def write(thread_id: str) -> None:
+            for index in range(steps):
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        INSERT_STEP_SQL,
+                        {
+                            "id": str(uuid4()),
+                            "thread_id": thread_id,
+                            "output": "token " * 100,
+                            "created_at": f"{index:08d}",
+                        },
+                    )
+
+        async def read(thread_id: str) -> None:
+            while not done.is_set():
+                async with engine.connect() as conn:
+                    await conn.execute(SELECT_STEPS_SQL, {"thread_id": thread_id})
+
+        reader_tasks = [
+            asyncio.create_task(read(thread_ids[index % writers]))
+            for index in range(readers)
+        ]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(write(thread_id) for thread_id in thread_ids))
+        duration = time.perf_counter() - start
+
+        done.set()
+        await asyncio.gather(*reader_tasks)
+        await engine.dispose()
+
+    return writers * steps / duration
+
+
+async def main() -> None:
+    """Compare the write throughput of the default and the tuned profile."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    profiles = {"default": {}, "tuned": get_sqlite_pragmas()}
+    results = {}
+
+    for name, pragmas in profiles.items():
+        results[name] = await run_benchmark(
+            pragmas, writers=args.writers, steps=args.steps, readers=args.readers
+        )
+        logger.info(f"{name:>8}: {results[name]:>10.1f} steps/s")
+
+    logger.info(f" speedup: {results['tuned'] / results['default']:>10.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
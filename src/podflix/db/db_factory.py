@@ -1,16 +1,99 @@
 """SqlAlchemy database interface factory and implementations."""
 
+import json
 import os
 from abc import ABC, abstractmethod
 from pathlib import Path
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
 
 from podflix.env_settings import env_settings
 
 
+def to_json_parameter(value):
+    """Serialize a list or dict parameter into JSON, other values are kept.
+
+    Chainlit binds some JSON columns, e.g. the thread tags, as Python objects, which
+    neither sqlite3 nor the asyncpg JSON codecs accept.
+
+    Examples:
+        >>> to_json_parameter(["podcast", "ai"])
+        '["podcast", "ai"]'
+        >>> to_json_parameter("text")
+        'text'
+
+    Args:
+        value: The bound parameter value.
+
+    Returns:
+        The JSON text of lists and dicts, the value itself otherwise.
+    """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+
+    return value
+
+
+def encode_json_text(value) -> bytes:
+    """Encode a value bound to a JSON column into the text of the binary format.
+
+    Strings are taken as JSON text already, like SQLAlchemy and Chainlit bind them,
+    any other value, including scalars and None, is serialized.
+
+    Examples:
+        >>> encode_json_text({"show": "ai"})
+        b'{"show": "ai"}'
+        >>> encode_json_text(True)
+        b'true'
+
+    Args:
+        value: The bound parameter value.
+
+    Returns:
+        The UTF-8 encoded JSON text.
+    """
+    if not isinstance(value, str):
+        value = json.dumps(value)
+
+    return value.encode("utf-8")
+
+
+def get_sqlite_pragmas() -> dict[str, str | int]:
+    """Return the SQLite connection profile configured in the environment settings.
+
+    The defaults favour concurrent Chainlit writes: with WAL, readers don't block the
+    writer, and `synchronous=NORMAL` only syncs at checkpoints, which is still safe
+    against application crashes.
+
+    Examples:
+        >>> get_sqlite_pragmas()["journal_mode"]
+        'WAL'
+
+    Returns:
+        The pragma values by pragma name, applied in order on every connection.
+    """
+    return {
+        "journal_mode": env_settings.sqlite_journal_mode,
+        "synchronous": env_settings.sqlite_synchronous,
+        "busy_timeout": env_settings.sqlite_busy_timeout_ms,
+        "mmap_size": env_settings.sqlite_mmap_size,
+        "temp_store": env_settings.sqlite_temp_store,
+        # NOTE: A negative cache size is in KiB instead of pages
+        "cache_size": -env_settings.sqlite_cache_size_kib,
+    }
+
+
 class SqlAlchemyDBInterface(ABC):
-    """Abstract base class for database interfaces."""
+    """Abstract base class for database interfaces.
+
+    Attributes:
+        schema_mode: The column types of the JSON values, `json` for the portable
+            schema of `init_db.sql` or `jsonb` for the Postgres schema of
+            `init_db_jsonb.sql`.
+    """
+
+    schema_mode = "json"
 
     @abstractmethod
     def get_connection_path(self) -> str:
@@ -36,27 +119,123 @@ class SqlAlchemyDBInterface(ABC):
             A string representing the sync database connection URL.
         """
 
+    def configure_engine(self, engine: Engine) -> Engine:
+        """Configures the connections of an engine of the database.
+
+        For async engines, pass their `sync_engine`.
+
+        Args:
+            engine: The engine to configure.
+
+        Returns:
+            The configured engine.
+        """
+        return engine
+
+    def create_engine(self) -> Engine:
+        """Creates a configured sync engine of the database.
+
+        Returns:
+            The sync engine.
+        """
+        return self.configure_engine(create_engine(self.sync_connection()))
+
     def check_db_connection(self) -> None:
         """Checks if database connection is valid.
 
         Raises:
             Exception: If database connection fails, with details about the error.
         """
+        # NOTE: Imported here, the registry depends on the interfaces
+        from podflix.db.engine_registry import engine_registry  # noqa: PLC0415
+
         try:
-            engine = create_engine(self.sync_connection())
+            engine = engine_registry.get_engine(self)
             with engine.connect() as conn:
-                conn.execute("SELECT 1")
+                conn.execute(text("SELECT 1"))
         except Exception as e:
             db_type = self.__class__.__name__.replace("DBInterface", "")
             raise Exception(f"{db_type} connection error:\n{e}") from e
 
 
 class SQLiteDBInterface(SqlAlchemyDBInterface):
-    """SQLite database interface implementation."""
+    """SQLite database interface implementation.
+
+    Every connection, sync or aiosqlite, is tuned with the pragmas of the profile.
 
-    def __init__(self, db_path: str | Path = "db.sqlite"):
+    Args:
+        db_path: Path to the SQLite database file.
+        pragmas: The pragma values by pragma name. Defaults to `get_sqlite_pragmas()`,
+            an empty dict keeps the SQLite defaults.
+    """
+
+    def __init__(
+        self,
+        db_path: str | Path = "db.sqlite",
+        pragmas: dict[str, str | int] | None = None,
+    ):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.pragmas = get_sqlite_pragmas() if pragmas is None else pragmas
+
+    def apply_pragmas(self, dbapi_connection, connection_record=None) -> None:
+        """Applies the pragmas of the profile to a new DBAPI connection.
+
+        Args:
+            dbapi_connection: The sqlite3 or the adapted aiosqlite connection.
+            connection_record: The pool record of the connection, unused.
+        """
+        cursor = dbapi_connection.cursor()
+
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def adapt_json_parameters(  # noqa: PLR0913, PLR0917
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        """Serializes the list and dict parameters of a statement into JSON.
+
+        Unlike `sqlite3.register_adapter`, this only applies to the engines of the
+        interface instead of every sqlite3 connection of the process.
+
+        Returns:
+            The statement and its adapted parameters.
+        """
+        if executemany:
+            parameters = [
+                type(row)(to_json_parameter(value) for value in row)
+                for row in parameters
+            ]
+        else:
+            parameters = type(parameters)(
+                to_json_parameter(value) for value in parameters
+            )
+
+        return statement, parameters
+
+    def configure_engine(self, engine: Engine) -> Engine:
+        """Applies the pragmas of the profile and the JSON adapters to the engine.
+
+        Args:
+            engine: The engine to configure, the `sync_engine` of async engines.
+
+        Returns:
+            The configured engine.
+        """
+        if not event.contains(engine, "connect", self.apply_pragmas):
+            event.listen(engine, "connect", self.apply_pragmas)
+            event.listen(
+                engine,
+                "before_cursor_execute",
+                self.adapt_json_parameters,
+                retval=True,
+            )
+
+        return engine
 
     def get_connection_path(self) -> str:
         """Returns the SQLite database file path.
@@ -84,7 +263,65 @@ class SQLiteDBInterface(SqlAlchemyDBInterface):
 
 
 class PostgresDBInterface(SqlAlchemyDBInterface):
-    """PostgreSQL database interface implementation."""
+    """PostgreSQL database interface implementation.
+
+    Args:
+        schema_mode: The column types of the JSON values, `json` or `jsonb`. With
+            `jsonb`, metadata and tags can be filtered with GIN indexes.
+    """
+
+    def __init__(self, schema_mode: str = "json"):
+        self.schema_mode = schema_mode
+
+    @staticmethod
+    def register_json_codecs(dbapi_connection, connection_record=None) -> None:
+        """Registers asyncpg JSON codecs also accepting lists and dicts.
+
+        The codecs replace the ones of the SQLAlchemy asyncpg dialect, with the same
+        binary format and decoding.
+
+        Args:
+            dbapi_connection: The adapted asyncpg connection, others are left as is.
+            connection_record: The pool record of the connection, unused.
+        """
+        if not hasattr(dbapi_connection, "run_async"):
+            return
+
+        def encode_jsonb(value) -> bytes:
+            # NOTE: \x01 is the version prefix of the binary jsonb format
+            return b"\x01" + encode_json_text(value)
+
+        async def set_codecs(connection) -> None:
+            await connection.set_type_codec(
+                "json",
+                encoder=encode_json_text,
+                decoder=lambda content: json.loads(content.decode()),
+                schema="pg_catalog",
+                format="binary",
+            )
+            await connection.set_type_codec(
+                "jsonb",
+                encoder=encode_jsonb,
+                decoder=lambda content: json.loads(content[1:].decode()),
+                schema="pg_catalog",
+                format="binary",
+            )
+
+        dbapi_connection.run_async(set_codecs)
+
+    def configure_engine(self, engine: Engine) -> Engine:
+        """Registers the JSON codecs on every asyncpg connection of the engine.
+
+        Args:
+            engine: The engine to configure, the `sync_engine` of async engines.
+
+        Returns:
+            The configured engine.
+        """
+        if not event.contains(engine, "connect", self.register_json_codecs):
+            event.listen(engine, "connect", self.register_json_codecs)
+
+        return engine
 
     def get_connection_path(self) -> str:
         """Returns the PostgreSQL connection path.
@@ -149,6 +386,8 @@ class DBInterfaceFactory:
 
             # NOTE: Implement postgres
             else:
-                cls._db_interface = PostgresDBInterface()
+                cls._db_interface = PostgresDBInterface(
+                    schema_mode=env_settings.db_schema_mode
+                )
 
         return cls._db_interface
@@ -1,12 +1,13 @@
 """Base database management functionality.
 
 This module provides database management capabilities including initialization,
-connection handling, and SQL file execution with retry logic.
+connection handling, SQL file execution and schema migrations with retry logic.
 
 Examples:
     >>> from podflix.db.db_manager import DatabaseManager
     >>> db_manager = DatabaseManager()
     >>> db_manager.execute_sql_file(Path("init.sql"), True, "Initialize")
+    >>> db_manager.migrate()
 
 The module contains the following class:
 
@@ -26,6 +27,8 @@ from tenacity import (
 )
 
 from podflix.db.db_factory import DBInterfaceFactory
+from podflix.db.engine_registry import engine_registry
+from podflix.db.migrations import MigrationRunner, get_migrations, split_sql_statements
 from podflix.env_settings import env_settings
 
 
@@ -48,7 +51,8 @@ class DatabaseManager:
     def __init__(self, max_retries: int = 5, retry_delay: int = 2):
         self.max_retries = max_retries
         self.retry_delay = retry_delay
-        self.engine = sa.create_engine(DBInterfaceFactory.create().sync_connection())
+        self.db_interface = DBInterfaceFactory.create()
+        self.engine = engine_registry.get_engine(self.db_interface)
 
     def read_sql_file(self, file_path: str | Path) -> list[str]:
         """Read and parse SQL statements from a file.
@@ -65,8 +69,7 @@ class DatabaseManager:
             >>> len(statements) > 0
             True
         """
-        with Path(file_path).open("r") as f:
-            return [x.strip() for x in f.read().split(";") if x.strip()]
+        return split_sql_statements(Path(file_path).read_text())
 
     def table_exists(self, conn) -> bool:
         """Check if users table exists in the database.
@@ -100,7 +103,7 @@ class DatabaseManager:
                     SELECT EXISTS (
                         SELECT FROM information_schema.tables
                         WHERE table_schema = 'public'
-                        AND table_name = 'User'
+                        AND table_name = 'users'
                     );
                 """
             result = conn.execute(sa.text(query)).scalar()
@@ -159,3 +162,41 @@ class DatabaseManager:
 
             conn.commit()
             logger.info(f"Database {operation_name.lower()} completed successfully")
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=2, min=2, max=30),
+        retry=retry_if_exception_type(OperationalError),
+        before_sleep=lambda retry_state: logger.warning(
+            f"Database connection attempt {retry_state.attempt_number} failed, retrying..."
+        ),
+    )
+    def migrate(self, convert_json: bool = False) -> list[int]:
+        """Apply the pending schema migrations with retry logic.
+
+        Args:
+            convert_json: Whether to convert the JSON columns of an existing Postgres
+                database in `jsonb` schema mode, which locks the converted tables.
+
+        Returns:
+            The versions of the applied migrations.
+
+        Raises:
+            OperationalError: If database connection fails after max retries.
+
+        Examples:
+            >>> db_manager = DatabaseManager()
+            >>> db_manager.migrate()
+            [1, 2, 5, 6]
+        """
+        migrations = get_migrations(
+            self.db_interface.schema_mode, convert_json=convert_json
+        )
+        applied_versions = MigrationRunner(self.engine, migrations).upgrade()
+
+        if applied_versions:
+            logger.info(f"Applied database migrations: {applied_versions}")
+        else:
+            logger.info("Database schema is up to date")
+
+        return applied_versions
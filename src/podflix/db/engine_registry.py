@@ -0,0 +1,159 @@
+"""Process wide registry of the SQLAlchemy engines.
+
+Each database gets a single sync engine and a single async engine per process, shared
+by the Chainlit data layer, the migrations and the repositories. Their connection pools
+are tuned with the `DB_POOL_*` settings, and the time spent waiting for a pooled
+connection is recorded in the `db_pool_wait` histogram. Their statements are recorded
+by `query_instrumentation`.
+
+Examples:
+    >>> engine = engine_registry.get_async_engine()
+    >>> engine is engine_registry.get_async_engine()
+    True
+
+The module contains the following:
+
+- `InstrumentedQueuePool` - Sync connection pool recording its wait time.
+- `InstrumentedAsyncAdaptedQueuePool` - Async connection pool recording its wait time.
+- `get_engine_options(db_interface, is_async)` - Returns the pool options of an engine.
+- `EngineRegistry` - Creates and caches the engines of the databases.
+- `engine_registry` - The process wide instance.
+"""
+
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from podflix.db.db_factory import (
+    DBInterfaceFactory,
+    PostgresDBInterface,
+    SqlAlchemyDBInterface,
+)
+from podflix.db.query_metrics import query_instrumentation
+from podflix.env_settings import env_settings
+from podflix.utils.metrics import observe
+
+
+class PoolWaitInstrumentation:
+    """Record the time spent getting a connection from the pool."""
+
+    pool_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        finally:
+            observe("db_pool_wait", time.perf_counter() - start, pool=self.pool_name)
+
+
+class InstrumentedQueuePool(PoolWaitInstrumentation, QueuePool):
+    """Sync connection pool recording its wait time."""
+
+
+class InstrumentedAsyncAdaptedQueuePool(PoolWaitInstrumentation, AsyncAdaptedQueuePool):
+    """Async connection pool recording its wait time."""
+
+    pool_name = "async"
+
+
+def get_engine_options(db_interface: SqlAlchemyDBInterface, is_async: bool) -> dict:
+    """Return the pool options of an engine of the database.
+
+    Examples:
+        >>> get_engine_options(DBInterfaceFactory.create(), is_async=True)["pool_size"]
+        5
+
+    Args:
+        db_interface: The interface of the database.
+        is_async: Whether the options are for the async engine.
+
+    Returns:
+        The keyword arguments of `create_engine` or `create_async_engine`.
+    """
+    options = {
+        "poolclass": InstrumentedAsyncAdaptedQueuePool
+        if is_async
+        else InstrumentedQueuePool,
+        "pool_size": env_settings.db_pool_size,
+        "max_overflow": env_settings.db_max_overflow,
+        "pool_timeout": env_settings.db_pool_timeout,
+        "pool_pre_ping": env_settings.db_pool_pre_ping,
+        "pool_recycle": env_settings.db_pool_recycle,
+    }
+
+    if is_async and isinstance(db_interface, PostgresDBInterface):
+        options["connect_args"] = {
+            "statement_cache_size": env_settings.db_statement_cache_size
+        }
+
+    return options
+
+
+class EngineRegistry:
+    """Create and cache one sync and one async engine per database."""
+
+    def __init__(self):
+        self._engines: dict[str, Engine] = {}
+        self._async_engines: dict[str, AsyncEngine] = {}
+
+    def get_engine(self, db_interface: SqlAlchemyDBInterface | None = None) -> Engine:
+        """Return the shared sync engine of a database.
+
+        Args:
+            db_interface: The interface of the database. Defaults to
+                `DBInterfaceFactory.create()`.
+
+        Returns:
+            The sync engine, created on the first call.
+        """
+        db_interface = db_interface or DBInterfaceFactory.create()
+        url = db_interface.sync_connection()
+
+        if url not in self._engines:
+            engine = create_engine(url, **get_engine_options(db_interface, False))
+            query_instrumentation.attach(engine)
+            self._engines[url] = db_interface.configure_engine(engine)
+
+        return self._engines[url]
+
+    def get_async_engine(
+        self, db_interface: SqlAlchemyDBInterface | None = None
+    ) -> AsyncEngine:
+        """Return the shared async engine of a database.
+
+        Args:
+            db_interface: The interface of the database. Defaults to
+                `DBInterfaceFactory.create()`.
+
+        Returns:
+            The async engine, created on the first call.
+        """
+        db_interface = db_interface or DBInterfaceFactory.create()
+        url = db_interface.async_connection()
+
+        if url not in self._async_engines:
+            engine = create_async_engine(url, **get_engine_options(db_interface, True))
+            query_instrumentation.attach(engine.sync_engine)
+            db_interface.configure_engine(engine.sync_engine)
+            self._async_engines[url] = engine
+
+        return self._async_engines[url]
+
+    async def dispose(self) -> None:
+        """Close the pooled connections of all engines."""
+        for async_engine in self._async_engines.values():
+            await async_engine.dispose()
+
+        for engine in self._engines.values():
+            engine.dispose()
+
+        self._engines.clear()
+        self._async_engines.clear()
+
+
+engine_registry = EngineRegistry()
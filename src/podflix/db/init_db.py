@@ -1,19 +1,38 @@
-"""Initialize the database schema using SQL statements from init_db.sql file."""
+"""Initialize or upgrade the database schema with the versioned migrations.
 
-from pathlib import Path
+Examples:
+    $ uv run src/podflix/db/init_db.py
+    $ uv run src/podflix/db/init_db.py --convert-json-columns
+"""
+
+import argparse
 
 from podflix.db.db_manager import DatabaseManager
 
 
-def initialize_db(max_retries: int = 5, retry_delay: int = 2):
-    """Initialize the database using SQL statements from init_db.sql file."""
+def initialize_db(
+    max_retries: int = 5, retry_delay: int = 2, convert_json: bool = False
+):
+    """Apply the pending migrations, creating the schema of a new database.
+
+    Args:
+        max_retries: Maximum number of connection retry attempts.
+        retry_delay: Initial delay between retries in seconds.
+        convert_json: Whether to convert the JSON columns of an existing Postgres
+            database to JSONB, when `DB_SCHEMA_MODE` is `jsonb`. The converted tables
+            are locked while they are rewritten.
+    """
     db_manager = DatabaseManager(max_retries, retry_delay)
-    db_manager.execute_sql_file(
-        Path(__file__).parent / "init_db.sql",
-        check_exists=True,
-        operation_name="Initializing",
-    )
+    db_manager.migrate(convert_json=convert_json)
 
 
 if __name__ == "__main__":
-    initialize_db()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--convert-json-columns",
+        action="store_true",
+        help="Convert the JSON columns of an existing Postgres database to JSONB",
+    )
+    args = parser.parse_args()
+
+    initialize_db(convert_json=args.convert_json_columns)
@@ -68,3 +68,17 @@ CREATE TABLE IF NOT EXISTS feedbacks (
     "comment" TEXT,
     FOREIGN KEY ("threadId") REFERENCES threads("id") ON DELETE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS transcripts (
+    "threadId" UUID PRIMARY KEY,
+    "episodeId" TEXT NOT NULL,
+    "content" BYTEA NOT NULL,
+    "createdAt" TEXT,
+    FOREIGN KEY ("threadId") REFERENCES threads("id") ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS session_state (
+    "key" TEXT PRIMARY KEY,
+    "value" BYTEA NOT NULL,
+    "expiresAt" DOUBLE PRECISION
+);
@@ -0,0 +1,627 @@
+"""Retention, archiving and compaction of the database of the data layer.
+
+Threads without any activity for `RETENTION_DAYS` are archived, as compressed JSON
+documents, into the `thread_archive` table or the S3 bucket, then deleted with their
+steps, elements, feedbacks and transcript. Orphaned elements are deleted with their
+stored files, expired session states are purged, and the database is compacted.
+
+Every batch of `MAINTENANCE_BATCH_SIZE` rows is processed in its own short transaction,
+so the live tables are never locked for long. On SQLite, the database is only vacuumed,
+which blocks the writers, once `MAINTENANCE_VACUUM_FREE_RATIO` of its pages are free.
+On Postgres, a plain `VACUUM (ANALYZE)` doesn't block them, and concurrent workers skip
+the run thanks to an advisory lock.
+
+The job runs every `MAINTENANCE_INTERVAL` seconds when `ENABLE_MAINTENANCE_JOB` is set,
+or once as a script.
+
+Examples:
+    $ uv run src/podflix/db/maintenance.py --retention-days 180
+    >>> maintenance_job.run()
+    {'archived_threads': 12, 'orphaned_elements': 3, 'expired_session_states': 40}
+
+The module contains the following:
+
+- `get_retention_cutoff(retention_days)` - Returns the timestamp threads expire before.
+- `compress_thread_archive(archive)` - Serializes and compresses an archived thread.
+- `decompress_thread_archive(content)` - Restores an archived thread.
+- `ThreadArchive` - The archive of a single thread.
+- `ArchiveSink` - Interface of the archive destinations.
+- `TableArchiveSink` - Archives the threads into the `thread_archive` table.
+- `S3ArchiveSink` - Archives the threads as objects of a S3 bucket.
+- `get_archive_sink()` - Returns the configured archive destination.
+- `MaintenanceJob` - Runs the retention, cleanup and compaction tasks.
+- `maintenance_job` - The process wide instance.
+- `main()` - Runs the maintenance job once.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.engine import Connection, Engine
+
+from podflix.db.engine_registry import engine_registry
+from podflix.env_settings import env_settings
+from podflix.utils.metrics import increment
+
+# NOTE: Arbitrary key of the Postgres advisory lock, next to the migrations one
+MAINTENANCE_LOCK_KEY = 7_204_312
+# NOTE: Lets the live writes through between two batches, SQLite has a single writer
+BATCH_PAUSE_SECONDS = 0.05
+# NOTE: Keeps the maintenance away from the startup of the workers
+START_DELAY_SECONDS = 60
+
+ARCHIVE_S3_PREFIX = "archive/threads"
+VACUUMED_TABLES = (
+    "threads",
+    "steps",
+    "elements",
+    "feedbacks",
+    "transcripts",
+    "session_state",
+    "thread_archive",
+)
+SQLITE_FTS_TABLES = ("steps_fts", "transcripts_fts")
+
+EXPIRED_THREADS_SQL = """
+    SELECT t."id", t."userIdentifier", t."createdAt" FROM threads t
+    WHERE t."createdAt" < :cutoff
+    AND NOT EXISTS (
+        SELECT 1 FROM steps s WHERE s."threadId" = t."id" AND s."createdAt" >= :cutoff
+    )
+    ORDER BY t."createdAt"
+    LIMIT :limit
+"""
+# NOTE: The foreign key checks of the steps written meanwhile wait for the batch
+POSTGRES_EXPIRED_THREADS_SQL = EXPIRED_THREADS_SQL + " FOR UPDATE OF t SKIP LOCKED"
+ORPHANED_ELEMENTS_SQL = """
+    SELECT e."id", e."objectKey" FROM elements e
+    WHERE (:after IS NULL OR e."id" > :after)
+    AND (
+        NOT EXISTS (SELECT 1 FROM threads t WHERE t."id" = e."threadId")
+        OR (
+            e."forId" IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM steps s WHERE s."id" = e."forId")
+        )
+    )
+    ORDER BY e."id"
+    LIMIT :limit
+"""
+EXPIRED_SESSION_STATES_SQL = """
+    DELETE FROM session_state WHERE "key" IN (
+        SELECT "key" FROM session_state WHERE "expiresAt" < :now LIMIT :limit
+    )
+"""
+INSERT_ARCHIVE_SQL = """
+    INSERT INTO thread_archive
+        ("threadId", "userIdentifier", "createdAt", "archivedAt", "content")
+    VALUES (:thread_id, :user_identifier, :created_at, :archived_at, :content)
+    ON CONFLICT ("threadId") DO UPDATE
+    SET "content" = EXCLUDED."content", "archivedAt" = EXCLUDED."archivedAt"
+"""
+# NOTE: Children first, SQLite doesn't enforce the cascades of the foreign keys
+DELETE_THREADS_STATEMENTS = (
+    'DELETE FROM feedbacks WHERE "threadId" IN :ids',
+    'DELETE FROM elements WHERE "threadId" IN :ids',
+    'DELETE FROM steps WHERE "threadId" IN :ids',
+    'DELETE FROM transcripts WHERE "threadId" IN :ids',
+    'DELETE FROM threads WHERE "id" IN :ids',
+)
+SQLITE_DELETE_THREADS_STATEMENTS = (
+    'DELETE FROM transcripts_fts WHERE "threadId" IN :ids',
+)
+
+
+def get_retention_cutoff(retention_days: int) -> str:
+    """Return the timestamp before which the threads without activity expire.
+
+    Examples:
+        >>> get_retention_cutoff(30)
+        '2025-01-01T12:00:00.000000Z'
+
+    Args:
+        retention_days: Days without activity after which a thread expires.
+
+    Returns:
+        The cutoff, in the ISO format of the timestamps of the Chainlit data layer.
+    """
+    cutoff = datetime.now(UTC) - timedelta(days=retention_days)
+
+    return cutoff.replace(tzinfo=None).isoformat(timespec="microseconds") + "Z"
+
+
+def compress_thread_archive(archive: dict[str, Any]) -> bytes:
+    """Serialize and compress an archived thread.
+
+    Examples:
+        >>> content = compress_thread_archive({"thread": {"id": "abc"}, "steps": []})
+        >>> decompress_thread_archive(content)["thread"]["id"]
+        'abc'
+
+    Args:
+        archive: The thread, steps, elements, feedbacks and transcript of the thread.
+
+    Returns:
+        The zlib compressed JSON of the archive.
+    """
+    # NOTE: Values without a JSON type, e.g. UUIDs, are archived as text
+    payload = json.dumps(archive, separators=(",", ":"), default=str)
+
+    return zlib.compress(payload.encode("utf-8"), level=9)
+
+
+def decompress_thread_archive(content: bytes) -> dict[str, Any]:
+    """Restore an archived thread compressed with `compress_thread_archive`.
+
+    Args:
+        content: The compressed archive.
+
+    Returns:
+        The thread, steps, elements, feedbacks and transcript of the thread.
+    """
+    return json.loads(zlib.decompress(content).decode("utf-8"))
+
+
+@dataclass(frozen=True)
+class ThreadArchive:
+    """The archive of a single thread.
+
+    Attributes:
+        thread_id: The identifier of the archived thread.
+        user_identifier: The identifier of the user owning the thread.
+        created_at: The creation timestamp of the thread.
+        content: The archive compressed with `compress_thread_archive`.
+    """
+
+    thread_id: str
+    user_identifier: str | None
+    created_at: str | None
+    content: bytes
+
+
+class ArchiveSink(ABC):
+    """Interface of the destinations of the archived threads."""
+
+    @abstractmethod
+    def write(self, conn: Connection, archives: list[ThreadArchive]) -> None:
+        """Store the archives, the threads are deleted afterwards.
+
+        Args:
+            conn: The connection of the transaction deleting the threads.
+            archives: The archives of the threads.
+        """
+
+
+class TableArchiveSink(ArchiveSink):
+    """Archive the threads into the `thread_archive` table.
+
+    The archives are written in the transaction deleting the threads, so a thread is
+    either archived and deleted or left as is.
+    """
+
+    def write(self, conn: Connection, archives: list[ThreadArchive]) -> None:  # noqa: D102
+        archived_at = time.time()
+
+        conn.execute(
+            sa.text(INSERT_ARCHIVE_SQL),
+            [
+                {
+                    "thread_id": archive.thread_id,
+                    "user_identifier": archive.user_identifier,
+                    "created_at": archive.created_at,
+                    "archived_at": archived_at,
+                    "content": archive.content,
+                }
+                for archive in archives
+            ],
+        )
+
+
+class S3ArchiveSink(ArchiveSink):
+    """Archive the threads as objects of a S3 bucket.
+
+    The objects are written before the threads are deleted, a failed deletion only
+    overwrites them on the next run.
+
+    Args:
+        client: The boto3 S3 client.
+        bucket: The name of the bucket.
+        prefix: The prefix of the object keys.
+    """
+
+    def __init__(self, client, bucket: str, prefix: str = ARCHIVE_S3_PREFIX):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get_key(self, archive: ThreadArchive) -> str:
+        """Return the object key of the archive of a thread."""
+        return (
+            f"{self.prefix}/{archive.user_identifier or 'unknown'}/"
+            f"{archive.thread_id}.json.zlib"
+        )
+
+    def write(self, conn: Connection, archives: list[ThreadArchive]) -> None:  # noqa: D102
+        for archive in archives:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.get_key(archive),
+                Body=archive.content,
+                ContentType="application/octet-stream",
+            )
+
+
+def get_archive_sink() -> ArchiveSink:
+    """Return the archive destination of `RETENTION_ARCHIVE_TARGET`.
+
+    Returns:
+        The `thread_archive` table or the bucket of the S3 storage client.
+
+    Raises:
+        ValueError: If the S3 target is used without the S3 credentials.
+    """
+    if env_settings.retention_archive_target == "s3":
+        # NOTE: Imported here, the Chainlit utilities depend on the database modules
+        from podflix.utils.chainlit_utils.data_layer import (  # noqa: PLC0415
+            get_s3_storage_client,
+        )
+
+        storage_client = get_s3_storage_client()
+        return S3ArchiveSink(storage_client.client, storage_client.bucket)
+
+    return TableArchiveSink()
+
+
+def get_storage_client():
+    """Return the S3 storage client of the element files, None if not configured."""
+    # NOTE: Imported here, the Chainlit utilities depend on the database modules
+    from podflix.utils.chainlit_utils.data_layer import (  # noqa: PLC0415
+        get_s3_storage_client,
+    )
+
+    try:
+        return get_s3_storage_client()
+    except ValueError:
+        return None
+
+
+class MaintenanceJob:
+    """Run the retention, cleanup and compaction tasks of the database.
+
+    Args:
+        engine: The sync engine of the database. Defaults to the one of the registry.
+        retention_days: Days without activity after which a thread is archived, 0
+            keeps the threads.
+        batch_size: Rows processed per transaction.
+        vacuum_free_ratio: Share of free SQLite pages above which the database is
+            vacuumed.
+        interval: Seconds between the periodic runs.
+        archive_sink: The destination of the archived threads. Defaults to
+            `get_archive_sink()`.
+        storage_client: The storage client deleting the files of the orphaned
+            elements. Defaults to the S3 storage client, if configured.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        engine: Engine | None = None,
+        *,
+        retention_days: int = 365,
+        batch_size: int = 100,
+        vacuum_free_ratio: float = 0.25,
+        interval: int = 86400,
+        archive_sink: ArchiveSink | None = None,
+        storage_client=None,
+    ):
+        self._engine = engine
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.vacuum_free_ratio = vacuum_free_ratio
+        self.interval = interval
+        self._archive_sink = archive_sink
+        self._storage_client = storage_client
+
+        self._periodic_task: asyncio.Task | None = None
+
+    @property
+    def engine(self) -> Engine:
+        """The sync engine of the maintained database."""
+        return self._engine or engine_registry.get_engine()
+
+    @property
+    def is_postgres(self) -> bool:
+        """Whether the database is Postgres, SQLite otherwise."""
+        return self.engine.dialect.name == "postgresql"
+
+    def run(self) -> dict[str, int]:
+        """Run all the maintenance tasks once.
+
+        Returns:
+            The number of archived threads, deleted orphaned elements and purged
+            session states, empty if another worker is running the job.
+        """
+        start = time.perf_counter()
+
+        with self.engine.connect() as lock_conn:
+            if self.is_postgres:
+                is_locked = lock_conn.execute(
+                    sa.text("SELECT pg_try_advisory_lock(:key)"),
+                    {"key": MAINTENANCE_LOCK_KEY},
+                ).scalar()
+                lock_conn.commit()
+
+                if is_locked is not True:
+                    logger.info("Skipping the maintenance run of another worker")
+                    return {}
+
+            try:
+                results = {
+                    "archived_threads": self.archive_expired_threads(),
+                    "orphaned_elements": self.delete_orphaned_elements(),
+                    "expired_session_states": self.purge_expired_session_states(),
+                }
+                self.compact()
+            finally:
+                if self.is_postgres:
+                    lock_conn.execute(
+                        sa.text("SELECT pg_advisory_unlock(:key)"),
+                        {"key": MAINTENANCE_LOCK_KEY},
+                    )
+                    lock_conn.commit()
+
+        for task, count in results.items():
+            increment("db_maintenance_rows", count, task=task)
+
+        logger.info(
+            f"Maintenance done in {time.perf_counter() - start:.1f} s: {results}"
+        )
+
+        return results
+
+    def archive_expired_threads(self) -> int:
+        """Archive and delete the threads without activity during the retention.
+
+        Returns:
+            The number of archived threads.
+        """
+        if self.retention_days == 0:
+            return 0
+
+        archive_sink = self._archive_sink or get_archive_sink()
+        cutoff = get_retention_cutoff(self.retention_days)
+        select_sql = (
+            POSTGRES_EXPIRED_THREADS_SQL if self.is_postgres else EXPIRED_THREADS_SQL
+        )
+        delete_statements = DELETE_THREADS_STATEMENTS
+        if not self.is_postgres:
+            delete_statements = SQLITE_DELETE_THREADS_STATEMENTS + delete_statements
+
+        archived = 0
+
+        while True:
+            with self.engine.begin() as conn:
+                threads = (
+                    conn.execute(
+                        sa.text(select_sql),
+                        {"cutoff": cutoff, "limit": self.batch_size},
+                    )
+                    .mappings()
+                    .all()
+                )
+
+                if not threads:
+                    return archived
+
+                thread_ids = [thread["id"] for thread in threads]
+                archive_sink.write(conn, self._build_archives(conn, thread_ids))
+
+                for statement in delete_statements:
+                    conn.execute(_expanding(statement), {"ids": thread_ids})
+
+            archived += len(threads)
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    def delete_orphaned_elements(self) -> int:
+        """Delete the elements of missing threads or steps, with their stored files.
+
+        An element whose file can't be deleted is kept, and retried on the next run.
+
+        Returns:
+            The number of deleted elements.
+        """
+        storage_client = self._storage_client or get_storage_client()
+        deleted = 0
+        after = None
+
+        while True:
+            with self.engine.begin() as conn:
+                elements = conn.execute(
+                    sa.text(ORPHANED_ELEMENTS_SQL),
+                    {"after": after, "limit": self.batch_size},
+                ).all()
+
+                if not elements:
+                    return deleted
+
+                element_ids = [
+                    element_id
+                    for element_id, object_key in elements
+                    if object_key is None
+                    or (
+                        storage_client is not None
+                        and storage_client.sync_delete_file(object_key) is True
+                    )
+                ]
+
+                if element_ids:
+                    conn.execute(
+                        _expanding('DELETE FROM elements WHERE "id" IN :ids'),
+                        {"ids": element_ids},
+                    )
+
+            after = elements[-1][0]
+            deleted += len(element_ids)
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    def purge_expired_session_states(self) -> int:
+        """Delete the expired session states, which are otherwise only overwritten.
+
+        Returns:
+            The number of deleted session states.
+        """
+        purged = 0
+
+        while True:
+            with self.engine.begin() as conn:
+                rowcount = conn.execute(
+                    sa.text(EXPIRED_SESSION_STATES_SQL),
+                    {"now": time.time(), "limit": self.batch_size},
+                ).rowcount
+
+            purged += rowcount
+
+            if rowcount < self.batch_size:
+                return purged
+
+            time.sleep(BATCH_PAUSE_SECONDS)
+
+    def compact(self) -> None:
+        """Reclaim the space of the deleted rows and refresh the planner statistics."""
+        with self.engine.connect() as conn:
+            autocommit_conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+            if self.is_postgres:
+                for table in VACUUMED_TABLES:
+                    autocommit_conn.execute(sa.text(f"VACUUM (ANALYZE) {table}"))
+                return
+
+            for table in SQLITE_FTS_TABLES:
+                autocommit_conn.execute(
+                    sa.text(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+                )
+
+            autocommit_conn.execute(sa.text("PRAGMA optimize"))
+
+            page_count = autocommit_conn.execute(sa.text("PRAGMA page_count")).scalar()
+            free_count = autocommit_conn.execute(
+                sa.text("PRAGMA freelist_count")
+            ).scalar()
+
+            if page_count and free_count / page_count > self.vacuum_free_ratio:
+                logger.info(f"Vacuuming {free_count} free pages of {page_count}")
+                autocommit_conn.execute(sa.text("VACUUM"))
+
+            autocommit_conn.execute(sa.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+    def start(self) -> None:
+        """Start running the job periodically."""
+        if self._periodic_task is None or self._periodic_task.done():
+            self._periodic_task = asyncio.create_task(self._run_periodically())
+
+    def stop(self) -> None:
+        """Stop the periodic runs."""
+        if self._periodic_task is not None:
+            self._periodic_task.cancel()
+
+        self._periodic_task = None
+
+    async def _run_periodically(self) -> None:
+        await asyncio.sleep(min(START_DELAY_SECONDS, self.interval))
+
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except Exception as e:
+                logger.warning(f"Maintenance run failed: {e}")
+
+            await asyncio.sleep(self.interval)
+
+    def _build_archives(
+        self, conn: Connection, thread_ids: list[str]
+    ) -> list[ThreadArchive]:
+        threads = _select_by_thread(conn, "threads", "id", thread_ids)
+        archives = {
+            thread["id"]: {
+                "thread": thread,
+                "steps": [],
+                "elements": [],
+                "feedbacks": [],
+                "transcript": None,
+            }
+            for thread in threads
+        }
+
+        for table in ("steps", "elements", "feedbacks"):
+            for row in _select_by_thread(conn, table, "threadId", thread_ids):
+                archives[row["threadId"]][table].append(row)
+
+        for row in _select_by_thread(conn, "transcripts", "threadId", thread_ids):
+            # NOTE: The format of `compress_transcript` of the thread stores
+            content = json.loads(zlib.decompress(row.pop("content")).decode("utf-8"))
+            archives[row["threadId"]]["transcript"] = {**row, **content}
+
+        return [
+            ThreadArchive(
+                thread_id=str(archive["thread"]["id"]),
+                user_identifier=archive["thread"].get("userIdentifier"),
+                created_at=archive["thread"].get("createdAt"),
+                content=compress_thread_archive(archive),
+            )
+            for archive in archives.values()
+        ]
+
+
+def _expanding(statement: str) -> sa.TextClause:
+    return sa.text(statement).bindparams(sa.bindparam("ids", expanding=True))
+
+
+def _select_by_thread(
+    conn: Connection, table: str, column: str, thread_ids: list[str]
+) -> list[dict[str, Any]]:
+    order_by = ' ORDER BY "createdAt"' if table == "steps" else ""
+    rows = conn.execute(
+        _expanding(f'SELECT * FROM {table} WHERE "{column}" IN :ids{order_by}'),
+        {"ids": thread_ids},
+    ).mappings()
+
+    # NOTE: The search vectors are rebuilt from the text if a thread is restored
+    return [
+        {key: value for key, value in row.items() if key != "searchVector"}
+        for row in rows
+    ]
+
+
+maintenance_job = MaintenanceJob(
+    retention_days=env_settings.retention_days,
+    batch_size=env_settings.maintenance_batch_size,
+    vacuum_free_ratio=env_settings.maintenance_vacuum_free_ratio,
+    interval=env_settings.maintenance_interval,
+)
+
+
+def main() -> None:
+    """Run the maintenance job once."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--retention-days", type=int, default=env_settings.retention_days
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=env_settings.maintenance_batch_size
+    )
+    args = parser.parse_args()
+
+    maintenance_job.retention_days = args.retention_days
+    maintenance_job.batch_size = args.batch_size
+    maintenance_job.run()
+
+
+if __name__ == "__main__":
+    main()
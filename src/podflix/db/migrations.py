@@ -0,0 +1,681 @@
+"""Versioned migrations of the database schema.
+
+Each migration runs once per database, the applied versions are recorded in the
+`schema_migrations` table. Databases initialized before the migrations existed are
+upgraded in place, since the initial schema only creates the missing tables.
+
+On Postgres, indexes are created with `CREATE INDEX CONCURRENTLY`, which doesn't block
+the writes to the indexed table but can't run inside a transaction. Such migrations are
+marked as not transactional and run in autocommit mode.
+
+The migrations depend on the schema mode of the database interface. In `jsonb` mode,
+Postgres databases get the JSONB schema of `init_db_jsonb.sql`, and the thread and step
+metadata and tags get GIN indexes. Converting the JSON columns of an existing database
+rewrites its largest tables under exclusive locks, so it is never done on startup: it
+has to be requested with `uv run src/podflix/db/init_db.py --convert-json-columns`,
+e.g. during a maintenance window, and the startup migrations fail until then.
+
+The full-text search index of the steps and transcripts is a FTS5 table on SQLite and a
+`tsvector` column with a GIN index on Postgres. The steps are indexed by triggers, the
+transcripts, stored compressed, by `ThreadTranscriptStore`.
+
+The threads past the retention period are moved by the maintenance job into the
+`thread_archive` table, see `podflix.db.maintenance`.
+
+Examples:
+    >>> runner = MigrationRunner(sa.create_engine("sqlite:///db.sqlite"))
+    >>> runner.upgrade()
+    [1, 2, 5, 6]
+
+The module contains the following:
+
+- `split_sql_statements(sql)` - Splits a SQL script into statements.
+- `execute_sql_file(conn, sql_file)` - Executes the statements of a SQL file.
+- `Index` - A secondary index created by a migration.
+- `create_index(conn, index)` - Creates an index, concurrently on Postgres.
+- `Migration` - A single versioned migration.
+- `convert_json_columns(conn)` - Converts the JSON columns of Postgres to JSONB.
+- `create_search_index(conn)` - Creates the full-text search index.
+- `create_thread_archive(conn)` - Creates the archive of the expired threads.
+- `get_migrations(schema_mode)` - Returns the migrations of a schema mode.
+- `MIGRATIONS` - The migrations of the portable podflix schema.
+- `MigrationRunner` - Applies the pending migrations.
+"""
+
+import json
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import sqlalchemy as sa
+from loguru import logger
+from sqlalchemy.engine import Connection, Engine
+
+INIT_DB_SQL = Path(__file__).parent / "init_db.sql"
+INIT_DB_JSONB_SQL = Path(__file__).parent / "init_db_jsonb.sql"
+
+# NOTE: Arbitrary key of the Postgres advisory lock serializing the runners
+MIGRATION_LOCK_KEY = 7_204_311
+
+# NOTE: Episodes are in any language, so words are indexed without stemming
+SEARCH_TEXT_CONFIG = "simple"
+# NOTE: A tsvector is limited to 1 MB, longer transcripts are indexed partially
+MAX_SEARCH_TEXT_CHARS = 500_000
+SEARCH_BACKFILL_BATCH_SIZE = 1000
+
+
+def _token_end(sql: str, position: int) -> int:
+    """Return the end of the comment, quoted text or character at the position."""
+    char = sql[position]
+
+    if sql.startswith(("--", "/*"), position):
+        closing = "\n" if char == "-" else "*/"
+        end = sql.find(closing, position + 2)
+        return len(sql) if end == -1 else end + len(closing.strip())
+
+    if char in ("'", '"'):
+        end = position + 1
+        while end < len(sql):
+            # NOTE: A doubled quote is an escaped quote
+            if sql.startswith(char * 2, end):
+                end += 2
+            elif sql[end] == char:
+                return end + 1
+            else:
+                end += 1
+        return end
+
+    if char == "$" and (tag_end := sql.find("$", position + 1)) != -1:
+        tag = sql[position : tag_end + 1]
+
+        if tag == "$$" or tag[1:-1].isidentifier():
+            end = sql.find(tag, tag_end + 1)
+            return len(sql) if end == -1 else end + len(tag)
+
+    return position + 1
+
+
+def split_sql_statements(sql: str) -> list[str]:
+    r"""Split a SQL script into its statements.
+
+    Unlike splitting on every `;`, semicolons inside quoted strings, quoted
+    identifiers, comments and Postgres dollar-quoted bodies are kept.
+
+    Examples:
+        >>> split_sql_statements("SELECT ';'; -- a; comment\nSELECT 2;")
+        ["SELECT ';'", '-- a; comment\nSELECT 2']
+
+    Args:
+        sql: The SQL script.
+
+    Returns:
+        The non-empty statements, without their trailing semicolon.
+    """
+    statements = []
+    start = position = 0
+
+    while position < len(sql):
+        if sql[position] == ";":
+            statements.append(sql[start:position])
+            start = position = position + 1
+        else:
+            position = _token_end(sql, position)
+
+    statements.append(sql[start:])
+
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def execute_sql_file(conn: Connection, sql_file: str | Path) -> None:
+    """Execute the statements of a SQL file.
+
+    Args:
+        conn: The connection to execute the statements with.
+        sql_file: Path to the SQL file.
+    """
+    for statement in split_sql_statements(Path(sql_file).read_text()):
+        conn.execute(sa.text(statement))
+
+
+@dataclass(frozen=True)
+class Index:
+    """A secondary index created by a migration."""
+
+    name: str
+    table: str
+    columns: tuple[str, ...]
+    using: str | None = None
+
+    def create_statement(self, concurrently: bool = False) -> str:
+        """Return the idempotent `CREATE INDEX` statement of the index.
+
+        Args:
+            concurrently: Whether to build the index without blocking writes, Postgres only.
+
+        Returns:
+            The SQL statement.
+        """
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        concurrently_clause = "CONCURRENTLY " if concurrently else ""
+        using_clause = f"USING {self.using} " if self.using else ""
+
+        return (
+            f"CREATE INDEX {concurrently_clause}IF NOT EXISTS {self.name} "
+            f"ON {self.table} {using_clause}({columns})"
+        )
+
+
+def create_index(conn: Connection, index: Index) -> None:
+    """Create an index, concurrently on Postgres.
+
+    A failed concurrent build leaves an invalid index behind, which `IF NOT EXISTS`
+    would keep forever, so such an index is dropped and built again.
+
+    Args:
+        conn: The connection to create the index with, in autocommit mode on Postgres.
+        index: The index to create.
+    """
+    if conn.dialect.name != "postgresql":
+        conn.execute(sa.text(index.create_statement()))
+        return
+
+    is_invalid = conn.execute(
+        sa.text(
+            """
+            SELECT NOT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = :name
+            """
+        ),
+        {"name": index.name},
+    ).scalar()
+
+    if is_invalid is True:
+        logger.warning(f"Rebuilding the invalid index {index.name}")
+        conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+
+    conn.execute(sa.text(index.create_statement(concurrently=True)))
+
+
+@dataclass(frozen=True)
+class Migration:
+    """A single versioned migration.
+
+    Attributes:
+        version: The unique and increasing version of the migration.
+        name: A short description of the migration.
+        upgrade: Applies the migration with the given connection.
+        transactional: Whether the migration runs in a transaction. Migrations building
+            indexes concurrently on Postgres must run in autocommit mode instead, so
+            they must be idempotent.
+    """
+
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    transactional: bool = True
+
+
+SECONDARY_INDEXES = (
+    # NOTE: Thread listing filters by user, the threads are sorted by their steps
+    Index("threads_user_id_created_at_idx", "threads", ("userId", "createdAt")),
+    Index("steps_thread_id_created_at_idx", "steps", ("threadId", "createdAt")),
+    Index("steps_parent_id_idx", "steps", ("parentId",)),
+    Index("elements_thread_id_idx", "elements", ("threadId",)),
+    Index("elements_for_id_idx", "elements", ("forId",)),
+    Index("feedbacks_thread_id_idx", "feedbacks", ("threadId",)),
+    Index("feedbacks_for_id_idx", "feedbacks", ("forId",)),
+)
+
+# NOTE: Containment filters, e.g. threads of a show, use `@>` on the indexed columns
+GIN_INDEXES = (
+    Index("threads_metadata_gin_idx", "threads", ("metadata",), using="GIN"),
+    Index("threads_tags_gin_idx", "threads", ("tags",), using="GIN"),
+    Index("steps_metadata_gin_idx", "steps", ("metadata",), using="GIN"),
+)
+
+# NOTE: The JSON columns of `init_db.sql` and their type in `init_db_jsonb.sql`
+JSONB_COLUMNS = (
+    ("users", "metadata", "JSONB"),
+    ("threads", "tags", "TEXT[]"),
+    ("threads", "metadata", "JSONB"),
+    ("steps", "metadata", "JSONB"),
+    ("steps", "tags", "TEXT[]"),
+    ("steps", "generation", "JSONB"),
+    ("elements", "props", "JSONB"),
+)
+
+
+def create_initial_schema(conn: Connection) -> None:
+    """Create the missing tables of the Chainlit and podflix schema."""
+    execute_sql_file(conn, INIT_DB_SQL)
+
+
+def create_initial_jsonb_schema(conn: Connection) -> None:
+    """Create the missing tables of the schema, with JSONB columns on Postgres."""
+    if conn.dialect.name != "postgresql":
+        execute_sql_file(conn, INIT_DB_SQL)
+        return
+
+    execute_sql_file(conn, INIT_DB_JSONB_SQL)
+
+
+def create_secondary_indexes(conn: Connection) -> None:
+    """Create the indexes of the thread listing and the thread loading queries."""
+    for index in SECONDARY_INDEXES:
+        create_index(conn, index)
+
+
+def get_json_columns(conn: Connection) -> list[tuple[str, str, str]]:
+    """Return the columns of `JSONB_COLUMNS` still having the JSON type, Postgres only.
+
+    Args:
+        conn: The connection to inspect the schema with.
+
+    Returns:
+        The table, column and target type of the columns to convert.
+    """
+    if conn.dialect.name != "postgresql":
+        return []
+
+    json_columns = []
+
+    for table, column, column_type in JSONB_COLUMNS:
+        data_type = conn.execute(
+            sa.text(
+                """
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                AND table_name = :table AND column_name = :column
+                """
+            ),
+            {"table": table, "column": column},
+        ).scalar()
+
+        if data_type == "json":
+            json_columns.append((table, column, column_type))
+
+    return json_columns
+
+
+def check_json_columns(conn: Connection) -> None:
+    """Refuse to go on with a database whose JSON columns are not converted yet.
+
+    Raises:
+        RuntimeError: If the database still has JSON columns.
+    """
+    json_columns = get_json_columns(conn)
+
+    if json_columns:
+        columns = ", ".join(f"{table}.{column}" for table, column, _ in json_columns)
+        raise RuntimeError(
+            f"The columns {columns} are still JSON, while DB_SCHEMA_MODE is jsonb. "
+            "Convert them during a maintenance window, since the tables are locked "
+            "while they are rewritten, with "
+            "`uv run src/podflix/db/init_db.py --convert-json-columns`, "
+            "or set DB_SCHEMA_MODE=json."
+        )
+
+
+def convert_json_columns(conn: Connection) -> None:
+    """Convert the JSON columns of databases created with `init_db.sql` to JSONB.
+
+    Tags become text arrays, which can't be done with a `USING` cast, so their values
+    are copied into a new column replacing the JSON one. The tables are rewritten under
+    an exclusive lock.
+    """
+    for table, column, column_type in get_json_columns(conn):
+        logger.info(f"Converting {table}.{column} to {column_type}")
+
+        if column_type == "JSONB":
+            conn.execute(
+                sa.text(
+                    f'ALTER TABLE {table} ALTER COLUMN "{column}" '
+                    f'TYPE JSONB USING "{column}"::jsonb'
+                )
+            )
+            continue
+
+        conn.execute(sa.text(f'ALTER TABLE {table} ADD COLUMN "{column}_array" TEXT[]'))
+        conn.execute(
+            sa.text(
+                f"""
+                UPDATE {table}
+                SET "{column}_array" = ARRAY(SELECT json_array_elements_text("{column}"))
+                WHERE json_typeof("{column}") = 'array'
+                """
+            )
+        )
+        conn.execute(sa.text(f'ALTER TABLE {table} DROP COLUMN "{column}"'))
+        conn.execute(
+            sa.text(f'ALTER TABLE {table} RENAME COLUMN "{column}_array" TO "{column}"')
+        )
+
+
+def create_gin_indexes(conn: Connection) -> None:
+    """Create the GIN indexes of the metadata and tags filters, Postgres only."""
+    if conn.dialect.name != "postgresql":
+        return
+
+    for index in GIN_INDEXES:
+        create_index(conn, index)
+
+
+SQLITE_SEARCH_STATEMENTS = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS steps_fts
+    USING fts5("input", "output", content='steps', content_rowid='rowid')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS steps_fts_insert AFTER INSERT ON steps BEGIN
+        INSERT INTO steps_fts (rowid, "input", "output")
+        VALUES (new.rowid, new."input", new."output");
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS steps_fts_delete AFTER DELETE ON steps BEGIN
+        INSERT INTO steps_fts (steps_fts, rowid, "input", "output")
+        VALUES ('delete', old.rowid, old."input", old."output");
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS steps_fts_update
+    AFTER UPDATE OF "input", "output" ON steps BEGIN
+        INSERT INTO steps_fts (steps_fts, rowid, "input", "output")
+        VALUES ('delete', old.rowid, old."input", old."output");
+        INSERT INTO steps_fts (rowid, "input", "output")
+        VALUES (new.rowid, new."input", new."output");
+    END
+    """,
+    "INSERT INTO steps_fts (steps_fts) VALUES ('rebuild')",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts
+    USING fts5("text", "threadId" UNINDEXED, "episodeId" UNINDEXED)
+    """,
+)
+
+POSTGRES_SEARCH_STATEMENTS = (
+    'ALTER TABLE steps ADD COLUMN IF NOT EXISTS "searchVector" TSVECTOR',
+    'ALTER TABLE transcripts ADD COLUMN IF NOT EXISTS "searchVector" TSVECTOR',
+    f"""
+    CREATE OR REPLACE FUNCTION steps_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW."searchVector" := to_tsvector(
+            '{SEARCH_TEXT_CONFIG}',
+            coalesce(NEW."input", '') || ' ' || coalesce(NEW."output", '')
+        );
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS steps_search_vector_trigger ON steps",
+    """
+    CREATE TRIGGER steps_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF "input", "output" ON steps
+    FOR EACH ROW EXECUTE FUNCTION steps_search_vector_update()
+    """,
+)
+
+SEARCH_INDEXES = (
+    Index("steps_search_vector_idx", "steps", ("searchVector",), using="GIN"),
+    Index(
+        "transcripts_search_vector_idx", "transcripts", ("searchVector",), using="GIN"
+    ),
+)
+
+
+def backfill_step_search_vectors(conn: Connection) -> None:
+    """Index the existing steps on Postgres, in batches to keep the locks short."""
+    while True:
+        result = conn.execute(
+            sa.text(
+                f"""
+                UPDATE steps SET "searchVector" = to_tsvector(
+                    '{SEARCH_TEXT_CONFIG}',
+                    coalesce("input", '') || ' ' || coalesce("output", '')
+                )
+                WHERE "id" IN (
+                    SELECT "id" FROM steps WHERE "searchVector" IS NULL LIMIT :limit
+                )
+                """
+            ),
+            {"limit": SEARCH_BACKFILL_BATCH_SIZE},
+        )
+
+        if result.rowcount == 0:
+            return
+
+
+def backfill_transcript_search_index(conn: Connection) -> None:
+    """Index the existing transcripts, which are only readable once decompressed."""
+    is_postgres = conn.dialect.name == "postgresql"
+    query = (
+        'SELECT "threadId", "episodeId", "content" FROM transcripts '
+        'WHERE "searchVector" IS NULL'
+        if is_postgres
+        else 'SELECT "threadId", "episodeId", "content" FROM transcripts '
+        'WHERE "threadId" NOT IN (SELECT "threadId" FROM transcripts_fts)'
+    )
+
+    for thread_id, episode_id, content in conn.execute(sa.text(query)).all():
+        # NOTE: The format of `compress_transcript` of the thread stores
+        text = json.loads(zlib.decompress(content).decode("utf-8"))["text"]
+        parameters = {
+            "thread_id": thread_id,
+            "episode_id": episode_id,
+            "text": text[:MAX_SEARCH_TEXT_CHARS],
+        }
+
+        if is_postgres:
+            statement = f"""
+                UPDATE transcripts
+                SET "searchVector" = to_tsvector('{SEARCH_TEXT_CONFIG}', :text)
+                WHERE "threadId" = :thread_id
+            """
+        else:
+            statement = """
+                INSERT INTO transcripts_fts ("text", "threadId", "episodeId")
+                VALUES (:text, :thread_id, :episode_id)
+            """
+
+        conn.execute(sa.text(statement), parameters)
+
+
+def create_search_index(conn: Connection) -> None:
+    """Create the full-text search index of the steps and transcripts."""
+    if conn.dialect.name == "postgresql":
+        for statement in POSTGRES_SEARCH_STATEMENTS:
+            conn.execute(sa.text(statement))
+
+        backfill_step_search_vectors(conn)
+
+        for index in SEARCH_INDEXES:
+            create_index(conn, index)
+    else:
+        for statement in SQLITE_SEARCH_STATEMENTS:
+            conn.execute(sa.text(statement))
+
+    backfill_transcript_search_index(conn)
+
+
+THREAD_ARCHIVE_SQL = """
+    CREATE TABLE IF NOT EXISTS thread_archive (
+        "threadId" UUID PRIMARY KEY,
+        "userIdentifier" TEXT,
+        "createdAt" TEXT,
+        "archivedAt" DOUBLE PRECISION NOT NULL,
+        "content" BYTEA NOT NULL
+    )
+"""
+
+# NOTE: The maintenance job scans the oldest threads and the expired session states
+MAINTENANCE_INDEXES = (
+    Index("threads_created_at_idx", "threads", ("createdAt",)),
+    Index("session_state_expires_at_idx", "session_state", ("expiresAt",)),
+)
+
+
+def create_thread_archive(conn: Connection) -> None:
+    """Create the archive of the expired threads and the indexes of the maintenance."""
+    conn.execute(sa.text(THREAD_ARCHIVE_SQL))
+
+    for index in MAINTENANCE_INDEXES:
+        create_index(conn, index)
+
+
+def get_migrations(
+    schema_mode: str = "json", convert_json: bool = False
+) -> tuple[Migration, ...]:
+    """Return the migrations of a schema mode.
+
+    Examples:
+        >>> [migration.version for migration in get_migrations("jsonb")]
+        [1, 2, 3, 4, 5, 6]
+
+    Args:
+        schema_mode: The schema mode of the database interface, `json` or `jsonb`.
+        convert_json: Whether the JSONB migration converts the JSON columns of an
+            existing database. Otherwise, it fails if there are any.
+
+    Returns:
+        The migrations, the JSONB ones only in `jsonb` mode.
+    """
+    initial_schema = (
+        create_initial_jsonb_schema if schema_mode == "jsonb" else create_initial_schema
+    )
+    migrations = (
+        Migration(1, "initial_schema", initial_schema),
+        Migration(
+            2, "secondary_indexes", create_secondary_indexes, transactional=False
+        ),
+    )
+
+    if schema_mode == "jsonb":
+        migrations += (
+            Migration(
+                3,
+                "jsonb_columns",
+                convert_json_columns if convert_json else check_json_columns,
+            ),
+            Migration(4, "gin_indexes", create_gin_indexes, transactional=False),
+        )
+
+    migrations += (
+        Migration(5, "search_index", create_search_index, transactional=False),
+        Migration(6, "thread_archive", create_thread_archive, transactional=False),
+    )
+
+    return migrations
+
+
+MIGRATIONS = get_migrations()
+
+
+class MigrationRunner:
+    """Apply the pending migrations to a database.
+
+    Args:
+        engine: The sync engine of the database.
+        migrations: The migrations to apply. Defaults to `MIGRATIONS`.
+    """
+
+    def __init__(self, engine: Engine, migrations: tuple[Migration, ...] = MIGRATIONS):
+        self.engine = engine
+        self.migrations = tuple(sorted(migrations, key=lambda m: m.version))
+
+    def applied_versions(self, conn: Connection) -> set[int]:
+        """Return the versions of the applied migrations.
+
+        Args:
+            conn: The connection to query the `schema_migrations` table with.
+
+        Returns:
+            The applied versions.
+        """
+        rows = conn.execute(sa.text('SELECT "version" FROM schema_migrations'))
+
+        return {row[0] for row in rows}
+
+    def pending(self) -> list[Migration]:
+        """Return the migrations that are not applied yet, in version order."""
+        with self.engine.begin() as conn:
+            self._create_migrations_table(conn)
+            applied_versions = self.applied_versions(conn)
+
+        return [m for m in self.migrations if m.version not in applied_versions]
+
+    def upgrade(self) -> list[int]:
+        """Apply the pending migrations in version order.
+
+        On Postgres, concurrent runners, e.g. several workers starting at once, are
+        serialized with an advisory lock.
+
+        Returns:
+            The versions of the applied migrations.
+        """
+        with self.engine.connect() as lock_conn:
+            is_postgres = lock_conn.dialect.name == "postgresql"
+
+            if is_postgres:
+                lock_conn.execute(
+                    sa.text("SELECT pg_advisory_lock(:key)"),
+                    {"key": MIGRATION_LOCK_KEY},
+                )
+                lock_conn.commit()
+
+            try:
+                applied = [self._apply(migration) for migration in self.pending()]
+            finally:
+                if is_postgres:
+                    lock_conn.execute(
+                        sa.text("SELECT pg_advisory_unlock(:key)"),
+                        {"key": MIGRATION_LOCK_KEY},
+                    )
+                    lock_conn.commit()
+
+        return applied
+
+    def _apply(self, migration: Migration) -> int:
+        logger.info(f"Applying migration {migration.version}: {migration.name}")
+
+        if migration.transactional is True:
+            with self.engine.begin() as conn:
+                migration.upgrade(conn)
+                self._record(conn, migration)
+        else:
+            with self.engine.connect() as conn:
+                autocommit_conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                migration.upgrade(autocommit_conn)
+                self._record(autocommit_conn, migration)
+
+        return migration.version
+
+    def _create_migrations_table(self, conn: Connection) -> None:
+        conn.execute(
+            sa.text(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    "version" INT PRIMARY KEY,
+                    "name" TEXT NOT NULL,
+                    "appliedAt" DOUBLE PRECISION NOT NULL
+                )
+                """
+            )
+        )
+
+    def _record(self, conn: Connection, migration: Migration) -> None:
+        conn.execute(
+            sa.text(
+                """
+                INSERT INTO schema_migrations ("version", "name", "appliedAt")
+                VALUES (:version, :name, :applied_at)
+                """
+            ),
+            {
+                "version": migration.version,
+                "name": migration.name,
+                "applied_at": time.time(),
+            },
+        )
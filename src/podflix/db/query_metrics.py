@@ -0,0 +1,178 @@
+"""Per statement instrumentation of the SQLAlchemy engines.
+
+Instead of echoing every SQL statement, the engines record the duration of each
+statement into the `db_query_duration` histogram, labelled by the fingerprint of the
+statement, i.e. the statement with its literals replaced and its whitespace collapsed.
+Only the statements slower than `DB_SLOW_QUERY_THRESHOLD_MS` are logged, with the
+fingerprint instead of the literals and the parameters reduced to their types.
+
+Examples:
+    >>> fingerprint_statement("SELECT * FROM steps WHERE id = 'abc' LIMIT 10")
+    'SELECT * FROM steps WHERE id = ? LIMIT ?'
+    >>> query_instrumentation.attach(engine)
+
+The module contains the following:
+
+- `fingerprint_statement(statement)` - Normalizes a statement into its fingerprint.
+- `get_fingerprint_id(fingerprint)` - Returns the short identifier of a fingerprint.
+- `redact_parameters(parameters)` - Replaces the parameter values with their types.
+- `QueryInstrumentation` - Engine event listeners recording the statements.
+- `query_instrumentation` - The process wide instance.
+"""
+
+import hashlib
+import re
+import time
+from functools import lru_cache
+from typing import Any
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from podflix.env_settings import env_settings
+from podflix.utils.metrics import increment, observe
+
+LITERAL_PATTERN = re.compile(
+    r"'(?:[^']|'')*'"  # NOTE: String literals, with doubled quotes
+    r"|\b\d+(?:\.\d+)?\b"  # NOTE: Number literals
+)
+IN_LIST_PATTERN = re.compile(r"\bIN\s*\((?:\s*\$?\?\s*,)*\s*\$?\?\s*\)", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+QUERY_START_TIMES_KEY = "podflix_query_start_times"
+
+
+@lru_cache(maxsize=1024)
+def fingerprint_statement(statement: str) -> str:
+    """Normalize a statement into its fingerprint.
+
+    Statements differing only by their literals, the length of their `IN` lists or
+    their whitespace share a fingerprint. The bound parameters of SQLAlchemy are kept
+    as they are, so the statements of the data layer are fingerprinted once.
+
+    Examples:
+        >>> fingerprint_statement("DELETE FROM steps WHERE id IN (1, 2, 3)")
+        'DELETE FROM steps WHERE id IN (?)'
+
+    Args:
+        statement: The SQL statement.
+
+    Returns:
+        The fingerprint of the statement.
+    """
+    fingerprint = LITERAL_PATTERN.sub("?", statement)
+    fingerprint = IN_LIST_PATTERN.sub("IN (?)", fingerprint)
+
+    return WHITESPACE_PATTERN.sub(" ", fingerprint).strip()
+
+
+@lru_cache(maxsize=1024)
+def get_fingerprint_id(fingerprint: str) -> str:
+    """Return the short identifier of a fingerprint, used as the metric label.
+
+    Args:
+        fingerprint: The fingerprint of a statement.
+
+    Returns:
+        The first 12 hexadecimal characters of the SHA-1 of the fingerprint.
+    """
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Replace the parameter values with their types, and lengths if they have one.
+
+    Examples:
+        >>> redact_parameters({"id": "abc", "limit": 10})
+        {'id': '<str:3>', 'limit': '<int>'}
+
+    Args:
+        parameters: The parameters of a statement, a mapping, a sequence or a list of
+            them for `executemany`.
+
+    Returns:
+        The parameters with the same structure and redacted values.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact_parameters(value) for key, value in parameters.items()}
+
+    if isinstance(parameters, (list, tuple)):
+        return type(parameters)(redact_parameters(value) for value in parameters)
+
+    if parameters is None:
+        return None
+
+    type_name = type(parameters).__name__
+
+    if isinstance(parameters, (str, bytes)):
+        return f"<{type_name}:{len(parameters)}>"
+
+    return f"<{type_name}>"
+
+
+class QueryInstrumentation:
+    """Record the duration of the statements executed by the attached engines.
+
+    Args:
+        slow_query_threshold_ms: Statements slower than this are logged.
+    """
+
+    def __init__(self, slow_query_threshold_ms: int = 250):
+        self.slow_query_threshold_ms = slow_query_threshold_ms
+
+    def attach(self, engine: Engine) -> Engine:
+        """Listen to the statements of an engine, attaching it twice does nothing.
+
+        Args:
+            engine: The sync engine, or the `sync_engine` of an async engine.
+
+        Returns:
+            The same engine.
+        """
+        if not event.contains(engine, "before_cursor_execute", self.before_execute):
+            event.listen(engine, "before_cursor_execute", self.before_execute)
+            event.listen(engine, "after_cursor_execute", self.after_execute)
+
+        return engine
+
+    def before_execute(  # noqa: PLR0913, PLR0917
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        """Store the start time of the statement on the connection."""
+        conn.info.setdefault(QUERY_START_TIMES_KEY, []).append(time.perf_counter())
+
+    def after_execute(  # noqa: PLR0913, PLR0917
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        """Record the duration of the statement and log it if it is slow."""
+        start_times = conn.info.get(QUERY_START_TIMES_KEY)
+
+        if not start_times:
+            return
+
+        duration = time.perf_counter() - start_times.pop()
+        fingerprint = fingerprint_statement(statement)
+        fingerprint_id = get_fingerprint_id(fingerprint)
+        operation = fingerprint.split(" ", 1)[0].upper()
+
+        observe(
+            "db_query_duration",
+            duration,
+            operation=operation,
+            fingerprint=fingerprint_id,
+        )
+
+        if duration * 1000 < self.slow_query_threshold_ms:
+            return
+
+        increment("db_slow_queries", operation=operation, fingerprint=fingerprint_id)
+        logger.warning(
+            f"Slow query {fingerprint_id} took {duration * 1000:.1f} ms: {fingerprint} "
+            f"parameters={redact_parameters(parameters)}"
+        )
+
+
+query_instrumentation = QueryInstrumentation(
+    slow_query_threshold_ms=env_settings.db_slow_query_threshold_ms
+)
@@ -13,7 +13,7 @@ from pydantic import (
     field_validator,
     model_validator,
 )
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 AnyHttpUrlAdapter = TypeAdapter(AnyHttpUrl)
 PASSWORD_AUTH_REQUIRED_ENV_VARS = ("ADMIN_USERNAME", "ADMIN_PASSWORD")
@@ -95,21 +95,80 @@ class EnvSettings(BaseSettings):
     oauth_generic_scopes: str | None = None
     oauth_generic_name: str = "generic"
     oauth_generic_user_identifier: str = "email"
+    answer_cache_max_entries: int = Field(default=1024, ge=1)
+    answer_cache_similarity_threshold: float = Field(default=0.95, ge=0, le=1)
+    answer_cache_ttl: int = Field(default=3600, ge=1, description="Seconds a cached answer stays valid")
+    completion_cache_dir: str | None = Field(default=None, description="Directory of the completion cache, kept in memory if not set")
+    completion_cache_max_chars: int = Field(default=2_000_000, ge=1, description="Characters of the in-memory completion cache")
+    completion_cache_max_entries: int = Field(default=512, ge=1)
+    data_layer_write_behind_ms: int = Field(default=250, ge=0, description="Milliseconds the step writes are coalesced for, 0 writes them immediately")
+    db_max_overflow: int = Field(default=10, ge=0, description="Connections opened above the pool size under load")
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = Field(default=1800, ge=-1, description="Seconds after which a pooled connection is replaced, -1 disables it")
+    db_pool_size: int = Field(default=5, ge=1)
+    db_pool_timeout: int = Field(default=30, ge=1, description="Seconds to wait for a pooled connection")
+    db_schema_mode: Annotated[str, AfterValidator(partial(allowed_values, values=["json", "jsonb"]))] = Field(default="json", description="Postgres column types of the JSON values, jsonb needs the columns of existing databases converted with init_db.py --convert-json-columns")
+    db_slow_query_threshold_ms: int = Field(default=250, ge=0, description="SQL statements slower than this are logged with redacted parameters")
+    db_statement_cache_size: int = Field(default=100, ge=0, description="Prepared statements cached per asyncpg connection, 0 behind pgbouncer")
     embedding_host: CustomHttpUrlStr
     embedding_model_name: str
+    enable_answer_cache: bool = False
+    enable_completion_cache: bool = False
+    enable_langfuse_metric_scores: bool = False
+    enable_library_index: bool = False
+    enable_maintenance_job: bool = False
+    enable_model_warmup: bool = False
     enable_openai_api: bool = False
     enable_sqlite_data_layer: bool = False
+    endpoint_cooldown: int = Field(default=30, ge=1, description="Seconds a failing endpoint is removed from the rotation")
+    endpoint_failure_threshold: int = Field(default=3, ge=1)
+    endpoint_health_check_interval: int = Field(default=15, ge=0, description="Seconds between endpoint health checks, 0 disables them")
+    endpoint_hedge_delay_ms: int = Field(default=0, ge=0, description="Milliseconds before a slow request is hedged to a second endpoint, 0 disables hedging")
+    endpoint_latency_ewma_alpha: float = Field(default=0.3, gt=0, le=1)
+    graph_stream_mode: Annotated[str, AfterValidator(partial(allowed_values, values=["messages", "events"]))] = "messages"
     hf_token: str | None = None
     langfuse_base_url: CustomHttpUrlStr
+    langfuse_metadata_ttl: int = Field(default=300, ge=1, description="Seconds between refreshes of the Langfuse credentials and project id")
     langfuse_public_key: str
     langfuse_secret_key: str
     library_base_path: str = Field(default=..., description="Path to the library base directory")
+    library_hnsw_ef_construction: int = Field(default=200, ge=1)
+    library_hnsw_ef_search: int = Field(default=64, ge=1, description="Higher values trade library search latency for recall")
+    library_hnsw_m: int = Field(default=16, ge=2)
+    library_search_top_k: int = Field(default=5, ge=1)
+    maintenance_batch_size: int = Field(default=100, ge=1, description="Threads, elements or session states processed per short maintenance transaction")
+    maintenance_interval: int = Field(default=86400, ge=1, description="Seconds between runs of the maintenance job")
+    maintenance_vacuum_free_ratio: float = Field(default=0.25, ge=0, le=1, description="Share of free SQLite pages above which the database is vacuumed")
+    memory_summary_max_tokens: int = Field(default=256, ge=1)
+    memory_window_max_tokens: int = Field(default=1500, ge=1, description="Token budget of the recent messages kept in the graph state")
     model_api_base: CustomHttpUrlStr
+    model_api_replicas: Annotated[list[CustomHttpUrlStr], NoDecode] = Field(default=[], description="Comma separated extra endpoints serving the model")
     model_name: str
     openai_api_key: str | None = None
     rerank_model_name: str
+    retention_archive_target: Annotated[str, AfterValidator(partial(allowed_values, values=["table", "s3"]))] = Field(default="table", description="Where the expired threads are archived, the thread_archive table or the S3 bucket")
+    retention_days: int = Field(default=365, ge=0, description="Days without activity after which a thread is archived, 0 keeps the threads")
+    resume_history_max_messages: int = Field(default=50, ge=1, description="Most recent messages loaded when a thread is resumed")
+    session_state_backend: Annotated[str, AfterValidator(partial(allowed_values, values=["memory", "sql", "redis"]))] = "memory"
+    session_state_redis_url: str | None = None
+    session_state_ttl: int = Field(default=86400, ge=1, description="Seconds the session state of a thread is kept after its last turn")
+    sqlite_busy_timeout_ms: int = Field(default=5000, ge=0, description="Milliseconds a SQLite connection waits for a lock")
+    sqlite_cache_size_kib: int = Field(default=65536, ge=0, description="Page cache of each SQLite connection")
+    sqlite_journal_mode: Annotated[str, AfterValidator(partial(allowed_values, values=["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"]))] = "WAL"
+    sqlite_mmap_size: int = Field(default=268_435_456, ge=0, description="Bytes of the SQLite database memory mapped, 0 disables mmap")
+    sqlite_synchronous: Annotated[str, AfterValidator(partial(allowed_values, values=["OFF", "NORMAL", "FULL", "EXTRA"]))] = "NORMAL"
+    sqlite_temp_store: Annotated[str, AfterValidator(partial(allowed_values, values=["DEFAULT", "FILE", "MEMORY"]))] = "MEMORY"
+    stream_coalesce_interval_ms: int = Field(default=30, ge=0, description="Maximum milliseconds a streamed token is buffered")
+    stream_coalesce_max_chars: int = Field(default=64, ge=1, description="Buffered characters flushing streamed tokens, 1 disables coalescing")
+    stream_max_pending_packets: int = Field(default=256, ge=1, description="Websocket write queue size pausing the streaming of slow clients")
     timeout_limit: int = 30
+    transcript_store_max_entries: int = Field(default=32, ge=1, description="Transcripts kept in memory, only the ones unused by sessions are evicted")
+    trace_buffer_max_size: int = Field(default=10_000, ge=1, description="Buffered tracing events, the oldest are dropped when Langfuse is slow")
+    trace_sample_rate: float = Field(default=1.0, ge=0, le=1, description="Share of the turns traced in Langfuse")
+    trace_sample_rates: Annotated[dict[str, float], NoDecode] = Field(default={}, description="Comma separated `app_type:rate` pairs overriding the sample rate")
+    trace_slow_turn_seconds: float = Field(default=10.0, ge=0, description="Turns slower than this are always traced")
     whisper_api_base: CustomHttpUrlStr
+    whisper_api_replicas: Annotated[list[CustomHttpUrlStr], NoDecode] = Field(default=[], description="Comma separated extra endpoints serving whisper")
     whisper_model_name: str
 
     @field_validator("openai_api_key")
@@ -122,6 +181,16 @@ class EnvSettings(BaseSettings):
 
         return value
 
+    @field_validator("session_state_redis_url")
+    def validate_session_state_redis_url(cls, value, values):
+        """Validate the Redis URL of the session state backend."""
+        if values.data.get("session_state_backend") == "redis" and value is None:
+            message = "SESSION_STATE_REDIS_URL should be set, when SESSION_STATE_BACKEND is redis."
+            logger.error(message)
+            raise ValueError(message)
+
+        return value
+
     @field_validator("model_api_base")
     def validate_model_api_base(cls, value, values):
         """Validate the model API base URL."""
@@ -132,6 +201,42 @@ class EnvSettings(BaseSettings):
 
         return value
 
+    @field_validator("model_api_replicas", "whisper_api_replicas", mode="before")
+    def split_replicas(cls, value):
+        """Split comma separated endpoint lists."""
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(",") if item.strip()]
+
+        return value
+
+    @field_validator("trace_sample_rates", mode="before")
+    def split_trace_sample_rates(cls, value):
+        """Split comma separated `app_type:rate` pairs."""
+        if not isinstance(value, str):
+            return value
+
+        sample_rates = {}
+        for item in value.split(","):
+            if not item.strip():
+                continue
+
+            if ":" not in item:
+                raise ValueError(f"TRACE_SAMPLE_RATES item `{item.strip()}` must be `app_type:rate`.")
+
+            app_type, rate = item.split(":", 1)
+            sample_rates[app_type.strip()] = rate.strip()
+
+        return sample_rates
+
+    @field_validator("trace_sample_rates")
+    def validate_trace_sample_rates(cls, value):
+        """Validate that the sample rates are between 0 and 1."""
+        for app_type, rate in value.items():
+            if not 0 <= rate <= 1:
+                raise ValueError(f"Sample rate of {app_type} must be between 0 and 1.")
+
+        return value
+
     @field_validator("auth_groups", mode="before")
     def validate_auth_groups(cls, value):
         """Validate AUTH_GROUPS."""
@@ -0,0 +1,129 @@
+"""Bounded conversation memory for the graphs.
+
+The memory keeps a sliding window of the most recent messages under a token budget.
+Messages that fall out of the window are folded into a rolling summary, so the
+graph state and the prompt size stay flat however long the conversation gets.
+
+Examples:
+    >>> messages = [HumanMessage("Hi"), AIMessage("Hello"), HumanMessage("Bye")]
+    >>> older, window = split_message_window(messages, max_tokens=10)
+    >>> [message.content for message in window]
+    ['Bye']
+
+The module contains the following:
+
+- `split_message_window(messages, max_tokens)` - Splits messages into older ones and the recent window.
+- `manage_memory(state)` - Graph node trimming the messages and updating the summary.
+"""
+
+from typing import Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.prompts import ChatPromptTemplate
+from loguru import logger
+
+from podflix.env_settings import env_settings
+from podflix.utils.pipeline_registry import pipeline_registry
+
+SUMMARIZE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "Progressively summarize the conversation between a user and an assistant "
+            "about a podcast. Extend the current summary with the new lines and return "
+            "only the new summary.",
+        ),
+        (
+            "human",
+            "Current summary:\n{summary}\n\nNew lines of conversation:\n{new_lines}",
+        ),
+    ]
+)
+
+
+def split_message_window(
+    messages: Sequence[BaseMessage], max_tokens: int
+) -> tuple[list[BaseMessage], list[BaseMessage]]:
+    """Split the messages into older messages and a recent window under a token budget.
+
+    The last message is always part of the window, even if it exceeds the budget.
+    The window always starts with a user message, so question/answer pairs are not
+    torn apart.
+
+    Examples:
+        >>> split_message_window([HumanMessage("Hi")], max_tokens=0)
+        ([], [HumanMessage(content='Hi', additional_kwargs={}, response_metadata={})])
+
+    Args:
+        messages: The conversation messages ordered from oldest to newest.
+        max_tokens: The approximate token budget of the window.
+
+    Returns:
+        A tuple of the older messages and the window messages.
+    """
+    if not messages:
+        return [], []
+
+    window_start = len(messages) - 1
+    window_tokens = count_tokens_approximately([messages[-1]])
+
+    for index in range(len(messages) - 2, -1, -1):
+        window_tokens += count_tokens_approximately([messages[index]])
+
+        if window_tokens > max_tokens:
+            break
+
+        window_start = index
+
+    while window_start < len(messages) - 1 and not isinstance(
+        messages[window_start], HumanMessage
+    ):
+        window_start += 1
+
+    return list(messages[:window_start]), list(messages[window_start:])
+
+
+async def manage_memory(state: dict) -> dict:
+    """Keep a bounded window of messages and summarize the ones falling out of it.
+
+    Examples:
+        >>> state = {"messages": [HumanMessage("Hi", id="1")], "summary": ""}
+        >>> await manage_memory(state)
+        {}
+
+    Args:
+        state: The graph state containing:
+            - messages: The conversation messages with ids.
+            - summary: The summary of the messages that were already removed.
+
+    Returns:
+        A state update removing the older messages and containing the new summary,
+        or an empty dictionary if all messages fit into the window.
+    """
+    older_messages, _ = split_message_window(
+        state["messages"], max_tokens=env_settings.memory_window_max_tokens
+    )
+
+    if not older_messages:
+        return {}
+
+    new_lines = "\n".join(
+        f"{message.type}: {message.content}" for message in older_messages
+    )
+
+    chain = pipeline_registry.get_pipeline(
+        name="memory.summarize",
+        prompt=SUMMARIZE_PROMPT,
+        chat_model_kwargs={"max_tokens": env_settings.memory_summary_max_tokens},
+    )
+    summary = await chain.ainvoke(
+        {"summary": state.get("summary") or "No summary yet.", "new_lines": new_lines}
+    )
+
+    logger.debug(f"Summarized {len(older_messages)} messages into the memory")
+
+    return {
+        "summary": summary,
+        "messages": [RemoveMessage(id=message.id) for message in older_messages],
+    }
@@ -3,13 +3,28 @@
 from typing import Annotated, Sequence, TypedDict
 
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
 from loguru import logger
 
-from podflix.utils.model import get_chat_model
+from podflix.env_settings import env_settings
+from podflix.graph.memory import manage_memory
+from podflix.graph.query_router import route_query, select_route
+from podflix.utils.library_index import search_library
+from podflix.utils.pipeline_registry import pipeline_registry
+
+GENERATE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "Use the following context to answer the question: {context}\n\n"
+            "Summary of the earlier conversation: {summary}",
+        ),
+        MessagesPlaceholder("history"),
+        ("human", "{question}"),
+    ]
+)
 
 
 class AgentState(TypedDict):
@@ -17,10 +32,39 @@ class AgentState(TypedDict):
 
     messages: Annotated[Sequence[BaseMessage], add_messages]
     context: str
+    summary: str
+    scope: str
+    library_filters: dict
+    segment_ids: list
+    route: str
+
+
+def format_library_context(results: list) -> str:
+    """Format library search results into a prompt context.
+
+    Args:
+        results: The library chunks and their similarity.
+
+    Returns:
+        The chunks with their show, publish date and time range.
+    """
+    return "\n\n".join(
+        f"[{chunk.show} | {chunk.published_at} | {chunk.start:.0f}s-{chunk.end:.0f}s] "
+        f"{chunk.text}"
+        for chunk, _ in results
+    )
 
 
 async def retrieve(state: AgentState) -> AgentState:
     """Retrieve relevant context based on the user's question."""
+    if state.get("scope") == "library":
+        results = await search_library(
+            state["messages"][-1].content,
+            k=env_settings.library_search_top_k,
+            **state.get("library_filters", {}),
+        )
+        return {"context": format_library_context(results)}
+
     # TODO: Implement actual retrieval logic
     # This is a placeholder that should be replaced with your vector store retrieval
     # question = state["messages"][-1].content
@@ -32,19 +76,22 @@ async def retrieve(state: AgentState) -> AgentState:
 async def generate(state: AgentState) -> AgentState:
     """Generate a response using the retrieved context."""
     question = state["messages"][-1].content
+    history = state["messages"][:-1]
     context = state["context"]
+    summary = state.get("summary") or "No earlier conversation."
 
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", "Use the following context to answer the question: {context}"),
-            ("human", "{question}"),
-        ]
+    chain = pipeline_registry.get_pipeline(
+        name="podcast_rag.generate", prompt=GENERATE_PROMPT
     )
 
-    model = get_chat_model()
-    chain = prompt | model | StrOutputParser()
-
-    response = await chain.ainvoke({"context": context, "question": question})
+    response = await chain.ainvoke(
+        {
+            "context": context,
+            "summary": summary,
+            "history": history,
+            "question": question,
+        }
+    )
 
     return {
         "messages": [AIMessage(content=response)],
@@ -54,16 +101,22 @@ async def generate(state: AgentState) -> AgentState:
 # Create the graph
 graph = StateGraph(AgentState)
 
-# Add nodes for retrieval and generation
+# Add nodes for routing, memory, retrieval and generation
+graph.add_node("route_query", route_query)
+graph.add_node("manage_memory", manage_memory)
 graph.add_node("retrieve", retrieve)
 graph.add_node("generate", generate)
 
-# Define the edges
+# Define the edges, direct lookups are answered by the router without the LLM
+graph.add_conditional_edges(
+    "route_query", select_route, {"lookup": END, "generate": "manage_memory"}
+)
+graph.add_edge("manage_memory", "retrieve")
 graph.add_edge("retrieve", "generate")
 graph.add_edge("generate", END)
 
 # Set the entry point
-graph.set_entry_point("retrieve")
+graph.set_entry_point("route_query")
 
 # Compile the graph
 compiled_graph = graph.compile()
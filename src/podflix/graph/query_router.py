@@ -0,0 +1,278 @@
+"""Route direct transcript lookups away from the LLM.
+
+Questions like "what was said at 12:30?" or "when do they talk about X?" can be
+answered from the transcript segments alone. The router classifies the question and
+answers such lookups from a segment index, so the LLM is only used for questions that
+actually need generation.
+
+Examples:
+    >>> classify_query("What was said at 12:30?")
+    ('timestamp', '12:30')
+    >>> classify_query("When do they talk about vector databases?")
+    ('topic', 'vector databases')
+    >>> classify_query("Summarize the episode")
+    ('generate', None)
+
+The module contains the following:
+
+- `parse_timestamp(timestamp)` - Converts a `[h:]mm:ss` timestamp into seconds.
+- `format_timestamp(seconds)` - Converts seconds into the transcript `m:ss` format.
+- `classify_query(question)` - Classifies a question into a lookup or generation.
+- `SegmentIndex` - Timestamp and keyword index over transcript segments.
+- `route_query(state)` - Graph node answering direct lookups.
+- `select_route(state)` - Conditional edge selecting the next node of the graph.
+"""
+
+import bisect
+import re
+from collections import defaultdict
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables.config import RunnableConfig
+from loguru import logger
+
+# NOTE: Both patterns span the whole question, only pure lookups skip the LLM
+TIMESTAMP_QUERY_PATTERN = re.compile(
+    r"^\s*what(?:'s|\s+is|\s+was|\s+do\s+they|\s+did\s+they)?\s+(?:being\s+)?"
+    r"(?:said|say|discuss(?:ed)?|talked\s+about|mentioned|happen(?:s|ed|ing)?)\s+"
+    r"(?:at|around)\s+(?P<timestamp>\d{1,2}:\d{2}(?::\d{2})?)\s*\??\s*$",
+    re.IGNORECASE,
+)
+TOPIC_QUERY_PATTERN = re.compile(
+    r"^\s*(?:when|where|at what (?:time|point))\s+(?:do|does|did|is|are|was|were)\s+"
+    r"(?:they|he|she|we|it|someone|anyone|the \w+)?\s*"
+    r"(?:talk(?:ing)?|speak(?:ing)?|discuss(?:ing)?|mention(?:ing)?|said|say|"
+    r"bring(?:ing)? up)\s+(?:about\s+)?"
+    r"(?P<topic>[\w'-]+(?:\s+[\w'-]+){0,5}?)\s*\??\s*$",
+    re.IGNORECASE,
+)
+GENERATION_QUERY_PATTERN = re.compile(
+    r"\b(?:why|how|explain|summari[sz]e|describe|compare|detail|think)\b",
+    re.IGNORECASE,
+)
+WORD_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    {"a", "an", "and", "the", "of", "to", "in", "on", "for", "is", "are", "it"}
+)
+MAX_LOOKUP_SEGMENTS = 5
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """Convert a `[h:]mm:ss` timestamp into seconds.
+
+    Examples:
+        >>> parse_timestamp("12:30")
+        750.0
+        >>> parse_timestamp("1:02:03")
+        3723.0
+
+    Args:
+        timestamp: The timestamp to convert.
+
+    Returns:
+        The timestamp in seconds.
+    """
+    seconds = 0.0
+    for part in timestamp.split(":"):
+        seconds = seconds * 60 + int(part)
+
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    """Convert seconds into the `m:ss` format of the transcript element.
+
+    Examples:
+        >>> format_timestamp(750.4)
+        '12:30'
+
+    Args:
+        seconds: The time in seconds.
+
+    Returns:
+        The formatted timestamp.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def classify_query(question: str) -> tuple[str, str | None]:
+    """Classify a question into a direct lookup or a generation.
+
+    Only questions that are pure lookups, like "What was said at 12:30?", are
+    classified as such. Questions asking for reasons, explanations or summaries, or
+    about time ranges, are left to the LLM.
+
+    Args:
+        question: The question of the user.
+
+    Returns:
+        A tuple of the query type (`timestamp`, `topic` or `generate`) and the
+        extracted timestamp or topic, if any.
+    """
+    if GENERATION_QUERY_PATTERN.search(question) is not None:
+        return "generate", None
+
+    timestamp_match = TIMESTAMP_QUERY_PATTERN.match(question)
+    if timestamp_match is not None:
+        return "timestamp", timestamp_match.group("timestamp")
+
+    topic_match = TOPIC_QUERY_PATTERN.match(question)
+    if topic_match is not None:
+        return "topic", topic_match.group("topic")
+
+    return "generate", None
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into lowercase words without stopwords."""
+    return [
+        word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS
+    ]
+
+
+class SegmentIndex:
+    """Timestamp and keyword index over the transcript segments.
+
+    Args:
+        segments: The transcript segments with `id`, `start`, `end` and `text` keys.
+    """
+
+    def __init__(self, segments: list[dict]):
+        self.segments = sorted(segments, key=lambda segment: segment["start"])
+        self._starts = [segment["start"] for segment in self.segments]
+        self._postings: dict[str, set[int]] = defaultdict(set)
+
+        for position, segment in enumerate(self.segments):
+            for word in tokenize(segment["text"]):
+                self._postings[word].add(position)
+
+    def find_at(self, seconds: float) -> dict | None:
+        """Return the segment spoken at the given time.
+
+        Args:
+            seconds: The time in seconds.
+
+        Returns:
+            The segment containing the time, or the closest preceding one. None if the
+            time is before the first segment or after the end of the last one.
+        """
+        position = bisect.bisect_right(self._starts, seconds) - 1
+
+        if position < 0:
+            return None
+
+        segment = self.segments[position]
+
+        # NOTE: A time past the end of the episode falls through to generation
+        if position == len(self.segments) - 1 and seconds > segment["end"]:
+            return None
+
+        return segment
+
+    def search(self, query: str, limit: int = MAX_LOOKUP_SEGMENTS) -> list[dict]:
+        """Return the segments matching most words of the query.
+
+        Args:
+            query: The topic to look up.
+            limit: The maximum number of segments to return.
+
+        Returns:
+            The matching segments ordered by their start time.
+        """
+        match_counts: dict[int, int] = defaultdict(int)
+        for word in set(tokenize(query)):
+            for position in self._postings.get(word, ()):
+                match_counts[position] += 1
+
+        best_positions = sorted(
+            match_counts, key=lambda position: (-match_counts[position], position)
+        )[:limit]
+
+        return [self.segments[position] for position in sorted(best_positions)]
+
+
+def format_segment(segment: dict) -> str:
+    """Format a segment with its id and timestamp for the answer."""
+    return f"- [{format_timestamp(segment['start'])}] (segment {segment['id']}) {segment['text']}"
+
+
+def answer_lookup(
+    question: str, segment_index: SegmentIndex | None
+) -> tuple[str, list] | None:
+    """Answer a direct lookup question from the transcript segment index.
+
+    Args:
+        question: The question of the user.
+        segment_index: The segment index of the episode, if any.
+
+    Returns:
+        A tuple of the answer and the ids of the matched segments, or None if the
+        question needs generation.
+    """
+    query_type, value = classify_query(question)
+
+    if query_type == "generate" or segment_index is None:
+        return None
+
+    if query_type == "timestamp":
+        segment = segment_index.find_at(parse_timestamp(value))
+        if segment is None:
+            return None
+
+        return f"At {value} they say:\n{format_segment(segment)}", [segment["id"]]
+
+    matched_segments = segment_index.search(value)
+    if not matched_segments:
+        return None
+
+    lines = "\n".join(format_segment(segment) for segment in matched_segments)
+    answer = f"They talk about {value} at:\n{lines}"
+
+    return answer, [segment["id"] for segment in matched_segments]
+
+
+async def route_query(state: dict, config: RunnableConfig | None = None) -> dict:
+    """Answer direct lookup questions and route the rest to generation.
+
+    The segment index is taken from the transcript handle of the session, passed in
+    the `transcript` configurable. It is kept out of the graph state, so it is not
+    serialized into the traces.
+
+    Examples:
+        >>> state = {"messages": [HumanMessage("What was said at 0:05?")]}
+        >>> await route_query(state, {"configurable": {"transcript": handle}})
+        {'route': 'lookup', 'messages': [AIMessage(...)], 'segment_ids': [1]}
+
+    Args:
+        state: The graph state containing:
+            - messages: The conversation messages.
+        config: The runnable config, optionally containing the `TranscriptHandle` of
+            the session as the `transcript` configurable.
+
+    Returns:
+        A state update with the selected route and, for lookups, the answer and the
+        matched segment ids.
+    """
+    transcript = (config or {}).get("configurable", {}).get("transcript")
+    segment_index = transcript.segment_index if transcript is not None else None
+
+    question = state["messages"][-1].content
+    lookup = answer_lookup(question, segment_index)
+
+    if lookup is None:
+        return {"route": "generate", "segment_ids": []}
+
+    answer, segment_ids = lookup
+    logger.debug(f"Answered lookup question without the LLM: {question}")
+
+    return {
+        "route": "lookup",
+        "messages": [AIMessage(content=answer)],
+        "segment_ids": segment_ids,
+    }
+
+
+def select_route(state: dict) -> str:
+    """Select the next node based on the route of the router node."""
+    return state["route"]
@@ -1,3 +1,4 @@
+import asyncio
 from pathlib import Path
 from typing import BinaryIO
 
@@ -5,38 +6,72 @@ import chainlit as cl
 from chainlit.types import ThreadDict
 from chainlit.user import PersistedUser, User
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langfuse.langchain import CallbackHandler as LangfuseCallbackHandler
 from literalai.helper import utc_now
-from loguru import logger  # noqa: F401
+from loguru import logger
 
 from podflix.env_settings import env_settings
 from podflix.graph.podcast_rag import compiled_graph
+from podflix.graph.query_router import format_timestamp
+from podflix.utils.answer_cache import get_answer_cache, get_settings_fingerprint
+from podflix.utils.app_lifecycle import run_shutdown_tasks, run_startup_tasks
 from podflix.utils.chainlit_utils.auth_provider import register_auth_provider
 from podflix.utils.chainlit_utils.data_layer import (
     apply_sqlite_data_layer_fixes,
     get_read_url_of_file,
 )
 from podflix.utils.chainlit_utils.general import (
-    create_message_history_from_db_thread,
+    cancel_generation_task,
     get_current_chainlit_thread_id,
+    resume_user_session,
+    save_user_session,
     set_extra_user_session_params,
+    track_generation_task,
 )
-from podflix.utils.general import get_lf_trace_url
+from podflix.utils.chainlit_utils.search import format_search_results, search_index
+from podflix.utils.chainlit_utils.thread_stores import thread_transcript_store
+from podflix.utils.general import get_content_hash, get_lf_trace_url
 from podflix.utils.graph_runner import GraphRunner
+from podflix.utils.library_index import index_transcript
+from podflix.utils.metrics import TurnMetrics, observe_duration
 from podflix.utils.model import transcribe_audio_file
+from podflix.utils.tracing import create_tracing_handler
+from podflix.utils.transcript_store import TranscriptHandle, transcript_store
 from podflix.utils.youtube import fetch_youtube_transcription
 
 Chainlit_User_Type = User | PersistedUser
 
+# NOTE: Keep references to the background ingest tasks, so they are not garbage collected
+library_ingest_tasks: set[asyncio.Task] = set()
+
 if env_settings.enable_sqlite_data_layer is True:
     apply_sqlite_data_layer_fixes()
 
 register_auth_provider()
 
+# NOTE: Only used with `chainlit run`, the backend runs them in its own lifespan
+cl.on_app_startup(run_startup_tasks)
+cl.on_app_shutdown(run_shutdown_tasks)
+
+search_command = {
+    "id": "Search",
+    "icon": "search",
+    "description": "Search your past conversations and transcripts",
+    "button": False,
+}
+
+audio_commands = [
+    {
+        "id": "NoCache",
+        "icon": "refresh-cw",
+        "description": "Generate a fresh answer without using the answer cache",
+        "button": True,
+    },
+]
+
 
 @cl.set_chat_profiles
 async def chat_profile() -> list[cl.ChatProfile]:
-    return [
+    chat_profiles = [
         cl.ChatProfile(
             name="Local.Audio",
             markdown_description="Transcribe your own audio file",
@@ -49,6 +84,99 @@ async def chat_profile() -> list[cl.ChatProfile]:
         ),
     ]
 
+    if env_settings.enable_library_index is True:
+        chat_profiles.append(
+            cl.ChatProfile(
+                name="Library.Search",
+                markdown_description="Ask questions across all your transcribed episodes",
+                icon="https://picsum.photos/300",
+            )
+        )
+
+    return chat_profiles
+
+
+def set_transcript_session_params(
+    audio_text: str, segments: list[dict], episode_id: str
+) -> TranscriptHandle:
+    """Set a handle to the shared transcript of the episode into the user session."""
+    release_transcript()
+
+    transcript = transcript_store.acquire(
+        episode_id=episode_id, text=audio_text, segments=segments
+    )
+    cl.user_session.set("transcript", transcript)
+
+    return transcript
+
+
+def release_transcript() -> None:
+    """Release the transcript of the user session, if any."""
+    transcript: TranscriptHandle | None = cl.user_session.get("transcript")
+
+    if transcript is not None:
+        transcript.release()
+        cl.user_session.set("transcript", None)
+
+
+async def send_segment_links(
+    message: cl.Message, segment_ids: list, transcript: TranscriptHandle
+) -> None:
+    """Attach a link seeking the transcript player to each segment of the answer."""
+    segments = {segment["id"]: segment for segment in transcript.segments}
+
+    for segment_id in segment_ids:
+        segment = segments.get(segment_id)
+        if segment is None:
+            continue
+
+        action = cl.Action(
+            name="seek_segment",
+            payload={"segment_id": segment_id, "start": segment["start"]},
+            label=format_timestamp(segment["start"]),
+            tooltip="Play this part of the episode",
+            icon="play",
+        )
+        await action.send(for_id=message.id)
+
+
+async def search_past_conversations(query: str) -> None:
+    """Send the messages and transcripts of the user matching the query."""
+    results = await search_index.search(
+        query, user_identifier=cl.user_session.get("user").identifier
+    )
+
+    await cl.Message(content=format_search_results(results), author="Search").send()
+
+
+async def hydrate_transcript() -> None:
+    """Load the persisted transcript of a resumed thread into the user session."""
+    thread_id = get_current_chainlit_thread_id()
+    transcript = await thread_transcript_store.load(thread_id=thread_id)
+
+    if transcript is None:
+        logger.warning(f"No persisted transcript found for thread {thread_id}")
+        return
+
+    set_transcript_session_params(
+        audio_text=transcript["text"],
+        segments=transcript["segments"],
+        episode_id=transcript["episode_id"],
+    )
+
+
+def schedule_library_ingest(
+    segments: list[dict], episode_id: str, show: str, user_id: str
+) -> None:
+    """Add the transcript to the library index without blocking the chat."""
+    task = asyncio.create_task(
+        index_transcript(
+            segments=segments, episode_id=episode_id, show=show, user_id=user_id
+        )
+    )
+    library_ingest_tasks.add(task)
+    task.add_done_callback(library_ingest_tasks.discard)
+
 
 @cl.step(name="Transcribe Audio", type="tool")
 async def transcribing_tool(file: BinaryIO | Path):
@@ -56,9 +184,10 @@ async def transcribing_tool(file: BinaryIO | Path):
     step_message = cl.Message(content="")
     await step_message.stream_token("Transcribing the audio file...")
 
-    transcription = await transcribe_audio_file(
-        file=file, response_format="verbose_json"
-    )
+    with observe_duration("transcription_duration", source="local"):
+        transcription = await transcribe_audio_file(
+            file=file, response_format="verbose_json"
+        )
     whole_text = transcription.text
 
     # Format segments for the UI
@@ -78,7 +207,8 @@ async def transcribing_tool_yt(url: str):
     step_message = cl.Message(content="")
     await step_message.stream_token("Transcribing the youtube video...")
 
-    transcription = await fetch_youtube_transcription(video_url_or_id=url)
+    with observe_duration("transcription_duration", source="youtube"):
+        transcription = await fetch_youtube_transcription(video_url_or_id=url)
     whole_text = transcription.text
 
     # Format segments for the UI
@@ -93,8 +223,21 @@ async def transcribing_tool_yt(url: str):
 async def on_chat_start():
     set_extra_user_session_params()
 
+    commands = [search_command]
+    if env_settings.enable_answer_cache is True:
+        commands.extend(audio_commands)
+
+    await cl.context.emitter.set_commands(commands)
+
     chat_profile = cl.user_session.get("chat_profile")
 
+    if chat_profile == "Library.Search":
+        await cl.Message(
+            content="Ask a question about any episode in your library.",
+            author="System",
+        ).send()
+        return
+
     system_message = cl.Message(
         content=" ",
         author="System",
@@ -127,6 +270,7 @@ async def on_chat_start():
         thread_id = get_current_chainlit_thread_id()
         audio_url = await get_read_url_of_file(thread_id=thread_id, file_id=file.id)
         name = file.name
+        show = "Local Uploads"
         element_name = "AudioWithTranscript"
     elif chat_profile == "Youtube.Audio":
         # FIXME: Custom video element isn't persistent when using AskUserMessage
@@ -146,6 +290,7 @@ async def on_chat_start():
         audio_text, segments = await transcribing_tool_yt(url=url)
         audio_url = url
         name = url.split("v=")[-1]
+        show = "Youtube"
 
         element_name = "VideoWithTranscript"
     else:
@@ -155,7 +300,28 @@ async def on_chat_start():
         message="Audio transcribed successfully", type="info"
     )
 
-    cl.user_session.set("audio_text", audio_text)
+    # NOTE: Continue with the shared copy, a duplicate fresh copy is dropped
+    transcript = set_transcript_session_params(
+        audio_text=audio_text,
+        segments=segments,
+        episode_id=get_content_hash(audio_text),
+    )
+
+    await thread_transcript_store.save(
+        thread_id=get_current_chainlit_thread_id(),
+        episode_id=transcript.episode_id,
+        text=transcript.text,
+        segments=transcript.segments,
+        show=show,
+    )
+
+    if env_settings.enable_library_index is True:
+        schedule_library_ingest(
+            segments=transcript.segments,
+            episode_id=transcript.episode_id,
+            show=show,
+            user_id=cl.user_session.get("user").identifier,
+        )
 
     # Create an element with transcript and segments
     element = cl.CustomElement(
@@ -163,7 +329,7 @@ async def on_chat_start():
         props={
             "name": name,
             "url": audio_url,
-            "segments": segments,
+            "segments": transcript.segments,
         },
         display="side",
     )
@@ -173,27 +339,101 @@ async def on_chat_start():
 
     await system_message.send()
 
+    cl.user_session.set("transcript_element", element)
+
+
+@cl.action_callback("seek_segment")
+async def seek_segment(action: cl.Action):
+    """Seek the transcript player to the segment of a segment link."""
+    element: cl.CustomElement | None = cl.user_session.get("transcript_element")
+
+    if element is None:
+        return
+
+    element.props["seek"] = {"start": action.payload["start"], "actionId": action.id}
+    element.props["highlightedSegmentIds"] = [action.payload["segment_id"]]
+
+    # NOTE: The seek request is only meant for the UI, don't persist it
+    await element.send(for_id=element.for_id, persist=False)
+
 
 @cl.on_chat_resume
-def setup_chat_resume(thread: ThreadDict):
+async def setup_chat_resume(thread: ThreadDict):
     # thread["metadata"] = {}
-    message_history = create_message_history_from_db_thread(thread=thread)
+    await resume_user_session(thread=thread)
+
+    # NOTE: The transcript is loaded lazily when the first question arrives
+    cl.user_session.set("transcript_pending", True)
+
+
+@cl.on_chat_end
+def on_chat_end():
+    cancel_generation_task()
+    release_transcript()
+
+
+async def complete_answer(
+    graph_runner: GraphRunner,
+    assistant_message: cl.Message,
+    message_history: ChatMessageHistory,
+    transcript: TranscriptHandle | None,
+) -> None:
+    """Attach the traces and segment links to the answer and update the history."""
+    lf_traces_url = None
+    if graph_runner.trace_id is not None:
+        lf_traces_url = get_lf_trace_url(trace_id=graph_runner.trace_id)
+
+    if lf_traces_url is not None:
+        elements = [
+            cl.Text(
+                name="Detailed Traces",
+                content=f"[Detailed Logs]({lf_traces_url})",
+                display="inline",
+            )
+        ]
+        assistant_message.elements.extend(elements)
 
-    set_extra_user_session_params(
-        user_id=thread["userIdentifier"], message_history=message_history
-    )
+    await assistant_message.update()
 
-    # TODO: Set audio_text from the db
-    # cl.user_session.set("audio_text", audio_text)
+    # NOTE: Segment links need the player, which isn't restored in resumed chats
+    if cl.user_session.get("transcript_element") is not None:
+        await send_segment_links(
+            message=assistant_message,
+            segment_ids=(graph_runner.final_state or {}).get("segment_ids", []),
+            transcript=transcript,
+        )
+
+    if graph_runner.final_state is None:
+        message_history.add_ai_message(assistant_message.content)
+    else:
+        # NOTE: The graph keeps only a bounded window, older messages are in the summary
+        message_history.clear()
+        message_history.add_messages(graph_runner.final_state["messages"])
+        cl.user_session.set(
+            "conversation_summary", graph_runner.final_state.get("summary", "")
+        )
 
 
 @cl.on_message
 async def on_message(msg: cl.Message):
-    lf_cb_handler: LangfuseCallbackHandler = cl.user_session.get("lf_cb_handler")
+    if msg.command == "Search":
+        await search_past_conversations(query=msg.content)
+        return
+
+    track_generation_task()
+    turn_metrics = TurnMetrics(
+        model=env_settings.model_name, profile=cl.user_session.get("chat_profile")
+    )
+
+    if cl.user_session.get("transcript_pending") is True:
+        cl.user_session.set("transcript_pending", False)
+        await hydrate_transcript()
+
     session_id: str = cl.user_session.get("session_id")
     message_history: ChatMessageHistory = cl.user_session.get("message_history")
-    audio_text: str = cl.user_session.get("audio_text")
+    transcript: TranscriptHandle | None = cl.user_session.get("transcript")
     chainlit_user: Chainlit_User_Type = cl.user_session.get("user")
+    is_library_search = cl.user_session.get("chat_profile") == "Library.Search"
 
     message_history.add_user_message(msg.content)
 
@@ -204,31 +444,58 @@ async def on_message(msg: cl.Message):
         created_at=utc_now(),
     )
 
-    graph_inputs = {"messages": message_history.messages, "context": audio_text}
+    graph_inputs = {
+        "messages": message_history.messages,
+        "context": transcript.text if transcript is not None else "",
+        "summary": cl.user_session.get("conversation_summary", ""),
+    }
+
+    if is_library_search is True:
+        graph_inputs["context"] = ""
+        graph_inputs["scope"] = "library"
+        graph_inputs["library_filters"] = {"user_id": chainlit_user.identifier}
+
+    # NOTE: Only standalone questions are cached, follow-ups depend on the history
+    use_answer_cache = (
+        env_settings.enable_answer_cache is True
+        and msg.command != "NoCache"
+        and is_library_search is False
+        and len(message_history.messages) == 1
+    )
 
     graph_runner = GraphRunner(
         graph=compiled_graph,
         graph_inputs=graph_inputs,
         graph_streamable_node_names=["generate"],
-        lf_cb_handler=lf_cb_handler,
+        lf_cb_handler=create_tracing_handler(),
         user_id=chainlit_user.identifier,
         session_id=session_id,
         assistant_message=assistant_message,
+        answer_cache=get_answer_cache() if use_answer_cache else None,
+        answer_cache_episode_id=transcript.episode_id if transcript else None,
+        answer_cache_fingerprint=get_settings_fingerprint(
+            model_name=env_settings.model_name, graph="podcast_rag"
+        ),
+        turn_metrics=turn_metrics,
+        # NOTE: The router reads the segment index from the handle, not the state
+        graph_configurable={"transcript": transcript},
     )
 
-    await graph_runner.run_graph()
-
-    lf_traces_url = get_lf_trace_url(langchain_trace_id=graph_runner.run_id)
-
-    elements = [
-        cl.Text(
-            name="Detailed Traces",
-            content=f"[Detailed Logs]({lf_traces_url})",
-            display="inline",
+    try:
+        await graph_runner.run_graph()
+    except asyncio.CancelledError:
+        # NOTE: Keep the partial answer of a stopped generation
+        if assistant_message.content.strip():
+            message_history.add_ai_message(assistant_message.content)
+            await assistant_message.update()
+        raise
+    else:
+        await complete_answer(
+            graph_runner=graph_runner,
+            assistant_message=assistant_message,
+            message_history=message_history,
+            transcript=transcript,
         )
-    ]
-    assistant_message.elements.extend(elements)
-
-    await assistant_message.update()
-
-    message_history.add_ai_message(assistant_message.content)
+    finally:
+        # NOTE: Stopped turns are saved too, the resumed thread keeps their answer
+        await save_user_session()
@@ -1,18 +1,30 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import chainlit as cl
 from chainlit.context import init_http_context
 from chainlit.server import UserParam
 from chainlit.utils import mount_chainlit
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from loguru import logger
 from starlette.middleware.cors import CORSMiddleware
 
 from podflix.env_settings import env_settings
 from podflix.gui.fasthtml_ui.home import app as fasthtml_app
+from podflix.utils.app_lifecycle import run_shutdown_tasks, run_startup_tasks
+from podflix.utils.chainlit_utils.search import search_index
+from podflix.utils.metrics import get_metrics_payload
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_startup_tasks()
+    yield
+    await run_shutdown_tasks()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +40,23 @@ def home():
     return RedirectResponse(url="/home")
 
 
+@app.get("/metrics")
+def metrics():
+    payload, content_type = get_metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+
+@app.get("/search")
+async def search(
+    current_user: UserParam,
+    q: str = Query(min_length=1),
+    limit: int = Query(default=10, ge=1, le=50),
+):
+    return await search_index.search(
+        q, user_identifier=current_user.identifier, limit=limit
+    )
+
+
 @app.get("/chainlit-message-test")
 async def chainlit_message_send(
     request: Request,
@@ -1,3 +1,4 @@
+import asyncio
 import time
 from typing import AsyncIterator
 
@@ -11,13 +12,27 @@ from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionChunk
 
 from podflix.env_settings import env_settings
+from podflix.utils.app_lifecycle import run_shutdown_tasks, run_startup_tasks
 from podflix.utils.chainlit_utils.auth_provider import register_auth_provider
 from podflix.utils.chainlit_utils.data_layer import apply_sqlite_data_layer_fixes
 from podflix.utils.chainlit_utils.general import (
-    create_message_history_from_db_thread,
+    cancel_generation_task,
+    resume_user_session,
+    save_user_session,
     set_extra_user_session_params,
+    track_generation_task,
 )
 from podflix.utils.chainlit_utils.setting_widgets import get_openai_chat_settings
+from podflix.utils.chainlit_utils.token_coalescer import TokenCoalescer
+from podflix.utils.completion_cache import (
+    CompletionReplayStream,
+    get_completion_cache,
+    get_completion_cache_key,
+    is_deterministic_request,
+    record_completion_chunks,
+)
+from podflix.utils.load_balancer import get_load_balanced_http_client
+from podflix.utils.metrics import TurnMetrics
 from podflix.utils.pydantic_models import OpenAIChatGenerationSettings
 
 if env_settings.enable_sqlite_data_layer is True:
@@ -25,9 +40,14 @@ if env_settings.enable_sqlite_data_layer is True:
 
 register_auth_provider()
 
+# NOTE: Only used with `chainlit run`, the backend runs them in its own lifespan
+cl.on_app_startup(run_startup_tasks)
+cl.on_app_shutdown(run_shutdown_tasks)
+
 async_openai_client = AsyncOpenAI(
     base_url=f"{env_settings.model_api_base}/v1",
     api_key=env_settings.openai_api_key,
+    http_client=get_load_balanced_http_client("model"),
 )
 
 
@@ -70,59 +90,79 @@ async def on_chat_start() -> None:
 
 @cl.on_chat_resume
 async def setup_chat_resume(thread: ThreadDict) -> None:
-    message_history = create_message_history_from_db_thread(thread=thread)
-
-    set_extra_user_session_params(
-        user_id=thread["userIdentifier"], message_history=message_history
-    )
+    await resume_user_session(thread=thread)
 
+    # NOTE: Restored settings are plain field values
     chat_settings = get_openai_chat_settings()
-    cl.user_session.set("settings", OpenAIChatGenerationSettings())
+    cl.user_session.set(
+        "settings",
+        OpenAIChatGenerationSettings(**(cl.user_session.get("settings") or {})),
+    )
 
     await chat_settings.send()
 
 
 async def stream_tokens(
-    stream: AsyncIterator[ChatCompletionChunk], assistant_message: cl.Message
+    stream: AsyncIterator[ChatCompletionChunk],
+    assistant_message: cl.Message,
+    turn_metrics: TurnMetrics,
 ) -> None:
-    async for chunk in stream:
-        if token := chunk.choices[0].delta.content or "":
-            await assistant_message.stream_token(token)
+    async with TokenCoalescer(assistant_message) as coalescer:
+        async for chunk in stream:
+            if token := chunk.choices[0].delta.content or "":
+                turn_metrics.mark_token()
+                await coalescer.add(token)
 
 
 async def handle_thinking_step(
     stream: AsyncIterator[ChatCompletionChunk],
     assistant_message: cl.Message,
     start_time: float,
+    turn_metrics: TurnMetrics,
 ) -> None:
     thinking = False
 
-    async with cl.Step(name="Thinking") as thinking_step:
+    async with (
+        cl.Step(name="Thinking") as thinking_step,
+        TokenCoalescer(thinking_step) as thinking_coalescer,
+        TokenCoalescer(assistant_message) as answer_coalescer,
+    ):
         async for chunk in stream:
             delta = chunk.choices[0].delta
 
             if not delta.content:
                 continue
 
+            turn_metrics.mark_token()
+
             if delta.content == "<think>":
                 thinking = True
                 continue
 
             if delta.content == "</think>":
                 thinking = False
+                await thinking_coalescer.flush()
                 thought_for = round(time.time() - start_time)
                 thinking_step.name = f"Thought for {thought_for}s"
                 await thinking_step.update()
                 continue
 
             if thinking:
-                await thinking_step.stream_token(delta.content)
+                await thinking_coalescer.add(delta.content)
             else:
-                await assistant_message.stream_token(delta.content)
+                await answer_coalescer.add(delta.content)
+
+
+@cl.on_chat_end
+def on_chat_end() -> None:
+    cancel_generation_task()
 
 
 @cl.on_message
 async def on_message(msg: cl.Message) -> None:
+    track_generation_task()
+    turn_metrics = TurnMetrics(model=env_settings.model_name, profile="base_chat")
+
     message_history: ChatMessageHistory = cl.user_session.get("message_history")
     settings: OpenAIChatGenerationSettings = cl.user_session.get("settings")
 
@@ -146,24 +186,72 @@ async def on_message(msg: cl.Message) -> None:
         message_history.messages
     )
 
-    stream = await async_openai_client.chat.completions.create(
-        messages=messages_openai,
-        stream=True,
-        response_format={"type": settings.response_format},
-        **settings.model_dump(exclude={"response_format"}),
-    )
+    completion_cache_key = None
+    cached_chunks = None
+    if env_settings.enable_completion_cache is True and is_deterministic_request(
+        settings
+    ):
+        completion_cache_key = get_completion_cache_key(messages_openai, settings)
+        cached_chunks = get_completion_cache().lookup(completion_cache_key)
+
+    if cached_chunks is not None:
+        stream = CompletionReplayStream(chunks=cached_chunks, model=settings.model)
+    else:
+        stream = await async_openai_client.chat.completions.create(
+            messages=messages_openai,
+            stream=True,
+            response_format={"type": settings.response_format},
+            **settings.model_dump(exclude={"response_format"}),
+        )
+
+    recorded_chunks: list[str] = []
+    stream_chunks = stream
+    if completion_cache_key is not None and cached_chunks is None:
+        stream_chunks = record_completion_chunks(stream, recorded_chunks)
 
     start = time.time()
 
     # TODO: Add more robust check your thinking models
     use_thinking = "R1" in env_settings.model_name
 
-    if use_thinking is True:
-        await handle_thinking_step(
-            stream=stream, assistant_message=assistant_message, start_time=start
-        )
+    status = "success"
+
+    try:
+        # NOTE: Closing the stream aborts the upstream request when cancelled
+        async with stream:
+            if use_thinking is True:
+                await handle_thinking_step(
+                    stream=stream_chunks,
+                    assistant_message=assistant_message,
+                    start_time=start,
+                    turn_metrics=turn_metrics,
+                )
+            else:
+                await stream_tokens(
+                    stream=stream_chunks,
+                    assistant_message=assistant_message,
+                    turn_metrics=turn_metrics,
+                )
+    except asyncio.CancelledError:
+        status = "cancelled"
+
+        # NOTE: Keep the partial answer of a stopped generation
+        if assistant_message.content:
+            message_history.add_ai_message(assistant_message.content)
+            await assistant_message.send()
+        raise
+    except Exception:
+        status = "error"
+        raise
     else:
-        await stream_tokens(stream=stream, assistant_message=assistant_message)
+        # NOTE: Only completed answers are cached, never stopped or failed ones
+        if recorded_chunks:
+            get_completion_cache().store(completion_cache_key, recorded_chunks)
+
+        message_history.add_ai_message(assistant_message.content)
+        await assistant_message.send()
+    finally:
+        turn_metrics.finish(status=status)
 
-    message_history.add_ai_message(assistant_message.content)
-    await assistant_message.send()
+        # NOTE: Stopped turns are saved too, the resumed thread keeps their answer
+        await save_user_session()
@@ -4,20 +4,22 @@ import chainlit as cl
 from chainlit.types import ThreadDict
 from chainlit.user import PersistedUser, User
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langfuse.langchain import CallbackHandler as LangfuseCallbackHandler
 from literalai.helper import utc_now
 from loguru import logger
 
 from podflix.env_settings import env_settings
 from podflix.graph.mock import compiled_graph
+from podflix.utils.app_lifecycle import run_shutdown_tasks, run_startup_tasks
 from podflix.utils.chainlit_utils.auth_provider import register_auth_provider
 from podflix.utils.chainlit_utils.data_layer import apply_sqlite_data_layer_fixes
 from podflix.utils.chainlit_utils.general import (
-    create_message_history_from_db_thread,
+    resume_user_session,
+    save_user_session,
     set_extra_user_session_params,
 )
 from podflix.utils.general import get_lf_trace_url
 from podflix.utils.graph_runner import GraphRunner
+from podflix.utils.tracing import create_tracing_handler
 
 Chainlit_User_Type = User | PersistedUser
 
@@ -26,6 +28,10 @@ if env_settings.enable_sqlite_data_layer is True:
 
 register_auth_provider()
 
+# NOTE: Only used with `chainlit run`, the backend runs them in its own lifespan
+cl.on_app_startup(run_startup_tasks)
+cl.on_app_shutdown(run_shutdown_tasks)
+
 
 @cl.set_starters
 async def set_starters() -> list[cl.Starter]:
@@ -118,17 +124,12 @@ async def on_chat_start():
 
 
 @cl.on_chat_resume
-def setup_chat_resume(thread: ThreadDict):
-    message_history = create_message_history_from_db_thread(thread=thread)
-
-    set_extra_user_session_params(
-        user_id=thread["userIdentifier"], message_history=message_history
-    )
+async def setup_chat_resume(thread: ThreadDict):
+    await resume_user_session(thread=thread)
 
 
 @cl.on_message
 async def on_message(msg: cl.Message):
-    lf_cb_handler: LangfuseCallbackHandler = cl.user_session.get("lf_cb_handler")
     session_id: str = cl.user_session.get("session_id")
     message_history: ChatMessageHistory = cl.user_session.get("message_history")
     chainlit_user: Chainlit_User_Type = cl.user_session.get("user")
@@ -154,7 +155,7 @@ async def on_message(msg: cl.Message):
         graph=compiled_graph,
         graph_inputs=graph_inputs,
         graph_streamable_node_names=["mock_answer"],
-        lf_cb_handler=lf_cb_handler,
+        lf_cb_handler=create_tracing_handler(),
         user_id=chainlit_user.identifier,
         session_id=session_id,
         assistant_message=assistant_message,
@@ -171,23 +172,28 @@ async def on_message(msg: cl.Message):
     ]
     assistant_message.elements.extend(elements)
 
-    lf_traces_url = get_lf_trace_url(langchain_trace_id=graph_runner.run_id)
+    lf_traces_url = None
+    if graph_runner.trace_id is not None:
+        lf_traces_url = get_lf_trace_url(trace_id=graph_runner.trace_id)
 
     logger.debug(f"Langfuse traces URL: {lf_traces_url}")
 
-    actions = [
-        cl.Action(
-            name="detailed_traces_button",
-            payload={"lf_traces_url": lf_traces_url},
-            label="Detailed Traces",
-            tooltip="Detailed Logs in Langfuse",
-        )
-    ]
+    if lf_traces_url is not None:
+        actions = [
+            cl.Action(
+                name="detailed_traces_button",
+                payload={"lf_traces_url": lf_traces_url},
+                label="Detailed Traces",
+                tooltip="Detailed Logs in Langfuse",
+            )
+        ]
 
-    assistant_message.actions.extend(actions)
+        assistant_message.actions.extend(actions)
 
     assistant_message.content += " DUMMY_ELEMENT_NAME"
     await assistant_message.update()
 
     message_history.add_user_message(msg.content)
     message_history.add_ai_message(assistant_message.content)
+
+    await save_user_session()
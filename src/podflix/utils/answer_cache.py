@@ -0,0 +1,239 @@
+"""Semantic answer cache for repeated questions about the same episode.
+
+Answers are stored per episode together with the embedding of the question that
+produced them. A later question about the same episode is served from the cache
+when its embedding is similar enough and the model/settings fingerprint matches.
+
+Examples:
+    >>> cache = SemanticAnswerCache(similarity_threshold=0.9)
+    >>> cache.store("episode", "What is RAG?", [1.0, 0.0], "An answer", "fp")
+    >>> cache.lookup("episode", [0.99, 0.01], "fp").answer
+    'An answer'
+
+The module contains the following:
+
+- `CachedAnswer` - A single cached answer entry.
+- `SemanticAnswerCache` - LRU and TTL bounded semantic cache.
+- `get_settings_fingerprint(**settings)` - Returns a fingerprint of the generation settings.
+- `get_answer_cache()` - Returns the process wide answer cache.
+"""
+
+import json
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cache
+
+from langchain_core.embeddings import Embeddings
+
+from podflix.env_settings import env_settings
+from podflix.utils.general import get_content_hash
+from podflix.utils.model import get_embedding_model
+
+
+@dataclass
+class CachedAnswer:
+    """A cached answer together with the question embedding it belongs to."""
+
+    question: str
+    embedding: list[float]
+    answer: str
+    fingerprint: str
+    created_at: float
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    """Compute the cosine similarity of two vectors.
+
+    Examples:
+        >>> cosine_similarity([1.0, 0.0], [1.0, 0.0])
+        1.0
+        >>> cosine_similarity([1.0, 0.0], [0.0, 1.0])
+        0.0
+
+    Args:
+        a: The first vector.
+        b: The second vector.
+
+    Returns:
+        The cosine similarity, 0.0 if one of the vectors has zero length.
+    """
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+
+    if norm == 0:
+        return 0.0
+
+    return sum(x * y for x, y in zip(a, b, strict=False)) / norm
+
+
+def get_settings_fingerprint(**settings) -> str:
+    """Build a fingerprint of the model and generation settings.
+
+    Examples:
+        >>> get_settings_fingerprint(model="a") == get_settings_fingerprint(model="a")
+        True
+        >>> get_settings_fingerprint(model="a") == get_settings_fingerprint(model="b")
+        False
+
+    Args:
+        **settings: Settings that influence the generated answer.
+
+    Returns:
+        A short hash of the settings.
+    """
+    return get_content_hash(json.dumps(settings, sort_keys=True, default=str))[:16]
+
+
+class SemanticAnswerCache:
+    """Cache answers per episode and serve them for semantically similar questions.
+
+    Entries expire after `ttl` seconds and the least recently used entry is evicted
+    once `max_entries` is reached.
+
+    Args:
+        embedding_model: The model used to embed questions. Only needed for `aembed`.
+        similarity_threshold: Minimum cosine similarity for a cache hit.
+        ttl: Number of seconds an entry stays valid.
+        max_entries: Maximum number of entries over all episodes.
+    """
+
+    def __init__(
+        self,
+        embedding_model: Embeddings | None = None,
+        similarity_threshold: float = 0.95,
+        ttl: int = 3600,
+        max_entries: int = 1024,
+    ):
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries: OrderedDict[tuple[str, str], CachedAnswer] = OrderedDict()
+        self._episode_keys: dict[str, set[tuple[str, str]]] = {}
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._entries)
+
+    async def aembed(self, question: str) -> list[float]:
+        """Embed the question with the configured embedding model.
+
+        Args:
+            question: The question to embed.
+
+        Returns:
+            The embedding of the question.
+
+        Raises:
+            ValueError: If no embedding model is configured.
+        """
+        if self.embedding_model is None:
+            raise ValueError("Embedding model is not set for the answer cache.")
+
+        return await self.embedding_model.aembed_query(question)
+
+    def lookup(
+        self, episode_id: str, embedding: list[float], fingerprint: str
+    ) -> CachedAnswer | None:
+        """Return the most similar cached answer of the episode if it is a hit.
+
+        Args:
+            episode_id: The identifier of the episode the question is about.
+            embedding: The embedding of the question.
+            fingerprint: The fingerprint of the current model/settings.
+
+        Returns:
+            The cached answer if one passes the similarity threshold, None otherwise.
+        """
+        self._evict_expired()
+
+        best_key, best_score = None, self.similarity_threshold
+
+        for key in self._episode_keys.get(episode_id, ()):
+            entry = self._entries[key]
+
+            if entry.fingerprint != fingerprint:
+                continue
+
+            score = cosine_similarity(embedding, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+
+        self._entries.move_to_end(best_key)
+
+        return self._entries[best_key]
+
+    def store(
+        self,
+        episode_id: str,
+        question: str,
+        embedding: list[float],
+        answer: str,
+        fingerprint: str,
+    ) -> None:
+        """Store an answer for the episode.
+
+        Args:
+            episode_id: The identifier of the episode the question is about.
+            question: The question that was answered.
+            embedding: The embedding of the question.
+            answer: The generated answer.
+            fingerprint: The fingerprint of the model/settings used for the answer.
+        """
+        key = (episode_id, get_content_hash(f"{fingerprint}:{question.strip()}"))
+
+        self._entries[key] = CachedAnswer(
+            question=question,
+            embedding=embedding,
+            answer=answer,
+            fingerprint=fingerprint,
+            created_at=time.monotonic(),
+        )
+        self._entries.move_to_end(key)
+        self._episode_keys.setdefault(episode_id, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self._entries.clear()
+        self._episode_keys.clear()
+
+    def _evict_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl
+
+        expired_keys = [
+            key for key, entry in self._entries.items() if entry.created_at < deadline
+        ]
+        for key in expired_keys:
+            self._remove(key)
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        del self._entries[key]
+
+        episode_keys = self._episode_keys[key[0]]
+        episode_keys.discard(key)
+
+        if not episode_keys:
+            del self._episode_keys[key[0]]
+
+
+@cache
+def get_answer_cache() -> SemanticAnswerCache:
+    """Return the process wide answer cache configured from the environment.
+
+    Returns:
+        The shared SemanticAnswerCache instance.
+    """
+    return SemanticAnswerCache(
+        embedding_model=get_embedding_model(),
+        similarity_threshold=env_settings.answer_cache_similarity_threshold,
+        ttl=env_settings.answer_cache_ttl,
+        max_entries=env_settings.answer_cache_max_entries,
+    )
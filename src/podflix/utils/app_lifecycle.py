@@ -0,0 +1,69 @@
+"""Startup and shutdown tasks of the application.
+
+The tasks are run from the lifespan of the FastAPI backend and, when a Chainlit app
+is started directly with `chainlit run`, from the Chainlit app startup hooks.
+"""
+
+import asyncio
+
+from loguru import logger
+
+from podflix.db.engine_registry import engine_registry
+from podflix.db.maintenance import maintenance_job
+from podflix.env_settings import env_settings
+from podflix.utils.chainlit_utils.write_behind import flush_data_layer
+from podflix.utils.langfuse_metadata import langfuse_metadata
+from podflix.utils.library_index import aget_library_index, flush_library_index
+from podflix.utils.load_balancer import start_health_checks, stop_health_checks
+from podflix.utils.pipeline_registry import warmup_model_backends
+from podflix.utils.tracing import trace_buffer
+
+
+async def run_startup_tasks() -> None:
+    """Run the tasks needed before the application serves the first user.
+
+    Returns:
+        None
+    """
+    logger.debug("Running application startup tasks")
+
+    start_health_checks()
+
+    # NOTE: Verify the Langfuse credentials once, sessions use the cached metadata
+    await langfuse_metadata.arefresh()
+    langfuse_metadata.start()
+
+    if env_settings.enable_maintenance_job is True:
+        maintenance_job.start()
+
+    # NOTE: Loading the shards reads the whole library, keep it off the event loop
+    if env_settings.enable_library_index is True:
+        await aget_library_index()
+
+    if env_settings.enable_model_warmup is True:
+        await warmup_model_backends()
+
+
+async def run_shutdown_tasks() -> None:
+    """Run the tasks needed before the application exits.
+
+    Returns:
+        None
+    """
+    logger.debug("Running application shutdown tasks")
+
+    stop_health_checks()
+    langfuse_metadata.stop()
+    maintenance_job.stop()
+
+    # NOTE: Send the buffered traces without holding the shutdown for long
+    if await asyncio.to_thread(trace_buffer.flush) is False:
+        logger.warning(f"Dropping {len(trace_buffer)} buffered traces on shutdown")
+
+    await asyncio.to_thread(flush_library_index)
+
+    # NOTE: The buffered step writes need the engines, no flush follows this one
+    try:
+        await flush_data_layer(raise_on_error=True)
+    finally:
+        await engine_registry.dispose()
@@ -1,24 +1,26 @@
 """Utility functions for working with ChainLit data layer.
 
 This module provides utility functions for configuring and working with ChainLit's data layer,
-including S3 storage integration and SQLAlchemy database connections.
+including S3 storage integration and SQLAlchemy database connections. The stores of the
+thread transcripts and messages are in `podflix.utils.chainlit_utils.thread_stores`.
 """
 
 import os
-import json
-import sqlite3
 
 import boto3
 import chainlit as cl
-import chainlit.socket
 from chainlit.data import get_data_layer
 from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
 from chainlit.data.storage_clients.s3 import S3StorageClient
 from chainlit.element import ElementDict
 from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
 
 from podflix.db.db_factory import DBInterfaceFactory
+from podflix.db.engine_registry import engine_registry
 from podflix.env_settings import env_settings
+from podflix.utils.chainlit_utils.write_behind import WriteBehindDataLayer
 
 
 def get_s3_storage_client() -> S3StorageClient:
@@ -91,7 +93,7 @@ def get_custom_sqlalchemy_data_layer(
     """Create and configure a custom SQLAlchemy data layer instance.
 
     This function sets up a SQLAlchemy data layer with optional S3 storage integration
-    and logging capabilities.
+    and logging capabilities. The step writes are coalesced by `WriteBehindDataLayer`.
 
     Examples:
         >>> data_layer = get_custom_sqlalchemy_data_layer()
@@ -119,14 +121,26 @@ def get_custom_sqlalchemy_data_layer(
     else:
         storage_client = None
 
-    return SQLAlchemyDataLayer(
-        DBInterfaceFactory.create().async_connection(),
+    db_interface = DBInterfaceFactory.create()
+    async_engine = engine_registry.get_async_engine(db_interface)
+
+    data_layer = WriteBehindDataLayer(
+        db_interface.async_connection(),
+        write_behind_ms=env_settings.data_layer_write_behind_ms,
         ssl_require=False,
         show_logger=show_logger,
         storage_provider=storage_client,
         # create_tables=True,
     )
 
+    # NOTE: Share the tuned engine of the process instead of the default one of Chainlit
+    data_layer.engine = async_engine
+    data_layer.async_session = sessionmaker(
+        bind=async_engine, expire_on_commit=False, class_=AsyncSession
+    )
+
+    return data_layer
+
 
 async def get_element_url(
     data_layer: SQLAlchemyDataLayer, thread_id: str, element_id: str
@@ -188,7 +202,6 @@ async def get_read_url_of_file(thread_id: str, file_id: str) -> str:
     return await cl_data_layer.storage_client.get_read_url(object_key=object_key)
 
 
-# ruff: noqa
 def apply_sqlite_data_layer_fixes():
     """Apply necessary fixes for SQLite data layer configuration.
 
@@ -204,10 +217,9 @@ def apply_sqlite_data_layer_fixes():
     if env_settings.enable_sqlite_data_layer is False:
         return
 
-    # From https://github.com/Chainlit/chainlit/issues/2528#issuecomment-3436664107
-    sqlite3.register_adapter(list, lambda lst: json.dumps(lst))
-    sqlite3.register_adapter(dict, lambda dct: json.dumps(dct))
-
+    # NOTE: Lists and dicts are bound as JSON by `SQLiteDBInterface`, see
+    # https://github.com/Chainlit/chainlit/issues/2528#issuecomment-3436664107
     @cl.data_layer
     def data_layer():
-        return get_custom_sqlalchemy_data_layer(show_logger=True)
+        # NOTE: Statements are instrumented by the engine, see `podflix.db.query_metrics`
+        return get_custom_sqlalchemy_data_layer()
@@ -1,15 +1,48 @@
 """Utilies for chainlit UI."""
 
+import asyncio
 from uuid import uuid4
 
 import chainlit as cl
 from chainlit.types import ThreadDict
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langfuse.langchain import CallbackHandler as LangfuseCallbackHandler
+from langchain_core.messages.utils import count_tokens_approximately
 from loguru import logger
 
 from podflix.env_settings import env_settings
-from podflix.utils.general import check_lf_credentials, get_lf_session_url
+from podflix.utils.chainlit_utils.session_state import session_state_store
+from podflix.utils.chainlit_utils.thread_stores import thread_history_store
+from podflix.utils.chainlit_utils.write_behind import flush_data_layer
+from podflix.utils.general import get_lf_session_url
+
+
+def create_message_history_from_steps(steps: list[dict]) -> ChatMessageHistory:
+    """Create message history from user and assistant steps in chronological order.
+
+    Examples:
+        >>> history = create_message_history_from_steps(
+        ...     [{"type": "user_message", "output": "hello"}]
+        ... )
+        >>> len(history.messages)
+        1
+
+    Args:
+        steps: The user and assistant steps, oldest first.
+
+    Returns:
+        A ChatMessageHistory object containing the messages of the steps.
+    """
+    message_history = ChatMessageHistory()
+
+    for step in steps:
+        if step["type"] == "user_message":
+            message_history.add_user_message(step["output"])
+        elif step["type"] == "assistant_message":
+            message_history.add_ai_message(step["output"])
+        else:
+            logger.warning(f"Unknown message type: {step['type']}")
+
+    return message_history
 
 
 def create_message_history_from_db_thread(
@@ -29,8 +62,6 @@ def create_message_history_from_db_thread(
     Returns:
         A ChatMessageHistory object containing the processed message history.
     """
-    message_history = ChatMessageHistory()
-
     # TODO: This is a workaround to sort the messages based on createdAt.
     steps_messages = sorted(
         [
@@ -41,15 +72,120 @@ def create_message_history_from_db_thread(
         key=lambda x: x["createdAt"],
     )
 
-    for steps_message in steps_messages:
-        if steps_message["type"] == "user_message":
-            message_history.add_user_message(steps_message["output"])
-        elif steps_message["type"] == "assistant_message":
-            message_history.add_ai_message(steps_message["output"])
-        else:
-            logger.warning(f"Unknown message type: {steps_message['type']}")
+    return create_message_history_from_steps(steps_messages)
+
+
+async def load_thread_message_history(
+    thread: ThreadDict, limit: int | None = None
+) -> ChatMessageHistory:
+    """Load the most recent messages of a resumed thread.
+
+    The messages are fetched page by page from the data layer, ordered in SQL, so
+    resuming a long thread doesn't sort its whole history. The cursor of the older
+    messages is kept in the user session for `load_older_message_history`.
+
+    Examples:
+        >>> history = await load_thread_message_history(thread, limit=2)
+        >>> len(history.messages)
+        2
+
+    Args:
+        thread: The resumed thread.
+        limit: The maximum number of loaded messages. Defaults to
+            `RESUME_HISTORY_MAX_MESSAGES`.
+
+    Returns:
+        A ChatMessageHistory object containing the most recent messages.
+    """
+    if limit is None:
+        limit = env_settings.resume_history_max_messages
+
+    page = await thread_history_store.load_page(thread_id=thread["id"], limit=limit)
+
+    if page is None:
+        # NOTE: Without a data layer, fall back to the steps of the thread
+        message_history = create_message_history_from_db_thread(thread=thread)
+        message_history.messages = message_history.messages[-limit:]
+        cl.user_session.set("message_history_cursor", None)
+
+        return message_history
+
+    cl.user_session.set("message_history_cursor", page.cursor)
+
+    return create_message_history_from_steps(page.steps)
+
+
+async def load_older_message_history(limit: int | None = None) -> int:
+    """Prepend the previous page of messages to the message history of the session.
+
+    Examples:
+        >>> await load_older_message_history(limit=20)
+        20
+
+    Args:
+        limit: The maximum number of loaded messages. Defaults to
+            `RESUME_HISTORY_MAX_MESSAGES`.
+
+    Returns:
+        The number of loaded messages, 0 if there are no older messages.
+    """
+    cursor = cl.user_session.get("message_history_cursor")
+
+    if cursor is None:
+        return 0
+
+    if limit is None:
+        limit = env_settings.resume_history_max_messages
+
+    page = await thread_history_store.load_page(
+        thread_id=get_current_chainlit_thread_id(), limit=limit, before=cursor
+    )
+
+    if page is None:
+        return 0
+
+    message_history: ChatMessageHistory = cl.user_session.get("message_history")
+    older_messages = create_message_history_from_steps(page.steps).messages
+    message_history.messages = older_messages + message_history.messages
+
+    cl.user_session.set("message_history_cursor", page.cursor)
+
+    return len(older_messages)
 
-    return message_history
+
+async def fill_message_history_window(max_tokens: int | None = None) -> int:
+    """Load older messages of the session until they fill the memory window.
+
+    A resumed thread only loads its most recent messages. When they are short, they
+    leave part of the memory window unused, so older pages are loaded until the
+    history reaches the token budget or the thread has no older messages.
+
+    Examples:
+        >>> await fill_message_history_window(max_tokens=1500)
+        12
+
+    Args:
+        max_tokens: The approximate token budget. Defaults to
+            `MEMORY_WINDOW_MAX_TOKENS`.
+
+    Returns:
+        The number of loaded older messages.
+    """
+    if max_tokens is None:
+        max_tokens = env_settings.memory_window_max_tokens
+
+    message_history: ChatMessageHistory = cl.user_session.get("message_history")
+    loaded_messages = 0
+
+    while count_tokens_approximately(message_history.messages) < max_tokens:
+        older_messages = await load_older_message_history()
+
+        if older_messages == 0:
+            break
+
+        loaded_messages += older_messages
+
+    return loaded_messages
 
 
 def set_extra_user_session_params(
@@ -78,13 +214,10 @@ def set_extra_user_session_params(
     if message_history is None:
         message_history = ChatMessageHistory()
 
-    check_lf_credentials()
-    lf_cb_handler = LangfuseCallbackHandler()
-
     cl.user_session.set("session_id", session_id)
-    cl.user_session.set("lf_cb_handler", lf_cb_handler)
     cl.user_session.set("message_history", message_history)
 
+    # NOTE: Built from the cached project id, without a Langfuse round-trip
     langfuse_session_url = get_lf_session_url(session_id=session_id)
 
     logger.debug(f"Langfuse Session URL: {langfuse_session_url}")
@@ -95,6 +228,97 @@ def get_current_chainlit_thread_id() -> str:
     return cl.context.session.thread_id
 
 
+async def resume_user_session(thread: ThreadDict) -> None:
+    """Set up the user session of a resumed thread.
+
+    The saved session state of the thread is restored if there is one, e.g. when the
+    thread was started on another worker. Otherwise, the message history is rebuilt
+    from the data layer, with as many older messages as fit into the memory window.
+
+    Examples:
+        >>> await resume_user_session(thread)
+        >>> cl.user_session.get("message_history") is not None
+        True
+
+    Args:
+        thread: The resumed thread.
+    """
+    if await session_state_store.restore(thread_id=thread["id"]) is True:
+        return
+
+    message_history = await load_thread_message_history(thread=thread)
+
+    set_extra_user_session_params(
+        user_id=thread["userIdentifier"], message_history=message_history
+    )
+
+    # NOTE: Older messages are only loaded while the memory window has room for them
+    await fill_message_history_window()
+
+
+async def save_user_session() -> None:
+    """Persist the end of a turn, so any worker can resume its thread.
+
+    The step writes buffered during the turn are written, and the state of the user
+    session is saved.
+    """
+    await flush_data_layer()
+    await session_state_store.save(thread_id=get_current_chainlit_thread_id())
+
+
+def track_generation_task() -> None:
+    """Track the current task as the generation of the session.
+
+    A previous generation that is still running is cancelled, since its answer won't be
+    read once the user sends a new message.
+
+    Returns:
+        None
+    """
+    previous_task: asyncio.Task | None = cl.user_session.get("generation_task")
+    current_task = asyncio.current_task()
+
+    if previous_task is not None and previous_task is not current_task:
+        previous_task.cancel()
+
+    cl.user_session.set("generation_task", current_task)
+
+
+def cancel_generation_task() -> None:
+    """Cancel the running generation of the session, e.g. when the user disconnects.
+
+    Returns:
+        None
+    """
+    generation_task: asyncio.Task | None = cl.user_session.get("generation_task")
+
+    if generation_task is not None and not generation_task.done():
+        logger.debug("Cancelling the running generation of the session")
+        generation_task.cancel()
+
+
+def get_pending_websocket_packets() -> int:
+    """Return the number of packets waiting to be written to the session websocket.
+
+    Returns:
+        The size of the websocket write queue, or 0 if it isn't available, e.g.
+        outside of a websocket session.
+    """
+    try:
+        socket_id = cl.context.session.socket_id
+    except Exception:
+        return 0
+
+    # NOTE: Imported lazily, since importing the Chainlit server builds the whole app
+    from chainlit.server import sio  # noqa: PLC0415
+
+    try:
+        eio_sid = sio.manager.eio_sid_from_sid(socket_id, "/")
+        return sio.eio.sockets[eio_sid].queue.qsize()
+    except (AttributeError, KeyError):
+        return 0
+
+
 async def set_mock_elements():
     """Set mock elements for the sidebar."""
     sidebar_mock_elements = [
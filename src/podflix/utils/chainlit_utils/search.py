@@ -0,0 +1,232 @@
+"""Full-text search over the past conversations and transcripts of a user.
+
+The search index is created by the `search_index` migration: FTS5 tables on SQLite and
+`tsvector` columns with GIN indexes on Postgres. Steps are indexed by database
+triggers as the data layer writes them, transcripts by `ThreadTranscriptStore` through
+`SearchIndex.index_transcript`. Queries only touch the index and the matching rows,
+never the whole `steps` table.
+
+Examples:
+    >>> results = await search_index.search("retrieval augmented", user_identifier="admin")
+    >>> results["steps"][0]["snippet"]
+    'what is [retrieval] [augmented] generation'
+
+The module contains the following:
+
+- `build_fts5_query(query)` - Converts a user query into a safe FTS5 query.
+- `SearchIndex` - Indexes the transcripts and searches the steps and transcripts.
+- `format_search_results(results)` - Formats the results as a markdown message.
+- `search_index` - The process wide instance.
+"""
+
+import re
+
+from chainlit.data import get_data_layer
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+
+from podflix.db.migrations import MAX_SEARCH_TEXT_CHARS, SEARCH_TEXT_CONFIG
+
+WORD_PATTERN = re.compile(r"\w+")
+
+SQLITE_STEPS_SEARCH_SQL = """
+    SELECT s."id", s."threadId", s."type", s."createdAt", t."name" AS "threadName",
+        snippet(steps_fts, -1, '[', ']', '...', 12) AS "snippet"
+    FROM steps_fts
+    JOIN steps s ON s.rowid = steps_fts.rowid
+    JOIN threads t ON t."id" = s."threadId"
+    WHERE steps_fts MATCH :query AND t."userIdentifier" = :user_identifier
+    ORDER BY bm25(steps_fts)
+    LIMIT :limit
+"""
+SQLITE_TRANSCRIPTS_SEARCH_SQL = """
+    SELECT f."threadId", f."episodeId", t."name" AS "threadName",
+        snippet(transcripts_fts, 0, '[', ']', '...', 12) AS "snippet"
+    FROM transcripts_fts f
+    JOIN threads t ON t."id" = f."threadId"
+    WHERE transcripts_fts MATCH :query AND t."userIdentifier" = :user_identifier
+    ORDER BY bm25(transcripts_fts)
+    LIMIT :limit
+"""
+# NOTE: The headlines are only built for the returned rows, after the ranking
+POSTGRES_STEPS_SEARCH_SQL = f"""
+    SELECT m."id", m."threadId", m."type", m."createdAt", m."threadName",
+        ts_headline(
+            '{SEARCH_TEXT_CONFIG}', coalesce(m."output", m."input", ''), m.query,
+            'StartSel=[, StopSel=], MaxFragments=1, MaxWords=24, MinWords=8'
+        ) AS "snippet"
+    FROM (
+        SELECT s."id", s."threadId", s."type", s."createdAt", s."input", s."output",
+            t."name" AS "threadName", q.query
+        FROM steps s
+        JOIN threads t ON t."id" = s."threadId",
+        websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query) AS q(query)
+        WHERE s."searchVector" @@ q.query AND t."userIdentifier" = :user_identifier
+        ORDER BY ts_rank(s."searchVector", q.query) DESC
+        LIMIT :limit
+    ) m
+"""
+POSTGRES_TRANSCRIPTS_SEARCH_SQL = f"""
+    SELECT tr."threadId", tr."episodeId", t."name" AS "threadName", NULL AS "snippet"
+    FROM transcripts tr
+    JOIN threads t ON t."id" = tr."threadId",
+    websearch_to_tsquery('{SEARCH_TEXT_CONFIG}', :query) AS q(query)
+    WHERE tr."searchVector" @@ q.query AND t."userIdentifier" = :user_identifier
+    ORDER BY ts_rank(tr."searchVector", q.query) DESC
+    LIMIT :limit
+"""
+
+
+def build_fts5_query(query: str) -> str:
+    """Convert a user query into a FTS5 query matching all of its words.
+
+    Each word is quoted, so the FTS5 operators and syntax errors can't be injected.
+
+    Examples:
+        >>> build_fts5_query('RAG OR "vector db" NEAR(x')
+        '"RAG" "OR" "vector" "db" "NEAR" "x"'
+
+    Args:
+        query: The query typed by the user.
+
+    Returns:
+        The FTS5 query, empty if the query has no words.
+    """
+    return " ".join(f'"{word}"' for word in WORD_PATTERN.findall(query))
+
+
+class SearchIndex:
+    """Index the transcripts and search the steps and transcripts of a user.
+
+    Args:
+        data_layer: The data layer to use. Defaults to the configured Chainlit data layer.
+    """
+
+    def __init__(self, data_layer: SQLAlchemyDataLayer | None = None):
+        self._data_layer = data_layer
+
+    @property
+    def data_layer(self) -> SQLAlchemyDataLayer | None:
+        """The data layer the search index is stored with."""
+        return self._data_layer or get_data_layer()
+
+    @property
+    def is_postgres(self) -> bool:
+        """Whether the data layer uses Postgres, SQLite otherwise."""
+        return self.data_layer.engine.dialect.name == "postgresql"
+
+    async def index_transcript(
+        self, thread_id: str, episode_id: str, text: str
+    ) -> None:
+        """Index or reindex the transcript of a thread.
+
+        Args:
+            thread_id: The identifier of the thread.
+            episode_id: The identifier of the episode.
+            text: The whole transcript text.
+        """
+        if self.data_layer is None:
+            return
+
+        parameters = {
+            "thread_id": thread_id,
+            "episode_id": episode_id,
+            "text": text[:MAX_SEARCH_TEXT_CHARS],
+        }
+
+        if self.is_postgres:
+            await self.data_layer.execute_sql(
+                query=f"""
+                    UPDATE transcripts
+                    SET "searchVector" = to_tsvector('{SEARCH_TEXT_CONFIG}', :text)
+                    WHERE "threadId" = :thread_id
+                """,
+                parameters=parameters,
+            )
+            return
+
+        await self.data_layer.execute_sql(
+            query='DELETE FROM transcripts_fts WHERE "threadId" = :thread_id',
+            parameters=parameters,
+        )
+        await self.data_layer.execute_sql(
+            query="""
+                INSERT INTO transcripts_fts ("text", "threadId", "episodeId")
+                VALUES (:text, :thread_id, :episode_id)
+            """,
+            parameters=parameters,
+        )
+
+    async def search(
+        self, query: str, user_identifier: str, limit: int = 10
+    ) -> dict[str, list[dict]]:
+        """Search the messages and transcripts of the threads of a user.
+
+        Args:
+            query: The words to search, all of them must match.
+            user_identifier: The identifier of the user owning the threads.
+            limit: Maximum number of steps and of transcripts returned.
+
+        Returns:
+            The matching `steps` and `transcripts`, best matches first, with their
+            thread name and a snippet of the matching text, when available.
+        """
+        results = {"steps": [], "transcripts": []}
+
+        if self.data_layer is None:
+            return results
+
+        if self.is_postgres:
+            queries = {
+                "steps": POSTGRES_STEPS_SEARCH_SQL,
+                "transcripts": POSTGRES_TRANSCRIPTS_SEARCH_SQL,
+            }
+        else:
+            queries = {
+                "steps": SQLITE_STEPS_SEARCH_SQL,
+                "transcripts": SQLITE_TRANSCRIPTS_SEARCH_SQL,
+            }
+            query = build_fts5_query(query)
+
+        if not query.strip():
+            return results
+
+        parameters = {
+            "query": query,
+            "user_identifier": user_identifier,
+            "limit": limit,
+        }
+
+        for kind, sql in queries.items():
+            rows = await self.data_layer.execute_sql(query=sql, parameters=parameters)
+            results[kind] = rows if isinstance(rows, list) else []
+
+        return results
+
+
+def format_search_results(results: dict[str, list[dict]]) -> str:
+    """Format the search results as a markdown message.
+
+    Args:
+        results: The results of `SearchIndex.search`.
+
+    Returns:
+        The markdown list of the matching messages and transcripts.
+    """
+    lines = []
+
+    for step in results["steps"]:
+        lines.append(f"- **{step['threadName'] or 'Untitled'}**: {step['snippet']}")
+
+    for transcript in results["transcripts"]:
+        snippet = transcript["snippet"] or f"episode {transcript['episodeId']}"
+        lines.append(
+            f"- **{transcript['threadName'] or 'Untitled'}** (transcript): {snippet}"
+        )
+
+    if not lines:
+        return "No matching conversations or transcripts."
+
+    return "\n".join(lines)
+
+
+search_index = SearchIndex()
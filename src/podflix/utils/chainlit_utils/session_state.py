@@ -0,0 +1,345 @@
+"""Externalized conversational state of the Chainlit sessions.
+
+The Chainlit `user_session` lives in the memory of a single worker. The conversational
+state of a session is therefore also saved, compactly serialized, into a pluggable
+backend after every turn, and restored from it when a thread is resumed. With a shared
+backend, the threads can be resumed by any worker or node behind the proxy.
+
+The backends follow the `get`/`set`/`delete` interface of Redis:
+
+- `memory` - In-process backend, the state only survives reconnections.
+- `sql` - The `session_state` table of the database, see `DBInterfaceFactory`.
+- `redis` - Any Redis compatible server, see `SESSION_STATE_REDIS_URL`.
+
+Examples:
+    >>> await session_state_store.save(thread_id="thread123")
+    >>> await session_state_store.restore(thread_id="thread123")
+    True
+
+The module contains the following:
+
+- `serialize_session_state(state)` - Serializes the session state into compact bytes.
+- `deserialize_session_state(content)` - Restores a serialized session state.
+- `SessionStateBackend` - Interface of the backends.
+- `InMemorySessionStateBackend` - In-process backend.
+- `SQLSessionStateBackend` - Backend using the shared engine of the database.
+- `RedisSessionStateBackend` - Backend using a Redis compatible client.
+- `SessionStateStore` - Saves and restores the state of the current session.
+- `get_session_state_backend()` - Returns the configured backend.
+- `session_state_store` - The process wide instance.
+"""
+
+import heapq
+import json
+import time
+import zlib
+from abc import ABC, abstractmethod
+from functools import cache
+from typing import Any
+
+import chainlit as cl
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from loguru import logger
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from podflix.db.engine_registry import engine_registry
+from podflix.env_settings import env_settings
+from podflix.utils.general import is_module_installed
+
+SESSION_STATE_KEYS = (
+    "session_id",
+    "message_history",
+    "message_history_cursor",
+    "conversation_summary",
+    "settings",
+)
+
+
+def serialize_session_state(state: dict[str, Any]) -> bytes:
+    """Serialize the session state into zlib compressed JSON.
+
+    The message history is stored as message dictionaries and pydantic models as their
+    field values.
+
+    Examples:
+        >>> content = serialize_session_state({"conversation_summary": "Hello"})
+        >>> deserialize_session_state(content)
+        {'conversation_summary': 'Hello'}
+
+    Args:
+        state: The session state, see `SESSION_STATE_KEYS`.
+
+    Returns:
+        The compressed state.
+    """
+    payload = dict(state)
+
+    for key, value in state.items():
+        if isinstance(value, ChatMessageHistory):
+            payload[key] = messages_to_dict(value.messages)
+        elif isinstance(value, BaseModel):
+            payload[key] = value.model_dump(mode="json")
+
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def deserialize_session_state(content: bytes) -> dict[str, Any]:
+    """Restore a session state serialized with `serialize_session_state`.
+
+    Args:
+        content: The compressed state.
+
+    Returns:
+        The session state. The message history is restored as a `ChatMessageHistory`,
+        pydantic models are left as dictionaries for the apps to validate.
+    """
+    state = json.loads(zlib.decompress(content).decode("utf-8"))
+
+    if "message_history" in state:
+        state["message_history"] = ChatMessageHistory(
+            messages=messages_from_dict(state["message_history"])
+        )
+
+    # NOTE: JSON has no tuples, the keyset cursor is compared as a tuple
+    if state.get("message_history_cursor") is not None:
+        state["message_history_cursor"] = tuple(state["message_history_cursor"])
+
+    return state
+
+
+class SessionStateBackend(ABC):
+    """Interface of the session state backends, a subset of the Redis commands."""
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        """Return the value of the key, or None if it is missing or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ex: int | None = None) -> None:
+        """Set the value of the key, expiring after `ex` seconds if set."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Delete the key."""
+
+
+class InMemorySessionStateBackend(SessionStateBackend):
+    """In-process session state backend, only shared by the sessions of the worker.
+
+    Expired values are evicted on every `set`, in the order of their expiration, so
+    the states of finished threads don't stay in memory for the life of the worker.
+    """
+
+    def __init__(self):
+        self._values: dict[str, tuple[bytes, float | None]] = {}
+        self._expirations: list[tuple[float, str]] = []
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._values)
+
+    async def get(self, key: str) -> bytes | None:  # noqa: D102
+        value, expires_at = self._values.get(key, (None, None))
+
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[key]
+            return None
+
+        return value
+
+    async def set(self, key: str, value: bytes, ex: int | None = None) -> None:  # noqa: D102
+        now = time.time()
+        self._evict_expired(now)
+
+        expires_at = now + ex if ex is not None else None
+        self._values[key] = (value, expires_at)
+
+        if expires_at is not None:
+            heapq.heappush(self._expirations, (expires_at, key))
+
+    async def delete(self, key: str) -> None:  # noqa: D102
+        self._values.pop(key, None)
+
+    def _evict_expired(self, now: float) -> None:
+        while self._expirations and self._expirations[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expirations)
+
+            # NOTE: Skip the expirations of values replaced or deleted since
+            if key in self._values and self._values[key][1] == expires_at:
+                del self._values[key]
+
+
+class SQLSessionStateBackend(SessionStateBackend):
+    """Session state backend using the `session_state` table of the database.
+
+    Errors of the database are raised, the `SessionStateStore` logs them.
+
+    Args:
+        engine: The async engine to use. Defaults to the shared engine of the database
+            configured with `DBInterfaceFactory`.
+    """
+
+    def __init__(self, engine: AsyncEngine | None = None):
+        self._engine = engine
+
+    @property
+    def engine(self) -> AsyncEngine:
+        """The async engine the session states are stored with."""
+        return self._engine or engine_registry.get_async_engine()
+
+    async def get(self, key: str) -> bytes | None:  # noqa: D102
+        query = """
+            SELECT "value" FROM session_state
+            WHERE "key" = :key AND ("expiresAt" IS NULL OR "expiresAt" > :now)
+        """
+
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(query), {"key": key, "now": time.time()})
+            return result.scalar()
+
+    async def set(self, key: str, value: bytes, ex: int | None = None) -> None:  # noqa: D102
+        query = """
+            INSERT INTO session_state ("key", "value", "expiresAt")
+            VALUES (:key, :value, :expires_at)
+            ON CONFLICT ("key") DO UPDATE
+            SET "value" = EXCLUDED."value", "expiresAt" = EXCLUDED."expiresAt"
+        """
+        parameters = {
+            "key": key,
+            "value": value,
+            "expires_at": time.time() + ex if ex is not None else None,
+        }
+
+        async with self.engine.begin() as conn:
+            await conn.execute(text(query), parameters)
+
+    async def delete(self, key: str) -> None:  # noqa: D102
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                text('DELETE FROM session_state WHERE "key" = :key'), {"key": key}
+            )
+
+
+class RedisSessionStateBackend(SessionStateBackend):
+    """Session state backend using a Redis compatible client.
+
+    Args:
+        client: An async client with the Redis `get`, `set` and `delete` commands,
+            e.g. `redis.asyncio.Redis`.
+    """
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    async def get(self, key: str) -> bytes | None:  # noqa: D102
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ex: int | None = None) -> None:  # noqa: D102
+        await self.client.set(key, value, ex=ex)
+
+    async def delete(self, key: str) -> None:  # noqa: D102
+        await self.client.delete(key)
+
+
+@cache
+def get_session_state_backend() -> SessionStateBackend:
+    """Return the session state backend configured with `SESSION_STATE_BACKEND`.
+
+    Examples:
+        >>> isinstance(get_session_state_backend(), SessionStateBackend)
+        True
+
+    Returns:
+        The process wide session state backend.
+
+    Raises:
+        ImportError: If the `redis` backend is configured without the `redis` package.
+    """
+    if env_settings.session_state_backend == "sql":
+        return SQLSessionStateBackend()
+
+    if env_settings.session_state_backend == "redis":
+        is_module_installed("redis", throw_error=True)
+
+        from redis.asyncio import from_url  # noqa: PLC0415
+
+        return RedisSessionStateBackend(
+            client=from_url(env_settings.session_state_redis_url)
+        )
+
+    return InMemorySessionStateBackend()
+
+
+class SessionStateStore:
+    """Save and restore the conversational state of the current Chainlit session.
+
+    Args:
+        backend: The backend to use. Defaults to `get_session_state_backend()`.
+        ttl: Seconds a saved state is kept after the last turn of its thread.
+    """
+
+    def __init__(self, backend: SessionStateBackend | None = None, ttl: int = 86400):
+        self._backend = backend
+        self.ttl = ttl
+
+    @property
+    def backend(self) -> SessionStateBackend:
+        """The backend the session states are stored in."""
+        return self._backend or get_session_state_backend()
+
+    @staticmethod
+    def get_key(thread_id: str) -> str:
+        """Return the backend key of the state of a thread."""
+        return f"podflix:session_state:{thread_id}"
+
+    async def save(self, thread_id: str) -> None:
+        """Save the state of the current session under its thread.
+
+        Args:
+            thread_id: The identifier of the thread of the session.
+        """
+        state = {key: cl.user_session.get(key) for key in SESSION_STATE_KEYS}
+        state = {key: value for key, value in state.items() if value is not None}
+
+        try:
+            await self.backend.set(
+                self.get_key(thread_id), serialize_session_state(state), ex=self.ttl
+            )
+        except Exception as e:
+            logger.warning(f"Saving the session state of {thread_id} failed: {e}")
+
+    async def restore(self, thread_id: str) -> bool:
+        """Restore the saved state of a thread into the current session.
+
+        Args:
+            thread_id: The identifier of the resumed thread.
+
+        Returns:
+            True if a saved state was restored, False otherwise.
+        """
+        try:
+            content = await self.backend.get(self.get_key(thread_id))
+        except Exception as e:
+            logger.warning(f"Loading the session state of {thread_id} failed: {e}")
+            return False
+
+        if content is None:
+            return False
+
+        for key, value in deserialize_session_state(content).items():
+            cl.user_session.set(key, value)
+
+        return True
+
+    async def delete(self, thread_id: str) -> None:
+        """Delete the saved state of a thread.
+
+        Args:
+            thread_id: The identifier of the thread.
+        """
+        await self.backend.delete(self.get_key(thread_id))
+
+
+session_state_store = SessionStateStore(ttl=env_settings.session_state_ttl)
@@ -0,0 +1,369 @@
+"""Stores of the thread transcripts and messages, built on the Chainlit data layer.
+
+The transcript of a thread is persisted compressed, so a resumed thread gets its
+context back without transcribing the audio again. The messages of a thread are
+loaded page by page, and the threads can be filtered by their metadata.
+
+Examples:
+    >>> await thread_transcript_store.save("thread123", "episode456", text, segments)
+    >>> page = await thread_history_store.load_page("thread123", limit=50)
+    >>> threads = await thread_finder.find({"show": "Youtube"}, user_id="user123")
+
+The module contains the following:
+
+- `compress_transcript(text, segments)` - Serializes and compresses a transcript.
+- `decompress_transcript(content)` - Restores a compressed transcript.
+- `ThreadTranscriptStore` - Persists the transcript of a thread.
+- `ThreadHistoryPage` - A page of thread messages with the cursor of the next page.
+- `ThreadHistoryStore` - Loads the messages of a thread page by page.
+- `ThreadFinder` - Finds the threads by their metadata values.
+- `thread_transcript_store`, `thread_history_store` and `thread_finder` - The process
+    wide instances.
+"""
+
+import json
+import zlib
+from dataclasses import dataclass
+
+from chainlit.data import get_data_layer
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+from chainlit.data.utils import queue_until_user_message
+
+from podflix.db.db_factory import DBInterfaceFactory
+from podflix.utils.chainlit_utils.search import SearchIndex
+
+
+def compress_transcript(text: str, segments: list[dict]) -> bytes:
+    """Serialize and compress a transcript with its segments.
+
+    Examples:
+        >>> content = compress_transcript("Hello", [{"start": 0.0, "end": 1.0, "text": "Hello"}])
+        >>> decompress_transcript(content)["text"]
+        'Hello'
+
+    Args:
+        text: The whole transcript text.
+        segments: The transcript segments.
+
+    Returns:
+        The zlib compressed JSON of the transcript.
+    """
+    payload = json.dumps({"text": text, "segments": segments}, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"))
+
+
+def decompress_transcript(content: bytes) -> dict:
+    """Decompress a transcript compressed with `compress_transcript`.
+
+    Args:
+        content: The compressed transcript.
+
+    Returns:
+        A dictionary with the `text` and `segments` of the transcript.
+    """
+    return json.loads(zlib.decompress(content).decode("utf-8"))
+
+
+class ThreadTranscriptStore:
+    """Persists the transcript of a thread through the Chainlit data layer.
+
+    Transcripts are stored compressed in the `transcripts` table, so resumed threads
+    get their context back without transcribing the audio again. They are also added
+    to the full-text search index.
+
+    Args:
+        data_layer: The data layer to use. Defaults to the configured Chainlit data layer.
+
+    Examples:
+        >>> await thread_transcript_store.save("thread123", "episode456", text, segments)
+        >>> transcript = await thread_transcript_store.load("thread123")
+        >>> transcript["episode_id"]
+        'episode456'
+    """
+
+    def __init__(self, data_layer: SQLAlchemyDataLayer | None = None):
+        self._data_layer = data_layer
+        self.search_index = SearchIndex(data_layer=data_layer)
+
+    @property
+    def data_layer(self) -> SQLAlchemyDataLayer | None:
+        """The data layer used to persist the transcripts."""
+        return self._data_layer or get_data_layer()
+
+    # NOTE: The thread row only exists after the first user message, like for the steps
+    @queue_until_user_message()
+    async def save(
+        self,
+        thread_id: str,
+        episode_id: str,
+        text: str,
+        segments: list[dict],
+        show: str | None = None,
+    ) -> None:
+        """Insert or replace the transcript of a thread.
+
+        The episode and the show are also added to the thread metadata, so the threads
+        can be filtered by them, see `ThreadFinder`.
+
+        Args:
+            thread_id: The identifier of the thread.
+            episode_id: The identifier of the episode, e.g. the transcript content hash.
+            text: The whole transcript text.
+            segments: The transcript segments.
+            show: The show of the episode, e.g. `Youtube`.
+        """
+        if self.data_layer is None:
+            return
+
+        query = """
+            INSERT INTO transcripts ("threadId", "episodeId", "content", "createdAt")
+            VALUES (:thread_id, :episode_id, :content, :created_at)
+            ON CONFLICT ("threadId") DO UPDATE
+            SET "episodeId" = EXCLUDED."episodeId", "content" = EXCLUDED."content"
+        """
+        parameters = {
+            "thread_id": thread_id,
+            "episode_id": episode_id,
+            "content": compress_transcript(text=text, segments=segments),
+            "created_at": await self.data_layer.get_current_timestamp(),
+        }
+
+        metadata = {"episode_id": episode_id}
+        if show is not None:
+            metadata["show"] = show
+
+        await self.data_layer.update_thread(thread_id, metadata=metadata)
+        await self.data_layer.execute_sql(query=query, parameters=parameters)
+        await self.search_index.index_transcript(thread_id, episode_id, text)
+
+    async def load(self, thread_id: str) -> dict | None:
+        """Load the transcript of a thread.
+
+        Args:
+            thread_id: The identifier of the thread.
+
+        Returns:
+            A dictionary with the `episode_id`, `text` and `segments` of the transcript,
+            or None if the thread has no persisted transcript.
+        """
+        if self.data_layer is None:
+            return None
+
+        query = """
+            SELECT "episodeId", "content" FROM transcripts
+            WHERE "threadId" = :thread_id
+        """
+        rows = await self.data_layer.execute_sql(
+            query=query, parameters={"thread_id": thread_id}
+        )
+
+        if not rows:
+            return None
+
+        transcript = decompress_transcript(rows[0]["content"])
+        transcript["episode_id"] = rows[0]["episodeId"]
+
+        return transcript
+
+
+thread_transcript_store = ThreadTranscriptStore()
+
+
+@dataclass
+class ThreadHistoryPage:
+    """A page of thread messages with the cursor of the next older page.
+
+    The cursor is the `createdAt` and `id` of the oldest step of the page, or None if
+    there are no older messages.
+    """
+
+    steps: list[dict]
+    cursor: tuple[str, str] | None
+
+
+class ThreadHistoryStore:
+    """Loads the user and assistant messages of a thread page by page.
+
+    Only the most recent messages are fetched, ordered by `createdAt` in SQL. Older
+    messages are fetched with keyset pagination, using the cursor of the previous page,
+    so no page requires reading the whole thread.
+
+    Args:
+        data_layer: The data layer to use. Defaults to the configured Chainlit data layer.
+
+    Examples:
+        >>> page = await thread_history_store.load_page("thread123", limit=50)
+        >>> older_page = await thread_history_store.load_page(
+        ...     "thread123", limit=50, before=page.cursor
+        ... )
+    """
+
+    def __init__(self, data_layer: SQLAlchemyDataLayer | None = None):
+        self._data_layer = data_layer
+
+    @property
+    def data_layer(self) -> SQLAlchemyDataLayer | None:
+        """The data layer the messages are loaded from."""
+        return self._data_layer or get_data_layer()
+
+    async def load_page(
+        self, thread_id: str, limit: int, before: tuple[str, str] | None = None
+    ) -> ThreadHistoryPage | None:
+        """Load the most recent messages of a thread older than the cursor.
+
+        Args:
+            thread_id: The identifier of the thread.
+            limit: The maximum number of messages of the page.
+            before: The cursor of the previous page. If None, the most recent messages
+                are loaded.
+
+        Returns:
+            The page with the steps in chronological order, or None if no data layer
+            is configured.
+        """
+        if self.data_layer is None:
+            return None
+
+        parameters = {"thread_id": thread_id, "limit": limit}
+        keyset_condition = ""
+
+        if before is not None:
+            keyset_condition = """
+                AND ("createdAt" < :before_created_at
+                     OR ("createdAt" = :before_created_at AND "id" < :before_id))
+            """
+            parameters["before_created_at"], parameters["before_id"] = before
+
+        query = f"""
+            SELECT "id", "type", "output", "createdAt" FROM steps
+            WHERE "threadId" = :thread_id
+            AND "type" IN ('user_message', 'assistant_message')
+            {keyset_condition}
+            ORDER BY "createdAt" DESC, "id" DESC
+            LIMIT :limit
+        """
+        rows = await self.data_layer.execute_sql(query=query, parameters=parameters)
+
+        # NOTE: execute_sql returns None when the query fails
+        if not isinstance(rows, list):
+            rows = []
+
+        cursor = None
+        if len(rows) == limit:
+            cursor = (rows[-1]["createdAt"], str(rows[-1]["id"]))
+
+        return ThreadHistoryPage(steps=rows[::-1], cursor=cursor)
+
+
+thread_history_store = ThreadHistoryStore()
+
+
+class ThreadFinder:
+    """Find the threads whose metadata contains the given values.
+
+    On Postgres with the `jsonb` schema mode, the filter is a containment query using
+    the GIN index of `threads.metadata`. Otherwise the metadata values are extracted
+    from the JSON text of every thread.
+
+    Args:
+        data_layer: The data layer to use. Defaults to the configured Chainlit data layer.
+        schema_mode: The schema mode of the database. Defaults to the mode of
+            `DBInterfaceFactory.create()`.
+
+    Examples:
+        >>> threads = await thread_finder.find({"show": "Youtube"}, user_id="user123")
+        >>> threads[0]["metadata"]["show"]
+        'Youtube'
+    """
+
+    def __init__(
+        self,
+        data_layer: SQLAlchemyDataLayer | None = None,
+        schema_mode: str | None = None,
+    ):
+        self._data_layer = data_layer
+        self._schema_mode = schema_mode
+
+    @property
+    def data_layer(self) -> SQLAlchemyDataLayer | None:
+        """The data layer the threads are queried with."""
+        return self._data_layer or get_data_layer()
+
+    @property
+    def schema_mode(self) -> str:
+        """The schema mode of the database, `json` or `jsonb`."""
+        return self._schema_mode or DBInterfaceFactory.create().schema_mode
+
+    def build_metadata_filter(self, metadata: dict) -> tuple[str, dict]:
+        """Return the SQL condition and parameters of a metadata filter.
+
+        Args:
+            metadata: The metadata values the threads must have.
+
+        Returns:
+            The condition and its parameters.
+        """
+        if self.data_layer.engine.dialect.name == "postgresql":
+            column = (
+                '"metadata"'
+                if self.schema_mode == "jsonb"
+                else 'CAST("metadata" AS JSONB)'
+            )
+            condition = f"{column} @> CAST(:metadata AS JSONB)"
+
+            return condition, {"metadata": json.dumps(metadata)}
+
+        conditions = []
+        parameters = {}
+
+        for index, (key, value) in enumerate(metadata.items()):
+            conditions.append(
+                f'json_extract("metadata", :path_{index}) = :value_{index}'
+            )
+            parameters[f"path_{index}"] = f'$."{key}"'
+            parameters[f"value_{index}"] = value
+
+        return " AND ".join(conditions) or "1 = 1", parameters
+
+    async def find(
+        self, metadata: dict, user_id: str | None = None, limit: int = 20
+    ) -> list[dict]:
+        """Return the most recent threads with the given metadata values.
+
+        Args:
+            metadata: The metadata values the threads must have, e.g. `{"show": "Youtube"}`.
+            user_id: The identifier of the user owning the threads, all users if None.
+            limit: Maximum number of returned threads.
+
+        Returns:
+            The `id`, `name`, `createdAt` and `metadata` of the threads, newest first.
+        """
+        if self.data_layer is None:
+            return []
+
+        condition, parameters = self.build_metadata_filter(metadata)
+        parameters["limit"] = limit
+
+        if user_id is not None:
+            condition += ' AND "userId" = :user_id'
+            parameters["user_id"] = user_id
+
+        query = f"""
+            SELECT "id", "name", "createdAt", "metadata" FROM threads
+            WHERE {condition}
+            ORDER BY "createdAt" DESC
+            LIMIT :limit
+        """
+        rows = await self.data_layer.execute_sql(query=query, parameters=parameters)
+
+        if not isinstance(rows, list):
+            return []
+
+        for row in rows:
+            if isinstance(row["metadata"], str):
+                row["metadata"] = json.loads(row["metadata"])
+
+        return rows
+
+
+thread_finder = ThreadFinder()
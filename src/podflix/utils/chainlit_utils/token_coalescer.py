@@ -0,0 +1,138 @@
+"""Coalesce streamed tokens into fewer websocket emits.
+
+Fast models produce hundreds of tokens per second and emitting every single token to
+the UI is expensive. The coalescer buffers the tokens and streams them to the message
+or step once the buffer is old or large enough, and always flushes at the end.
+
+When the websocket of a slow client falls behind, flushing waits until its write queue
+drains, which in turn stops reading the upstream model stream.
+
+Examples:
+    >>> async with TokenCoalescer(assistant_message) as coalescer:
+    ...     async for token in tokens:
+    ...         await coalescer.add(token)
+
+The module contains the following class:
+
+- `TokenCoalescer` - Buffers tokens and flushes them on a time or size threshold.
+"""
+
+import asyncio
+import time
+from typing import Callable, Protocol
+
+from loguru import logger
+
+from podflix.env_settings import env_settings
+from podflix.utils.chainlit_utils.general import get_pending_websocket_packets
+
+BACKPRESSURE_POLL_INTERVAL = 0.01
+
+
+class TokenStreamTarget(Protocol):
+    """An object tokens can be streamed to, e.g. a Chainlit Message or Step."""
+
+    async def stream_token(self, token: str) -> None:  # noqa: D102
+        ...
+
+
+class TokenCoalescer:
+    """Buffer streamed tokens and flush them on a time or size threshold.
+
+    Args:
+        target: The message or step to stream the tokens to.
+        flush_interval_ms: Maximum milliseconds a token waits in the buffer.
+            Defaults to `STREAM_COALESCE_INTERVAL_MS`.
+        flush_max_chars: Number of buffered characters triggering a flush.
+            Defaults to `STREAM_COALESCE_MAX_CHARS`.
+        max_pending_packets: Websocket write queue size above which flushing waits.
+            Defaults to `STREAM_MAX_PENDING_PACKETS`.
+        pending_packets: Callable returning the current websocket write queue size.
+    """
+
+    def __init__(
+        self,
+        target: TokenStreamTarget,
+        flush_interval_ms: int | None = None,
+        flush_max_chars: int | None = None,
+        max_pending_packets: int | None = None,
+        pending_packets: Callable[[], int] = get_pending_websocket_packets,
+    ):
+        if flush_interval_ms is None:
+            flush_interval_ms = env_settings.stream_coalesce_interval_ms
+
+        if flush_max_chars is None:
+            flush_max_chars = env_settings.stream_coalesce_max_chars
+
+        if max_pending_packets is None:
+            max_pending_packets = env_settings.stream_max_pending_packets
+
+        self.target = target
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_chars = flush_max_chars
+        self.max_pending_packets = max_pending_packets
+        self.pending_packets = pending_packets
+
+        self._buffer: list[str] = []
+        self._buffer_size = 0
+        self._flush_timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "TokenCoalescer":  # noqa: D105
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:  # noqa: D105
+        await self.flush()
+
+    async def add(self, token: str) -> None:
+        """Add a token to the buffer and flush it when the size threshold is reached.
+
+        Args:
+            token: The streamed token.
+        """
+        if not token:
+            return
+
+        self._buffer.append(token)
+        self._buffer_size += len(token)
+
+        if self._buffer_size >= self.flush_max_chars or self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """Stream all buffered tokens to the target."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffer_size = 0
+
+            await self.target.stream_token(text)
+            await self._wait_for_drain()
+
+    async def _wait_for_drain(self) -> None:
+        if self.pending_packets() <= self.max_pending_packets:
+            return
+
+        deadline = time.monotonic() + env_settings.timeout_limit
+        while self.pending_packets() > self.max_pending_packets:
+            if time.monotonic() > deadline:
+                logger.warning("Websocket did not drain in time, continue streaming")
+                return
+
+            await asyncio.sleep(BACKPRESSURE_POLL_INTERVAL)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+
+        # NOTE: Detach the timer first, so the flush doesn't cancel its own task
+        self._flush_timer = None
+        await self.flush()
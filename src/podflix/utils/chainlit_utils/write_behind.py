@@ -0,0 +1,275 @@
+"""Write-behind data layer coalescing the step writes of the chat turns.
+
+While an answer is streamed, Chainlit creates and updates the same steps many times,
+and each write of `SQLAlchemyDataLayer` is a thread lookup plus an upsert, each in its
+own transaction. `WriteBehindDataLayer` buffers the step writes instead: the writes of
+a step within `DATA_LAYER_WRITE_BEHIND_MS` are merged into a single upsert, and all the
+buffered steps are written in one transaction. The buffer is flushed when the window
+ends, at the end of every turn, before the reads and deletes depending on the steps,
+and on shutdown. Steps failing to be written are buffered again for the next flush,
+and their error is raised on shutdown.
+
+Examples:
+    >>> data_layer = WriteBehindDataLayer(conninfo="sqlite+aiosqlite:///db.sqlite")
+    >>> await data_layer.update_step(step_dict)
+    >>> await data_layer.flush()
+    1
+
+The module contains the following:
+
+- `build_step_parameters(step_dict)` - Returns the upsert parameters of a step.
+- `build_step_upsert(columns)` - Returns the upsert statement of the steps.
+- `WriteBehindDataLayer` - Data layer buffering and coalescing the step writes.
+- `flush_data_layer(raise_on_error)` - Flushes the configured data layer, if buffered.
+"""
+
+import asyncio
+import json
+from typing import TYPE_CHECKING, Any
+
+from chainlit.data import get_data_layer
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+from chainlit.data.utils import queue_until_user_message
+from loguru import logger
+from sqlalchemy import text
+
+if TYPE_CHECKING:
+    from chainlit.step import StepDict
+
+INSERT_THREAD_SQL = """
+    INSERT INTO threads ("id", "createdAt", "metadata")
+    VALUES (:id, :createdAt, :metadata)
+    ON CONFLICT ("id") DO NOTHING
+"""
+
+
+def build_step_parameters(step_dict: "StepDict") -> dict[str, Any]:
+    """Return the upsert parameters of a step, like `SQLAlchemyDataLayer.create_step`.
+
+    Args:
+        step_dict: The step, with the values of its unset fields set to None.
+
+    Returns:
+        The column values of the step.
+    """
+    step_dict = dict(step_dict)
+    step_dict["showInput"] = (
+        str(step_dict.get("showInput", "")).lower()
+        if "showInput" in step_dict
+        else None
+    )
+    parameters = {
+        key: value
+        for key, value in step_dict.items()
+        if value is not None and not (isinstance(value, dict) and not value)
+    }
+    parameters["metadata"] = json.dumps(step_dict.get("metadata", {}))
+    parameters["generation"] = json.dumps(step_dict.get("generation", {}))
+
+    return parameters
+
+
+def build_step_upsert(columns: tuple[str, ...]) -> str:
+    """Return the upsert statement of the steps with the given columns."""
+    column_names = ", ".join(f'"{column}"' for column in columns)
+    values = ", ".join(f":{column}" for column in columns)
+    updates = ", ".join(
+        f'"{column}" = EXCLUDED."{column}"' for column in columns if column != "id"
+    )
+
+    return f"""
+        INSERT INTO steps ({column_names})
+        VALUES ({values})
+        ON CONFLICT ("id") DO UPDATE
+        SET {updates}
+    """
+
+
+class WriteBehindDataLayer(SQLAlchemyDataLayer):
+    """SQLAlchemy data layer buffering and coalescing the step writes.
+
+    Args:
+        *args: The arguments of `SQLAlchemyDataLayer`.
+        write_behind_ms: Milliseconds the step writes are buffered for, 0 disables the
+            buffering.
+        max_pending_steps: Number of buffered steps triggering an immediate flush.
+        **kwargs: The keyword arguments of `SQLAlchemyDataLayer`.
+    """
+
+    def __init__(
+        self,
+        *args,
+        write_behind_ms: int = 250,
+        max_pending_steps: int = 256,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+
+        self.write_behind_ms = write_behind_ms
+        self.max_pending_steps = max_pending_steps
+
+        self._pending_steps: dict[str, dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    @property
+    def pending_steps(self) -> int:
+        """The number of buffered steps."""
+        return len(self._pending_steps)
+
+    @queue_until_user_message()
+    async def create_step(self, step_dict: "StepDict"):  # noqa: D102
+        if self.write_behind_ms <= 0:
+            await super().create_step(step_dict)
+            return
+
+        await self.buffer_step(step_dict)
+
+    @queue_until_user_message()
+    async def update_step(self, step_dict: "StepDict"):  # noqa: D102
+        await self.create_step(step_dict)
+
+    async def buffer_step(self, step_dict: "StepDict") -> None:
+        """Buffer a step write, merging it with the buffered writes of the step.
+
+        Args:
+            step_dict: The created or updated step.
+        """
+        # NOTE: Later writes only override the fields they set, like consecutive upserts
+        pending_step = self._pending_steps.setdefault(step_dict["id"], {})
+        pending_step.update(
+            {key: value for key, value in step_dict.items() if value is not None}
+        )
+
+        if len(self._pending_steps) >= self.max_pending_steps:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    @queue_until_user_message()
+    async def delete_step(self, step_id: str):  # noqa: D102
+        await self.flush()
+        await super().delete_step(step_id)
+
+    async def get_step(self, step_id: str):  # noqa: D102
+        await self.flush()
+        return await super().get_step(step_id)
+
+    async def get_thread(self, thread_id: str):  # noqa: D102
+        await self.flush()
+        return await super().get_thread(thread_id)
+
+    async def delete_thread(self, thread_id: str):  # noqa: D102
+        await self.flush()
+        await super().delete_thread(thread_id)
+
+    async def upsert_feedback(self, feedback):  # noqa: D102
+        await self.flush()
+        return await super().upsert_feedback(feedback)
+
+    @queue_until_user_message()
+    async def create_element(self, element):  # noqa: D102
+        # NOTE: Elements are attached to steps, keep them in order
+        await self.flush()
+        await super().create_element(element)
+
+    async def flush(self, raise_on_error: bool = False) -> int:
+        """Write the buffered steps in a single transaction.
+
+        If the transaction fails, the steps are written one by one, so a failing step
+        doesn't hold back the others. The steps that still fail are buffered again,
+        under their newer writes, and retried by the next flush.
+
+        Args:
+            raise_on_error: Whether to raise the error of the failing steps, e.g. on
+                shutdown when no flush follows.
+
+        Returns:
+            The number of written steps.
+        """
+        async with self._flush_lock:
+            if not self._pending_steps:
+                return 0
+
+            steps, self._pending_steps = self._pending_steps, {}
+
+            try:
+                await self._write_steps(list(steps.values()))
+            except Exception as e:
+                logger.warning(
+                    f"Writing {len(steps)} buffered steps failed, "
+                    f"writing them one by one: {e}"
+                )
+            else:
+                return len(steps)
+
+            failed_steps = {}
+            error = None
+            for step_id, step in steps.items():
+                try:
+                    await self._write_steps([step])
+                except Exception as e:
+                    failed_steps[step_id] = step
+                    error = e
+
+            # NOTE: The writes buffered during the flush override the failed ones
+            for step_id, step in failed_steps.items():
+                self._pending_steps[step_id] = {
+                    **step,
+                    **self._pending_steps.get(step_id, {}),
+                }
+
+        if error is not None:
+            logger.warning(f"Buffering {len(failed_steps)} failed steps again: {error}")
+
+            if raise_on_error is True:
+                raise error
+
+        return len(steps) - len(failed_steps)
+
+    async def close(self) -> None:
+        """Flush the buffered steps and close the data layer."""
+        try:
+            await self.flush(raise_on_error=True)
+        finally:
+            await super().close()
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.write_behind_ms / 1000)
+        await self.flush()
+
+    async def _write_steps(self, steps: list[dict[str, Any]]) -> None:
+        created_at = await self.get_current_timestamp()
+        thread_parameters = [
+            {"id": thread_id, "createdAt": created_at, "metadata": "{}"}
+            for thread_id in dict.fromkeys(step["threadId"] for step in steps)
+        ]
+
+        # NOTE: Steps with the same columns are written with a single executemany
+        step_parameters: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for step in steps:
+            parameters = build_step_parameters(step)
+            step_parameters.setdefault(tuple(parameters), []).append(parameters)
+
+        async with self.async_session() as session, session.begin():
+            await session.execute(text(INSERT_THREAD_SQL), thread_parameters)
+
+            for columns, parameters in step_parameters.items():
+                await session.execute(text(build_step_upsert(columns)), parameters)
+
+
+async def flush_data_layer(raise_on_error: bool = False) -> None:
+    """Write the step writes buffered by the configured data layer, if any.
+
+    Examples:
+        >>> await flush_data_layer()  # At the end of a turn
+        >>> await flush_data_layer(raise_on_error=True)  # On shutdown
+
+    Args:
+        raise_on_error: Whether to raise the error of the steps failing to be written,
+            instead of buffering them for the next flush only.
+    """
+    data_layer = get_data_layer()
+
+    if isinstance(data_layer, WriteBehindDataLayer):
+        await data_layer.flush(raise_on_error=raise_on_error)
@@ -0,0 +1,291 @@
+"""Exact response cache for deterministic chat completions.
+
+A completion requested with a fixed seed and temperature 0 is expected to be the same
+for the same messages and settings, so it is cached under a hash of the normalized
+messages and the generation settings. On a hit the recorded stream is replayed chunk
+by chunk instead of calling the model again.
+
+Entries are kept in memory, bounded by their number and total characters, or on disk
+when `COMPLETION_CACHE_DIR` is set. Both evict the least recently used entry.
+
+Examples:
+    >>> cache = CompletionCache(max_entries=10)
+    >>> cache.store("key", ["Hello", " world"])
+    >>> cache.lookup("key")
+    ['Hello', ' world']
+
+The module contains the following:
+
+- `CompletionCache` - LRU bounded memory or disk cache of completion chunks.
+- `CompletionReplayStream` - Replays cached chunks as an OpenAI completion stream.
+- `is_deterministic_request(settings)` - Whether a request can be served from the cache.
+- `get_completion_cache_key(messages, settings)` - Returns the cache key of a request.
+- `record_completion_chunks(stream, chunks)` - Records the content of a stream.
+- `get_completion_cache()` - Returns the process wide completion cache.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import cache
+from pathlib import Path
+from typing import AsyncIterator
+
+from loguru import logger
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+
+from podflix.env_settings import env_settings
+from podflix.utils.general import get_content_hash
+from podflix.utils.metrics import increment
+from podflix.utils.pydantic_models import OpenAIChatGenerationSettings
+
+
+def is_deterministic_request(settings: OpenAIChatGenerationSettings) -> bool:
+    """Whether the completion of the settings is deterministic and cacheable.
+
+    Examples:
+        >>> is_deterministic_request(OpenAIChatGenerationSettings(seed=42, temperature=0))
+        True
+        >>> is_deterministic_request(OpenAIChatGenerationSettings(seed=-1, temperature=0))
+        False
+
+    Args:
+        settings: The generation settings of the request.
+
+    Returns:
+        True if a seed is set, the temperature is 0 and a single completion is requested.
+    """
+    return settings.seed != -1 and settings.temperature == 0 and settings.n == 1
+
+
+def get_completion_cache_key(
+    messages: list[dict], settings: OpenAIChatGenerationSettings
+) -> str:
+    """Build the cache key of a completion request.
+
+    Only the role and the stripped content of the messages are part of the key, so
+    metadata like message ids doesn't prevent a hit.
+
+    Examples:
+        >>> settings = OpenAIChatGenerationSettings(seed=42, temperature=0)
+        >>> key = get_completion_cache_key([{"role": "user", "content": "Hi "}], settings)
+        >>> key == get_completion_cache_key([{"role": "user", "content": "Hi"}], settings)
+        True
+
+    Args:
+        messages: The OpenAI formatted messages of the request.
+        settings: The generation settings of the request.
+
+    Returns:
+        The hex encoded hash of the normalized request.
+    """
+    normalized_messages = [
+        {
+            "role": message["role"],
+            "content": message["content"].strip()
+            if isinstance(message["content"], str)
+            else message["content"],
+        }
+        for message in messages
+    ]
+
+    return get_content_hash(
+        json.dumps(
+            {"messages": normalized_messages, "settings": settings.model_dump()},
+            sort_keys=True,
+            default=str,
+        )
+    )
+
+
+class CompletionCache:
+    """Cache the streamed chunks of completions and evict the least recently used.
+
+    Args:
+        max_entries: Maximum number of cached completions.
+        max_chars: Maximum number of cached characters over all in-memory entries.
+        directory: Directory to store the entries in. If None, they are kept in memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        max_chars: int = 2_000_000,
+        directory: Path | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.directory = directory
+
+        self._entries: OrderedDict[str, list[str]] = OrderedDict()
+        self._chars = 0
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self) -> int:  # noqa: D105
+        if self.directory is not None:
+            return len(list(self.directory.glob("*.json")))
+
+        return len(self._entries)
+
+    def lookup(self, key: str) -> list[str] | None:
+        """Return the cached chunks of the key and record a hit or miss.
+
+        Args:
+            key: The cache key of the request.
+
+        Returns:
+            The cached chunks, or None on a miss.
+        """
+        if self.directory is not None:
+            chunks = self._read_file(key)
+        else:
+            chunks = self._entries.get(key)
+            if chunks is not None:
+                self._entries.move_to_end(key)
+
+        increment(
+            "completion_cache_requests", result="miss" if chunks is None else "hit"
+        )
+
+        return chunks
+
+    def store(self, key: str, chunks: list[str]) -> None:
+        """Store the chunks of a completion.
+
+        Args:
+            key: The cache key of the request.
+            chunks: The streamed content chunks of the completion.
+        """
+        if not chunks:
+            return
+
+        if self.directory is not None:
+            self._write_file(key, chunks)
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = chunks
+        self._chars += sum(len(chunk) for chunk in chunks)
+
+        while len(self._entries) > self.max_entries or (
+            self._chars > self.max_chars and len(self._entries) > 1
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        self._entries.clear()
+        self._chars = 0
+
+        if self.directory is not None:
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def _remove(self, key: str) -> None:
+        chunks = self._entries.pop(key)
+        self._chars -= sum(len(chunk) for chunk in chunks)
+
+    def _read_file(self, key: str) -> list[str] | None:
+        path = self.directory / f"{key}.json"
+
+        try:
+            chunks = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the cached completion {path}: {e}")
+            return None
+
+        # NOTE: The modification time orders the entries for the LRU eviction
+        touch_ns = time.time_ns()
+        os.utime(path, ns=(touch_ns, touch_ns))
+
+        return chunks
+
+    def _write_file(self, key: str, chunks: list[str]) -> None:
+        path = self.directory / f"{key}.json"
+        tmp_path = path.with_suffix(".tmp")
+
+        tmp_path.write_text(json.dumps(chunks), encoding="utf-8")
+        tmp_path.replace(path)
+
+        paths = sorted(
+            self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime
+        )
+        for old_path in paths[: max(len(paths) - self.max_entries, 0)]:
+            old_path.unlink(missing_ok=True)
+
+
+class CompletionReplayStream:
+    """Replay cached chunks as a stream of `ChatCompletionChunk`.
+
+    The chunks are replayed with the boundaries of the original stream, so the
+    consumers handle them exactly like a model stream.
+
+    Args:
+        chunks: The cached content chunks.
+        model: The model name reported in the chunks.
+    """
+
+    def __init__(self, chunks: list[str], model: str):
+        self.chunks = chunks
+        self.model = model
+
+    async def __aenter__(self) -> "CompletionReplayStream":  # noqa: D105
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:  # noqa: D105
+        return None
+
+    async def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:  # noqa: D105
+        created = int(time.time())
+
+        for chunk in self.chunks:
+            yield ChatCompletionChunk(
+                id="cached",
+                choices=[Choice(index=0, delta=ChoiceDelta(content=chunk))],
+                created=created,
+                model=self.model,
+                object="chat.completion.chunk",
+            )
+
+
+async def record_completion_chunks(
+    stream: AsyncIterator[ChatCompletionChunk], chunks: list[str]
+) -> AsyncIterator[ChatCompletionChunk]:
+    """Pass the stream through and append the content of every chunk to `chunks`.
+
+    Args:
+        stream: The completion stream of the model.
+        chunks: The list collecting the content chunks.
+
+    Yields:
+        The chunks of the stream.
+    """
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            chunks.append(chunk.choices[0].delta.content)
+
+        yield chunk
+
+
+@cache
+def get_completion_cache() -> CompletionCache:
+    """Return the process wide completion cache configured from the environment.
+
+    Returns:
+        The shared CompletionCache instance.
+    """
+    directory = env_settings.completion_cache_dir
+
+    return CompletionCache(
+        max_entries=env_settings.completion_cache_max_entries,
+        max_chars=env_settings.completion_cache_max_chars,
+        directory=Path(directory) if directory is not None else None,
+    )
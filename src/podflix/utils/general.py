@@ -1,12 +1,13 @@
 """General utility functions."""
 
+import hashlib
 import importlib
 import os
 
-from langfuse import get_client
-from loguru import logger
+from langfuse import Langfuse
 
 from podflix.env_settings import env_settings
+from podflix.utils.langfuse_metadata import langfuse_metadata
 
 
 def check_env_vars(env_vars: list[str] | None = None) -> None:
@@ -70,9 +71,27 @@ def is_module_installed(module_name: str, throw_error: bool = False) -> bool:
         return False
 
 
+def get_content_hash(content: str) -> str:
+    """Return a stable hash of the given text content.
+
+    Examples:
+        >>> get_content_hash("hello")[:12]
+        '2cf24dba5fb0'
+
+    Args:
+        content: The text to hash.
+
+    Returns:
+        The hex encoded SHA-256 digest of the content.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
 def check_lf_credentials() -> None:
     """Check if the Langfuse credentials are correct by attempting authentication.
 
+    This is a blocking network round-trip, which also refreshes the cached project ID.
+
     Examples:
         >>> check_lf_credentials()
         None
@@ -84,44 +103,46 @@ def check_lf_credentials() -> None:
         ValueError: If authentication fails with provided Langfuse credentials
         Exception: If Langfuse authentication check fails for any other reason
     """
-    try:
-        client = get_client()
-        lf_check_result = client.auth_check()
+    if langfuse_metadata.refresh() is False:
+        raise Exception("Langfuse Auth Check Failed")
 
-        if lf_check_result is False:
-            raise Exception("Langfuse Auth Check Failed")
 
-        logger.debug("Langfuse Auth Check Passed")
-    except Exception as e:
-        logger.error(f"Langfuse Auth Check Error: {e}")
-        raise e
+def get_lf_project_id() -> str | None:
+    """Return the cached Langfuse project ID without a network round-trip.
 
-
-def get_lf_project_id() -> str:
-    """Retrieve the Langfuse project ID from the first available project.
+    A background refresh is scheduled if the cached project ID is stale.
 
     Examples:
         >>> get_lf_project_id()
         'cm5a4jaff0006r8yk44cvas5a'
 
     Returns:
-        str: The unique identifier of the first Langfuse project.
-
-    Raises:
-        Exception: If no projects are found or if there's an error accessing Langfuse API
+        The project ID, or None if it wasn't fetched yet.
     """
-    client = get_client()
-    # projects = client.api.projects.get()
-    # return projects.data[0].id
-    project_id = client._get_project_id()
+    langfuse_metadata.refresh_in_background()
 
-    if not project_id:
-        raise Exception("No Langfuse projects found or unable to access Langfuse API")
+    return langfuse_metadata.project_id
 
-    return project_id
 
+def get_lf_trace_id(run_id: str) -> str:
+    """Return the Langfuse trace ID of a graph run.
 
-def get_lf_session_url(session_id: str) -> str:
+    The trace ID is derived from the run ID, so it is known before the trace is sent.
+
+    Examples:
+        >>> get_lf_trace_id("123") == get_lf_trace_id("123")
+        True
+
+    Args:
+        run_id: The root run ID of the graph run.
+
+    Returns:
+        The 32 hex characters trace ID.
+    """
+    return Langfuse.create_trace_id(seed=run_id)
+
+
+def get_lf_session_url(session_id: str) -> str | None:
     """Construct the full URL for a Langfuse session.
 
     Examples:
@@ -132,17 +153,18 @@ def get_lf_session_url(session_id: str) -> str:
         session_id: The unique identifier of the Langfuse session.
 
     Returns:
-        str: The complete URL to access the session in Langfuse UI.
-
-    Raises:
-        Exception: If there's an error retrieving the project ID
+        The complete URL to access the session in Langfuse UI, or None if the project
+        ID is not known yet.
     """
     langfuse_project_id = get_lf_project_id()
 
+    if langfuse_project_id is None:
+        return None
+
     return f"{env_settings.langfuse_base_url}/project/{langfuse_project_id}/sessions/{session_id}"
 
 
-def get_lf_trace_url(langchain_trace_id: str) -> str:
+def get_lf_trace_url(trace_id: str) -> str | None:
     """Construct the full URL for a Langfuse trace.
 
     Examples:
@@ -150,22 +172,21 @@ def get_lf_trace_url(langchain_trace_id: str) -> str:
         'https://YOUR_LANFUSE_HOST/project/YOUR_PROJECT_ID/traces/123'
 
     Args:
-        langchain_trace_id: The unique identifier of the Langchain trace.
+        trace_id: The Langfuse trace ID, see `get_lf_trace_id`.
 
     Returns:
-        str: The complete URL to access the trace in Langfuse UI.
+        The complete URL to access the trace in Langfuse UI, or None if the project
+        ID is not known yet.
 
     Raises:
-        ValueError: If langchain_trace_id is None
-        Exception: If there's an error retrieving the project ID
+        ValueError: If trace_id is None
     """
-    if langchain_trace_id is None:
-        raise ValueError("langchain_trace_id cannot be None")
+    if trace_id is None:
+        raise ValueError("trace_id cannot be None")
 
-    client = get_client()
-    url = client.get_trace_url(trace_id=langchain_trace_id)
+    langfuse_project_id = get_lf_project_id()
 
-    if url is None:
-        raise Exception("Unable to construct Langfuse trace URL")
+    if langfuse_project_id is None:
+        return None
 
-    return url
+    return f"{env_settings.langfuse_base_url}/project/{langfuse_project_id}/traces/{trace_id}"
@@ -1,25 +1,47 @@
 """Helper class for running the graph."""
 
+import asyncio
+from contextlib import aclosing
+from uuid import uuid4
+
 import chainlit as cl
-from langchain_core.messages import AIMessageChunk
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, AIMessageChunk
 from langchain_core.runnables.config import RunnableConfig
-from langfuse.langchain import CallbackHandler as LangfuseCallbackHandler
 from langgraph.graph.state import CompiledStateGraph
 from loguru import logger
 
+from podflix.env_settings import env_settings
+from podflix.utils.answer_cache import SemanticAnswerCache
+from podflix.utils.chainlit_utils.token_coalescer import TokenCoalescer
+from podflix.utils.general import get_lf_trace_id
+from podflix.utils.metrics import (
+    NodeTimingCallbackHandler,
+    TurnMetrics,
+    record_langfuse_scores,
+)
+from podflix.utils.tracing import TracingCallbackHandler
+
 
 class GraphRunner:
     """Helper class for on_message callback."""
 
-    def __init__(  # noqa: PLR0913
+    def __init__(  # noqa: PLR0913, PLR0917
         self,
         graph: CompiledStateGraph,
         graph_inputs: dict,
         graph_streamable_node_names: list[str],
-        lf_cb_handler: LangfuseCallbackHandler,
+        lf_cb_handler: BaseCallbackHandler,
         user_id: str,
         session_id: str,
         assistant_message: cl.Message,
+        *,
+        answer_cache: SemanticAnswerCache | None = None,
+        answer_cache_episode_id: str | None = None,
+        answer_cache_fingerprint: str = "",
+        stream_mode: str | None = None,
+        turn_metrics: TurnMetrics | None = None,
+        graph_configurable: dict | None = None,
     ):
         """Initialize the GraphRunner class.
 
@@ -27,10 +49,22 @@ class GraphRunner:
             graph: A CompiledStateGraph instance representing the graph to be executed.
             graph_inputs: A dictionary containing the inputs for the graph.
             graph_streamable_node_names: A list of node names that can be streamed.
-            lf_cb_handler: A LangfuseCallbackHandler instance for tracking.
+            lf_cb_handler: The tracing handler of the turn, usually created with
+                `create_tracing_handler`.
             user_id: A string representing the unique user identifier.
             session_id: A string representing the unique session identifier.
             assistant_message: A chainlit Message instance for displaying responses.
+            answer_cache: Optional semantic answer cache. If None, the cache is not used.
+            answer_cache_episode_id: The episode identifier used as the cache key.
+            answer_cache_fingerprint: The fingerprint of the model/settings of the graph.
+            stream_mode: Either `messages`, streaming only the LLM tokens and the graph
+                state, or `events`, streaming all callback events of the graph.
+                Defaults to `GRAPH_STREAM_MODE`.
+            turn_metrics: The latency and throughput metrics of the turn. Defaults to
+                metrics labelled with the model name and the app type.
+            graph_configurable: Extra configurable values of the graph run, e.g. the
+                transcript handle of the session. Unlike the graph inputs, they are
+                not part of the graph state and not traced.
         """
         self.graph = graph
         self.graph_inputs = graph_inputs
@@ -39,14 +73,40 @@ class GraphRunner:
         self.user_id = user_id
         self.session_id = session_id
         self.assistant_message = assistant_message
+        self.answer_cache = answer_cache
+        self.answer_cache_episode_id = answer_cache_episode_id
+        self.answer_cache_fingerprint = answer_cache_fingerprint
+        self.stream_mode = stream_mode or env_settings.graph_stream_mode
+        self.token_coalescer = TokenCoalescer(assistant_message)
+        self.turn_metrics = turn_metrics or TurnMetrics(
+            model=env_settings.model_name, profile=env_settings.app_type
+        )
+        self.graph_configurable = graph_configurable or {}
 
         self.run_id = None
+        self.trace_id = None
+        self.final_state = None
+        self.cancelled = False
+        self.turn_summary = None
+        self.answer_cache_hit = False
+        self._question_embedding = None
 
     async def run_graph(self):
         """Execute the graph asynchronously with the configured inputs.
 
         This method sets up the runnable configuration with callbacks and streams
-        the graph events to process the LLM responses.
+        the LLM responses of the graph. In the `messages` stream mode only the LLM
+        tokens and the graph state are streamed, while the `events` stream mode
+        dispatches every callback event of the graph. When an answer cache is set
+        and contains a matching answer, the graph is skipped and the cached answer
+        is streamed instead.
+
+        If the task running the graph is cancelled, e.g. by the Chainlit stop button,
+        the graph stream is closed, which cancels the running nodes and their upstream
+        model requests. The partial answer stays in the assistant message and the
+        cancellation is re-raised.
+
+        The latency and throughput metrics of the turn are recorded in any case.
 
         Examples:
             >>> runner = GraphRunner(graph, inputs, nodes, handler, "session1", message)
@@ -55,13 +115,39 @@ class GraphRunner:
         Returns:
             None
         """
+        status = "success"
+
+        try:
+            if await self.stream_cached_response() is False:
+                await self.stream_graph()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            status = "cancelled"
+            logger.debug(f"Graph run {self.run_id} is cancelled")
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.record_turn_metrics(status=status)
+
+    async def stream_graph(self) -> None:
+        """Stream the graph run to the assistant message and store its answer."""
+        # NOTE: Set the root run id upfront instead of picking it from the events
+        self.run_id = str(uuid4())
+
+        if isinstance(self.lf_cb_handler, TracingCallbackHandler):
+            self.lf_cb_handler.trace_id = get_lf_trace_id(self.run_id)
+
         graph_runnable_config = RunnableConfig(
+            run_id=self.run_id,
             callbacks=[
                 self.lf_cb_handler,
                 cl.LangchainCallbackHandler(),
+                NodeTimingCallbackHandler(),
             ],
             recursion_limit=10,
-            configurable={"session_id": self.session_id},
+            configurable={**self.graph_configurable, "session_id": self.session_id},
             metadata={
                 "langfuse_user_id": self.user_id,
                 "langfuse_session_id": self.session_id,
@@ -69,12 +155,150 @@ class GraphRunner:
             },
         )
 
-        async for event in self.graph.astream_events(
-            self.graph_inputs,
-            config=graph_runnable_config,
-            version="v2",
-        ):
-            await self.stream_llm_response(event)
+        if self.stream_mode == "events":
+            graph_stream = self.graph.astream_events(
+                self.graph_inputs,
+                config=graph_runnable_config,
+                version="v2",
+            )
+        else:
+            graph_stream = self.graph.astream(
+                self.graph_inputs,
+                config=graph_runnable_config,
+                stream_mode=["messages", "values"],
+            )
+
+        async with self.token_coalescer, aclosing(graph_stream):
+            async for chunk in graph_stream:
+                if self.stream_mode == "events":
+                    await self.stream_llm_response(chunk)
+                else:
+                    await self.stream_graph_chunk(*chunk)
+
+        await self.stream_final_state_response()
+        self.store_cached_response()
+
+    async def stream_cached_response(self) -> bool:
+        """Stream the cached answer of the question to the assistant message.
+
+        Returns:
+            True if the answer was served from the cache, False otherwise.
+        """
+        if self.answer_cache is None or self.answer_cache_episode_id is None:
+            return False
+
+        question = self.graph_inputs["messages"][-1].content
+
+        try:
+            self._question_embedding = await self.answer_cache.aembed(question)
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed, skipping cache: {e}")
+            return False
+
+        cached_answer = self.answer_cache.lookup(
+            episode_id=self.answer_cache_episode_id,
+            embedding=self._question_embedding,
+            fingerprint=self.answer_cache_fingerprint,
+        )
+
+        if cached_answer is None:
+            return False
+
+        logger.debug(f"Answer cache hit for question: {question}")
+        self.answer_cache_hit = True
+        self.turn_metrics.mark_token()
+        await self.assistant_message.stream_token(cached_answer.answer)
+
+        return True
+
+    def store_cached_response(self) -> None:
+        """Store the streamed answer in the answer cache."""
+        if self._question_embedding is None or not self.assistant_message.content:
+            return
+
+        self.answer_cache.store(
+            episode_id=self.answer_cache_episode_id,
+            question=self.graph_inputs["messages"][-1].content,
+            embedding=self._question_embedding,
+            answer=self.assistant_message.content.strip(),
+            fingerprint=self.answer_cache_fingerprint,
+        )
+
+    async def stream_final_state_response(self) -> None:
+        """Stream the last message of the final state if no tokens were streamed.
+
+        Nodes answering without an LLM, e.g. the query router, don't emit chat
+        model stream events, so their answer is taken from the final graph state.
+        """
+        if self.assistant_message.content.strip() or not self.final_state:
+            return
+
+        messages = self.final_state.get("messages") or []
+        if messages and isinstance(messages[-1], AIMessage):
+            self.turn_metrics.mark_token()
+            await self.assistant_message.stream_token(messages[-1].content)
+
+    def record_turn_metrics(self, status: str) -> None:
+        """Record the turn metrics and finish the tracing of the turn.
+
+        The trace of the turn is sent to Langfuse if the tracing policy keeps it,
+        and the turn metrics are optionally attached to it as scores.
+
+        Args:
+            status: The outcome of the turn, e.g. `success`, `cancelled` or `error`.
+        """
+        self.turn_summary = self.turn_metrics.finish(status=status)
+
+        scores = None
+        if env_settings.enable_langfuse_metric_scores is True:
+            scores = self.turn_summary
+
+        if isinstance(self.lf_cb_handler, TracingCallbackHandler):
+            is_traced = self.lf_cb_handler.finish(
+                status=status,
+                duration=self.turn_summary["turn_duration"],
+                scores=scores,
+            )
+
+            # NOTE: Only link traces that are sent to Langfuse
+            if is_traced is True:
+                self.trace_id = self.lf_cb_handler.trace_id
+        elif scores is not None:
+            record_langfuse_scores(
+                trace_id=getattr(self.lf_cb_handler, "last_trace_id", None),
+                summary=scores,
+            )
+
+    async def stream_graph_chunk(self, stream_mode: str, chunk) -> None:
+        """Stream a chunk of the `messages` or `values` graph stream.
+
+        Examples:
+            >>> await runner.stream_graph_chunk("messages", (chunk, {"langgraph_node": "generate"}))
+
+        Args:
+            stream_mode: The stream mode the chunk belongs to.
+            chunk: A tuple of the message chunk and its metadata for the `messages`
+                stream mode, the whole graph state for the `values` stream mode.
+
+        Returns:
+            None
+        """
+        if stream_mode == "values":
+            self.final_state = chunk
+            return
+
+        message, metadata = chunk
+
+        # NOTE: Whole messages returned by the nodes are also streamed, skip them
+        if not isinstance(message, AIMessageChunk):
+            return
+
+        if metadata.get("langgraph_node") not in self.graph_streamable_node_names:
+            return
+
+        if message.content:
+            self.turn_metrics.mark_token()
+            await self.token_coalescer.add(message.content)
 
     async def stream_llm_response(self, event: dict):
         """Stream the LLM response to the assistant message.
@@ -96,8 +320,9 @@ class GraphRunner:
             None
 
         Notes:
-            The method updates the assistant_message.content when streaming tokens.
-            It also captures the run_id for Langfuse tracking when the chain ends.
+            The tokens are coalesced before updating the assistant_message.content,
+            the buffer is flushed when the graph run ends.
+            It also captures the final graph state when the root chain ends.
         """
         event_kind = event["event"]
         langgraph_node = event["metadata"].get("langgraph_node", None)
@@ -111,10 +336,9 @@ class GraphRunner:
 
             if ai_message_content:
                 # NOTE: This automatically updates the assistant_message.content
-                await self.assistant_message.stream_token(ai_message_content)
+                self.turn_metrics.mark_token()
+                await self.token_coalescer.add(ai_message_content)
 
-        # TODO: Find out more robust way to get run_id for langfuse
-        if event["event"] == "on_chain_end":
-            run_id = event.get("run_id")
-            self.run_id = run_id
-            logger.debug(f"Langfuse Run ID: {run_id}")
+        # NOTE: The root run id is set upfront, only the final state is taken here
+        if event_kind == "on_chain_end" and not event.get("parent_ids"):
+            self.final_state = event["data"].get("output")
@@ -0,0 +1,118 @@
+"""Cached Langfuse credential and project metadata.
+
+Checking the Langfuse credentials and fetching the project id are blocking network
+round-trips. They are done once at startup and refreshed in the background every
+`LANGFUSE_METADATA_TTL` seconds, so building Langfuse URLs for a session or a turn is
+local string formatting and never waits for Langfuse.
+
+Examples:
+    >>> await langfuse_metadata.arefresh()
+    >>> langfuse_metadata.project_id
+    'cm5a4jaff0006r8yk44cvas5a'
+
+The module contains the following:
+
+- `LangfuseMetadata` - Caches the credential check and the project id.
+- `langfuse_metadata` - The process wide instance.
+"""
+
+import asyncio
+import time
+
+from langfuse import get_client
+from loguru import logger
+
+from podflix.env_settings import env_settings
+
+
+class LangfuseMetadata:
+    """Cache the Langfuse credential check and project id with a TTL.
+
+    Args:
+        ttl: Seconds between two background refreshes.
+    """
+
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+
+        self.project_id: str | None = None
+        self.credentials_valid: bool | None = None
+        self.refreshed_at: float | None = None
+
+        self._refresh_task: asyncio.Task | None = None
+        self._periodic_task: asyncio.Task | None = None
+
+    def is_stale(self) -> bool:
+        """Whether the metadata was never fetched or is older than the TTL."""
+        return (
+            self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.ttl
+        )
+
+    def refresh(self) -> bool:
+        """Fetch the project of the credentials, blocking until Langfuse answers.
+
+        A single project request both checks the credentials and returns the project
+        id. On failure, the last known project id is kept.
+
+        Returns:
+            True if the credentials are valid.
+        """
+        try:
+            projects = get_client().api.projects.get()
+
+            if not projects.data:
+                raise Exception("No Langfuse project found for the credentials")
+        except Exception as e:
+            logger.error(f"Langfuse Auth Check Error: {e}")
+            self.credentials_valid = False
+        else:
+            logger.debug("Langfuse Auth Check Passed")
+            self.credentials_valid = True
+            self.project_id = projects.data[0].id
+
+        self.refreshed_at = time.monotonic()
+
+        return self.credentials_valid
+
+    async def arefresh(self) -> bool:
+        """Fetch the project of the credentials in a worker thread.
+
+        Returns:
+            True if the credentials are valid.
+        """
+        return await asyncio.to_thread(self.refresh)
+
+    def refresh_in_background(self) -> None:
+        """Schedule a refresh if the metadata is stale and no refresh is running."""
+        if self.is_stale() is False:
+            return
+
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+
+        try:
+            self._refresh_task = asyncio.get_running_loop().create_task(self.arefresh())
+        except RuntimeError:
+            logger.debug("No running event loop to refresh the Langfuse metadata")
+
+    def start(self) -> None:
+        """Start refreshing the metadata periodically."""
+        if self._periodic_task is None or self._periodic_task.done():
+            self._periodic_task = asyncio.create_task(self._refresh_periodically())
+
+    def stop(self) -> None:
+        """Stop the periodic refresh."""
+        for task in (self._periodic_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+
+        self._periodic_task = None
+        self._refresh_task = None
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl)
+            await self.arefresh()
+
+
+langfuse_metadata = LangfuseMetadata(ttl=env_settings.langfuse_metadata_ttl)
@@ -0,0 +1,701 @@
+"""Library level search index over all ingested transcripts.
+
+Transcripts are split into chunks, embedded and stored in one approximate nearest
+neighbour shard per show. A query only touches the shard of the requested show or,
+without a show filter, searches all shards and merges the results. The other
+metadata filters (user and publish date) are applied on an over-fetched candidate
+list, widened until enough chunks match or the whole shard is searched.
+
+An episode is embedded once, whoever ingests it. Every user ingesting it becomes one
+of its owners, and the user filter matches the episodes the user owns.
+
+Shards use HNSW graphs when the optional `hnswlib` package is installed, with the
+`library` extra, e.g. `uv sync --extra library`. Otherwise they fall back to an exact
+cosine search scanning every chunk of a shard, which is only suitable for small
+libraries.
+
+New chunks are appended to the persisted shards, the HNSW graphs, which can only be
+saved whole, are saved at most every `save_delay` seconds and on shutdown. Chunks whose
+vectors were not saved before a crash are dropped on load, so their episodes are
+ingested again.
+
+Examples:
+    >>> await index_transcript(segments, episode_id="abc", show="my-show", user_id="admin")
+    >>> results = await search_library("What about RAG?", show="my-show")
+    >>> chunk, score = results[0]
+
+The module contains the following:
+
+- `LibraryChunk` - A transcript chunk with its metadata.
+- `chunk_segments(segments, max_chars)` - Merges transcript segments into chunks.
+- `ShardedLibraryIndex` - The show sharded vector index.
+- `get_library_index()` - Returns the process wide library index.
+- `aget_library_index()` - Returns the process wide library index, loaded in a thread.
+- `flush_library_index()` - Saves the pending changes of the process wide index.
+- `index_transcript(...)` - Embeds and adds a transcript to the library.
+- `search_library(...)` - Searches the library with metadata filters.
+"""
+
+import asyncio
+import json
+import threading
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+
+from loguru import logger
+
+from podflix.env_settings import env_settings
+from podflix.utils.answer_cache import cosine_similarity
+from podflix.utils.general import get_content_hash, is_module_installed
+from podflix.utils.model import get_embedding_model
+
+
+@dataclass
+class LibraryChunk:
+    """A chunk of an episode transcript with its metadata.
+
+    The `user_id` is the user who ingested the episode first, the users allowed to
+    find it are the owners of the episode kept by the index.
+    """
+
+    chunk_id: int
+    episode_id: str
+    show: str
+    user_id: str
+    published_at: str
+    text: str
+    start: float
+    end: float
+
+
+def chunk_segments(segments: list[dict], max_chars: int = 1000) -> list[dict]:
+    """Merge consecutive transcript segments into chunks of a bounded size.
+
+    Examples:
+        >>> segments = [
+        ...     {"start": 0.0, "end": 1.0, "text": "Hello"},
+        ...     {"start": 1.0, "end": 2.0, "text": "world"},
+        ... ]
+        >>> chunk_segments(segments)
+        [{'text': 'Hello world', 'start': 0.0, 'end': 2.0}]
+
+    Args:
+        segments: The transcript segments with `start`, `end` and `text` keys.
+        max_chars: The maximum number of characters of a chunk.
+
+    Returns:
+        A list of chunks with `text`, `start` and `end` keys.
+    """
+    chunks: list[dict] = []
+    current: dict | None = None
+
+    for segment in segments:
+        text = segment["text"].strip()
+        if not text:
+            continue
+
+        if current is not None and len(current["text"]) + len(text) < max_chars:
+            current["text"] = f"{current['text']} {text}"
+            current["end"] = segment["end"]
+            continue
+
+        current = {"text": text, "start": segment["start"], "end": segment["end"]}
+        chunks.append(current)
+
+    return chunks
+
+
+class ExactShard:
+    """Exact cosine search shard used when `hnswlib` is not installed."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vectors: dict[int, list[float]] = {}
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._vectors)
+
+    def add(self, ids: list[int], vectors: list[list[float]]) -> None:
+        """Add vectors with the given ids to the shard."""
+        self._vectors.update(zip(ids, vectors, strict=True))
+
+    def ids(self) -> set[int]:
+        """Return the ids of the vectors of the shard."""
+        return set(self._vectors)
+
+    def search(self, vector: list[float], k: int) -> list[tuple[int, float]]:
+        """Return the ids and similarities of the `k` most similar vectors."""
+        scores = [
+            (chunk_id, cosine_similarity(vector, candidate))
+            for chunk_id, candidate in self._vectors.items()
+        ]
+        return sorted(scores, key=lambda x: x[1], reverse=True)[:k]
+
+    def append(
+        self, directory: Path, ids: list[int], vectors: list[list[float]]
+    ) -> bool:
+        """Append the new vectors to the persisted shard.
+
+        Returns:
+            True, the shard is up to date on disk.
+        """
+        with (directory / "vectors.jsonl").open("a") as f:
+            for chunk_id, vector in zip(ids, vectors, strict=True):
+                f.write(json.dumps({"id": chunk_id, "vector": vector}) + "\n")
+
+        return True
+
+    def save(self, directory: Path) -> None:
+        """Persist the shard vectors into the directory, replacing the appended ones."""
+        with (directory / "vectors.jsonl").open("w") as f:
+            for chunk_id, vector in self._vectors.items():
+                f.write(json.dumps({"id": chunk_id, "vector": vector}) + "\n")
+
+    def load(self, directory: Path) -> None:
+        """Load the shard vectors from the directory, if any were saved."""
+        vectors_path = directory / "vectors.jsonl"
+        if not vectors_path.exists():
+            return
+
+        with vectors_path.open("r") as f:
+            for line in f:
+                row = json.loads(line)
+                self._vectors[row["id"]] = row["vector"]
+
+
+class HnswShard:
+    """HNSW based approximate nearest neighbour shard."""
+
+    def __init__(
+        self,
+        dim: int,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        initial_capacity: int = 10_000,
+    ):
+        import hnswlib  # noqa: PLC0415
+
+        self.dim = dim
+        self.ef_search = ef_search
+        self._index = hnswlib.Index(space="cosine", dim=dim)
+        self._index.init_index(
+            max_elements=initial_capacity, M=m, ef_construction=ef_construction
+        )
+        self._index.set_ef(ef_search)
+
+    def __len__(self) -> int:  # noqa: D105
+        return self._index.get_current_count()
+
+    def add(self, ids: list[int], vectors: list[list[float]]) -> None:
+        """Add vectors with the given ids to the shard, growing it when needed."""
+        required_capacity = len(self) + len(ids)
+
+        if required_capacity > self._index.get_max_elements():
+            self._index.resize_index(max(required_capacity, 2 * len(self)))
+
+        self._index.add_items(vectors, ids)
+
+    def ids(self) -> set[int]:
+        """Return the ids of the vectors of the shard."""
+        return set(self._index.get_ids_list())
+
+    def append(
+        self, directory: Path, ids: list[int], vectors: list[list[float]]
+    ) -> bool:
+        """The graph can't be appended to, it must be saved whole.
+
+        Returns:
+            False, the shard must be saved.
+        """
+        return False
+
+    def search(self, vector: list[float], k: int) -> list[tuple[int, float]]:
+        """Return the ids and similarities of the `k` nearest vectors."""
+        k = min(k, len(self))
+        if k == 0:
+            return []
+
+        # NOTE: ef must be at least k to return k results
+        self._index.set_ef(max(self.ef_search, k))
+        labels, distances = self._index.knn_query([vector], k=k)
+
+        return [
+            (int(label), 1.0 - float(distance))
+            for label, distance in zip(labels[0], distances[0], strict=True)
+        ]
+
+    def save(self, directory: Path) -> None:
+        """Persist the HNSW graph into the directory."""
+        self._index.save_index(str(directory / "index.bin"))
+
+    def load(self, directory: Path) -> None:
+        """Load the HNSW graph from the directory, if it was saved."""
+        if not (directory / "index.bin").exists():
+            return
+
+        self._index.load_index(
+            str(directory / "index.bin"), allow_replace_deleted=False
+        )
+        self._index.set_ef(self.ef_search)
+
+
+class ShardedLibraryIndex:
+    """Vector index over the whole library, sharded by show.
+
+    Args:
+        directory: Optional directory the shards are persisted to.
+        use_hnsw: Whether to use HNSW shards. Defaults to using them if `hnswlib` is installed.
+        overfetch: Factor of extra candidates fetched to compensate for metadata
+            filters, and of the widening of the search when too few of them match.
+        save_delay: Seconds the shards that can't be appended to are saved after a
+            change, the changes meanwhile are saved together.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path | None = None,
+        use_hnsw: bool | None = None,
+        overfetch: int = 4,
+        save_delay: float = 5.0,
+    ):
+        if use_hnsw is None:
+            use_hnsw = is_module_installed("hnswlib")
+
+        self.directory = Path(directory) if directory is not None else None
+        self.use_hnsw = use_hnsw
+        self.overfetch = overfetch
+        self.save_delay = save_delay
+
+        self._shards: dict[str, ExactShard | HnswShard] = {}
+        self._chunks: dict[str, dict[int, LibraryChunk]] = {}
+        self._episode_owners: dict[str, set[str]] = {}
+        self._lock = threading.RLock()
+        self._unsaved_shows: set[str] = set()
+        self._save_timer: threading.Timer | None = None
+
+    def __len__(self) -> int:  # noqa: D105
+        return sum(len(chunks) for chunks in self._chunks.values())
+
+    def has_episode(self, episode_id: str, user_id: str | None = None) -> bool:
+        """Check whether the episode is already part of the library.
+
+        Args:
+            episode_id: The identifier of the episode.
+            user_id: Only check whether this user owns the episode.
+
+        Returns:
+            Whether the episode is in the library, and owned by the user if given.
+        """
+        owners = self._episode_owners.get(episode_id)
+
+        if owners is None:
+            return False
+
+        return user_id is None or user_id in owners
+
+    def add_owner(self, episode_id: str, user_id: str) -> bool:
+        """Let a user find an episode already in the library, without embedding it again.
+
+        Args:
+            episode_id: The identifier of the episode.
+            user_id: The identifier of the user ingesting the episode.
+
+        Returns:
+            Whether the episode is in the library.
+        """
+        with self._lock:
+            owners = self._episode_owners.get(episode_id)
+
+            if owners is None:
+                return False
+
+            if user_id in owners:
+                return True
+
+            owners.add(user_id)
+
+            if self.directory is not None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with (self.directory / "owners.jsonl").open("a") as f:
+                    f.write(
+                        json.dumps({"episode_id": episode_id, "user_id": user_id})
+                        + "\n"
+                    )
+
+        return True
+
+    def add_chunks(
+        self, show: str, chunks: list[LibraryChunk], vectors: list[list[float]]
+    ) -> None:
+        """Add embedded chunks of a show to its shard.
+
+        The `chunk_id` of the chunks is assigned by the index.
+
+        Args:
+            show: The show the chunks belong to.
+            chunks: The chunks to add.
+            vectors: The embeddings of the chunks.
+        """
+        if not chunks:
+            return
+
+        with self._lock:
+            shard = self._get_or_create_shard(show, dim=len(vectors[0]))
+            shard_chunks = self._chunks[show]
+
+            next_id = max(shard_chunks, default=-1) + 1
+            for offset, chunk in enumerate(chunks):
+                chunk.chunk_id = next_id + offset
+                shard_chunks[chunk.chunk_id] = chunk
+                self._episode_owners.setdefault(chunk.episode_id, set()).add(
+                    chunk.user_id
+                )
+
+            shard.add([chunk.chunk_id for chunk in chunks], vectors)
+
+            if self.directory is not None:
+                self._append_to_shard(show, chunks, vectors)
+
+    def search(  # noqa: PLR0913
+        self,
+        vector: list[float],
+        k: int = 5,
+        *,
+        show: str | None = None,
+        user_id: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+    ) -> list[tuple[LibraryChunk, float]]:
+        """Search the library for the chunks most similar to the vector.
+
+        Args:
+            vector: The query embedding.
+            k: The number of results to return.
+            show: Only search the shard of this show.
+            user_id: Only return chunks of the episodes owned by this user.
+            date_from: Only return chunks published on or after this ISO date.
+            date_to: Only return chunks published on or before this ISO date.
+
+        Returns:
+            A list of chunks and their similarity, ordered from the most similar.
+        """
+        shows = [show] if show is not None else list(self._shards)
+        filters = {"user_id": user_id, "date_from": date_from, "date_to": date_to}
+        has_filters = any(value is not None for value in filters.values())
+
+        results: list[tuple[LibraryChunk, float]] = []
+
+        with self._lock:
+            for shard_show in shows:
+                if shard_show not in self._shards:
+                    continue
+
+                if has_filters:
+                    results.extend(
+                        self._search_filtered(shard_show, vector, k, filters)
+                    )
+                else:
+                    shard_chunks = self._chunks[shard_show]
+                    results.extend(
+                        (shard_chunks[chunk_id], score)
+                        for chunk_id, score in self._shards[shard_show].search(
+                            vector, k
+                        )
+                    )
+
+        return sorted(results, key=lambda x: x[1], reverse=True)[:k]
+
+    def load(self) -> None:
+        """Load all persisted shards from the index directory."""
+        if self.directory is None or not self.directory.exists():
+            return
+
+        with self._lock:
+            for shard_directory in self.directory.iterdir():
+                chunks_path = shard_directory / "chunks.jsonl"
+                if not shard_directory.is_dir() or not chunks_path.exists():
+                    continue
+
+                with chunks_path.open("r") as f:
+                    chunks = [LibraryChunk(**json.loads(line)) for line in f]
+
+                if not chunks:
+                    continue
+
+                show = chunks[0].show
+                meta = json.loads((shard_directory / "meta.json").read_text())
+
+                shard = self._get_or_create_shard(show, dim=meta["dim"])
+                shard.load(shard_directory)
+
+                # NOTE: Later lines win, the ids of dropped chunks are reused
+                shard_chunks = {chunk.chunk_id: chunk for chunk in chunks}
+                shard_ids = shard.ids()
+                chunks = [
+                    chunk
+                    for chunk in shard_chunks.values()
+                    if chunk.chunk_id in shard_ids
+                ]
+
+                if len(chunks) < len(shard_chunks):
+                    logger.warning(
+                        f"Dropping {len(shard_chunks) - len(chunks)} chunks of {show} "
+                        "whose vectors were not saved"
+                    )
+
+                self._chunks[show] = {chunk.chunk_id: chunk for chunk in chunks}
+                for chunk in chunks:
+                    self._episode_owners.setdefault(chunk.episode_id, set()).add(
+                        chunk.user_id
+                    )
+
+            # NOTE: Owners of episodes whose chunks were all dropped are skipped, so
+            # the episode is ingested again instead of being found without chunks
+            owners_path = self.directory / "owners.jsonl"
+            if owners_path.exists():
+                with owners_path.open("r") as f:
+                    for line in f:
+                        owner = json.loads(line)
+                        owners = self._episode_owners.get(owner["episode_id"])
+                        if owners is not None:
+                            owners.add(owner["user_id"])
+
+        logger.debug(f"Loaded {len(self)} library chunks from {self.directory}")
+
+    def _matches(
+        self,
+        chunk: LibraryChunk,
+        *,
+        user_id: str | None,
+        date_from: str | None,
+        date_to: str | None,
+    ) -> bool:
+        if user_id is not None and not self.has_episode(chunk.episode_id, user_id):
+            return False
+        if date_from is not None and chunk.published_at < date_from:
+            return False
+
+        return date_to is None or chunk.published_at <= date_to
+
+    def _search_filtered(
+        self, show: str, vector: list[float], k: int, filters: dict
+    ) -> list[tuple[LibraryChunk, float]]:
+        shard = self._shards[show]
+        shard_chunks = self._chunks[show]
+        candidate_count = k * self.overfetch
+
+        # NOTE: Widened until k chunks match, e.g. for a user owning few episodes
+        while True:
+            matches = [
+                (shard_chunks[chunk_id], score)
+                for chunk_id, score in shard.search(vector, candidate_count)
+                if self._matches(shard_chunks[chunk_id], **filters)
+            ]
+
+            if len(matches) >= k or candidate_count >= len(shard):
+                return matches[:k]
+
+            candidate_count *= max(self.overfetch, 2)
+
+    def _get_or_create_shard(self, show: str, dim: int) -> ExactShard | HnswShard:
+        if show not in self._shards:
+            if self.use_hnsw is True:
+                self._shards[show] = HnswShard(
+                    dim=dim,
+                    m=env_settings.library_hnsw_m,
+                    ef_construction=env_settings.library_hnsw_ef_construction,
+                    ef_search=env_settings.library_hnsw_ef_search,
+                )
+            else:
+                self._shards[show] = ExactShard(dim=dim)
+
+            self._chunks[show] = {}
+
+        return self._shards[show]
+
+    def flush(self) -> None:
+        """Save the shards with changes that could not be appended."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+            for show in self._unsaved_shows:
+                self._shards[show].save(self._get_shard_directory(show))
+
+            self._unsaved_shows.clear()
+
+    def _get_shard_directory(self, show: str) -> Path:
+        return self.directory / get_content_hash(show)[:16]
+
+    def _append_to_shard(
+        self, show: str, chunks: list[LibraryChunk], vectors: list[list[float]]
+    ) -> None:
+        shard_directory = self._get_shard_directory(show)
+        shard = self._shards[show]
+
+        if not shard_directory.exists():
+            shard_directory.mkdir(parents=True)
+            (shard_directory / "meta.json").write_text(json.dumps({"dim": shard.dim}))
+
+        # NOTE: Chunks first, vectors without a chunk would break the searches
+        with (shard_directory / "chunks.jsonl").open("a") as f:
+            for chunk in chunks:
+                f.write(json.dumps(asdict(chunk)) + "\n")
+
+        if shard.append(shard_directory, [chunk.chunk_id for chunk in chunks], vectors):
+            return
+
+        self._unsaved_shows.add(show)
+
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+
+_library_index: ShardedLibraryIndex | None = None
+_library_index_lock = threading.Lock()
+
+
+def get_library_index() -> ShardedLibraryIndex:
+    """Return the process wide library index loaded from the library directory.
+
+    Loading reads every shard, use `aget_library_index` from the event loop.
+
+    Returns:
+        The shared ShardedLibraryIndex instance.
+    """
+    global _library_index  # noqa: PLW0603
+
+    with _library_index_lock:
+        if _library_index is None:
+            if not is_module_installed("hnswlib"):
+                logger.warning(
+                    "hnswlib is not installed, the library index falls back to exact "
+                    "search. Install the `library` extra for large libraries."
+                )
+
+            library_index = ShardedLibraryIndex(
+                directory=Path(env_settings.library_base_path) / "library_index"
+            )
+            library_index.load()
+            _library_index = library_index
+
+    return _library_index
+
+
+async def aget_library_index() -> ShardedLibraryIndex:
+    """Return the process wide library index, loading it without blocking the loop.
+
+    Returns:
+        The shared ShardedLibraryIndex instance.
+    """
+    if _library_index is not None:
+        return _library_index
+
+    return await asyncio.to_thread(get_library_index)
+
+
+def flush_library_index() -> None:
+    """Save the pending changes of the process wide index, if it was loaded."""
+    if _library_index is not None:
+        _library_index.flush()
+
+
+async def index_transcript(  # noqa: PLR0913
+    segments: list[dict],
+    *,
+    episode_id: str,
+    show: str,
+    user_id: str,
+    published_at: str | None = None,
+    library_index: ShardedLibraryIndex | None = None,
+) -> None:
+    """Chunk, embed and add a transcript to the library index.
+
+    Episodes that are already part of the library are not embedded again, the user
+    only becomes one of their owners.
+
+    Args:
+        segments: The transcript segments with `start`, `end` and `text` keys.
+        episode_id: The identifier of the episode, e.g. the transcript content hash.
+        show: The show the episode belongs to.
+        user_id: The identifier of the user ingesting the episode.
+        published_at: The ISO publish date of the episode. Defaults to today.
+        library_index: The index to add to. Defaults to the process wide index.
+    """
+    if library_index is None:
+        library_index = await aget_library_index()
+
+    if library_index.has_episode(episode_id):
+        logger.debug(f"Episode {episode_id} is already in the library index")
+
+        if not library_index.has_episode(episode_id, user_id=user_id):
+            await asyncio.to_thread(library_index.add_owner, episode_id, user_id)
+
+        return
+
+    if published_at is None:
+        published_at = date.today().isoformat()
+
+    chunks = [
+        LibraryChunk(
+            chunk_id=-1,
+            episode_id=episode_id,
+            show=show,
+            user_id=user_id,
+            published_at=published_at,
+            **chunk,
+        )
+        for chunk in chunk_segments(segments)
+    ]
+
+    if not chunks:
+        return
+
+    vectors = await get_embedding_model().aembed_documents(
+        [chunk.text for chunk in chunks]
+    )
+
+    await asyncio.to_thread(library_index.add_chunks, show, chunks, vectors)
+
+    logger.debug(f"Added {len(chunks)} chunks of episode {episode_id} to the library")
+
+
+async def search_library(  # noqa: PLR0913
+    query: str,
+    k: int = 5,
+    *,
+    show: str | None = None,
+    user_id: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+) -> list[tuple[LibraryChunk, float]]:
+    """Embed the query and search the library index.
+
+    Args:
+        query: The question of the user.
+        k: The number of results to return.
+        show: Only search the episodes of this show.
+        user_id: Only return episodes owned by this user.
+        date_from: Only return episodes published on or after this ISO date.
+        date_to: Only return episodes published on or before this ISO date.
+
+    Returns:
+        A list of chunks and their similarity, ordered from the most similar.
+    """
+    vector = await get_embedding_model().aembed_query(query)
+    library_index = await aget_library_index()
+
+    return await asyncio.to_thread(
+        library_index.search,
+        vector,
+        k,
+        show=show,
+        user_id=user_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
@@ -0,0 +1,487 @@
+"""Client side load balancing over multiple model backend endpoints.
+
+Each backend (the chat model and whisper) can be served by several OpenAI compatible
+endpoints. Requests are routed on the HTTP transport level, so the same balancing
+works for `ChatOpenAI`, the plain `AsyncOpenAI` client of the base chat and the
+transcription requests.
+
+- Routing uses the power of two choices: two random available endpoints are compared
+  by their in-flight requests weighted with the EWMA of their latency.
+- An endpoint failing `ENDPOINT_FAILURE_THRESHOLD` times in a row is taken out of the
+  rotation for `ENDPOINT_COOLDOWN` seconds (circuit breaker). Failed requests fail over
+  to another endpoint while no response was returned yet.
+- Background health checks close the circuit of endpoints that came back.
+- With `ENDPOINT_HEDGE_DELAY_MS`, a request without a first response chunk after the
+  delay is also sent to a second endpoint, and the first one to answer wins.
+
+Examples:
+    >>> http_client = get_load_balanced_http_client("model")
+    >>> client = AsyncOpenAI(base_url=f"{env_settings.model_api_base}/v1", http_client=http_client)
+
+The module contains the following:
+
+- `Endpoint` - The routing state of a single endpoint.
+- `EndpointPool` - Selects endpoints and tracks their health.
+- `LoadBalancingTransport` - httpx transport routing requests through a pool.
+- `get_endpoint_pool(backend)` - Returns the pool of a backend.
+- `get_load_balanced_http_client(backend)` - Returns an httpx client for a backend.
+- `start_health_checks()` / `stop_health_checks()` - Manage the health check tasks.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from functools import cache
+from typing import AsyncIterator, Callable
+
+import httpx
+from loguru import logger
+from openai import DefaultAsyncHttpxClient
+
+from podflix.env_settings import env_settings
+
+RETRYABLE_STATUS_CODES = frozenset({502, 503, 504})
+HEALTH_CHECK_TIMEOUT = 5.0
+# NOTE: Endpoints without latency samples yet are preferred, so they get explored
+MIN_LATENCY = 1e-3
+
+
+@dataclass
+class Endpoint:
+    """The routing state of a single endpoint."""
+
+    url: str
+    in_flight: int = 0
+    ewma_latency: float | None = None
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+
+    def is_available(self, now: float) -> bool:
+        """Whether the circuit of the endpoint is closed or half-open."""
+        return self.open_until <= now
+
+    def score(self) -> float:
+        """The expected cost of sending one more request to the endpoint."""
+        return (self.in_flight + 1) * max(self.ewma_latency or 0.0, MIN_LATENCY)
+
+
+class EndpointPool:
+    """Select endpoints of a backend and track their latency and health.
+
+    Args:
+        urls: The base URLs of the endpoints, the first one is the configured base URL.
+        failure_threshold: Consecutive failures opening the circuit of an endpoint.
+        cooldown: Seconds an open circuit keeps the endpoint out of the rotation.
+        ewma_alpha: Weight of the latest latency in the latency EWMA.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        ewma_alpha: float = 0.3,
+    ):
+        self.endpoints = [Endpoint(url=url.rstrip("/")) for url in dict.fromkeys(urls)]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self.endpoints)
+
+    @property
+    def primary_url(self) -> str:
+        """The base URL the clients are configured with."""
+        return self.endpoints[0].url
+
+    def choose(self, exclude: set[str] | None = None) -> Endpoint | None:
+        """Choose the endpoint of the next request with the power of two choices.
+
+        Args:
+            exclude: URLs of endpoints already tried for the request.
+
+        Returns:
+            The chosen endpoint, or None if all endpoints are excluded.
+        """
+        exclude = exclude or set()
+        candidates = [
+            endpoint for endpoint in self.endpoints if endpoint.url not in exclude
+        ]
+
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        available = [endpoint for endpoint in candidates if endpoint.is_available(now)]
+
+        # NOTE: When all circuits are open, try the endpoint closest to recovery
+        if not available:
+            return min(candidates, key=lambda endpoint: endpoint.open_until)
+
+        if len(available) == 1:
+            return available[0]
+
+        first, second = random.sample(available, 2)
+        return first if first.score() <= second.score() else second
+
+    def record_success(self, endpoint: Endpoint, latency: float | None = None) -> None:
+        """Close the circuit of the endpoint and update its latency EWMA."""
+        endpoint.consecutive_failures = 0
+        endpoint.open_until = 0.0
+
+        if latency is None:
+            return
+
+        if endpoint.ewma_latency is None:
+            endpoint.ewma_latency = latency
+        else:
+            endpoint.ewma_latency = (
+                self.ewma_alpha * latency
+                + (1 - self.ewma_alpha) * endpoint.ewma_latency
+            )
+
+    def record_failure(self, endpoint: Endpoint) -> None:
+        """Count a failure and open the circuit once the threshold is reached."""
+        endpoint.consecutive_failures += 1
+
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.open_until = time.monotonic() + self.cooldown
+            logger.warning(
+                f"Endpoint {endpoint.url} failed {endpoint.consecutive_failures} times, "
+                f"removed from the rotation for {self.cooldown}s"
+            )
+
+    def rewrite_request(
+        self, request: httpx.Request, endpoint: Endpoint
+    ) -> httpx.Request:
+        """Return a copy of the request sent to the given endpoint."""
+        url = str(request.url)
+
+        if url.startswith(self.primary_url):
+            url = endpoint.url + url[len(self.primary_url) :]
+
+        headers = request.headers.copy()
+        headers.pop("host", None)
+
+        return httpx.Request(
+            method=request.method,
+            url=url,
+            headers=headers,
+            content=request.content,
+            extensions=request.extensions,
+        )
+
+    async def check_health(self, client: httpx.AsyncClient) -> None:
+        """Probe the `/v1/models` route of every endpoint and update its circuit."""
+
+        async def check_endpoint(endpoint: Endpoint) -> None:
+            try:
+                response = await client.get(f"{endpoint.url}/v1/models")
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                logger.debug(f"Health check of {endpoint.url} failed: {e!r}")
+                self.record_failure(endpoint)
+            else:
+                self.record_success(endpoint)
+
+        await asyncio.gather(*[check_endpoint(endpoint) for endpoint in self.endpoints])
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """Response stream releasing its endpoint when the response is closed."""
+
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        on_close: Callable[[], None],
+        iterator: AsyncIterator[bytes] | None = None,
+        first_chunk: bytes = b"",
+    ):
+        self._stream = stream
+        self._on_close = on_close
+        self._iterator = iterator
+        self._first_chunk = first_chunk
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:  # noqa: D105
+        if self._first_chunk:
+            yield self._first_chunk
+
+        async for chunk in self._iterator or self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:  # noqa: D102
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._closed is False:
+                self._closed = True
+                self._on_close()
+
+
+class LoadBalancingTransport(httpx.AsyncBaseTransport):
+    """httpx transport routing the requests through an endpoint pool.
+
+    Args:
+        pool: The endpoint pool of the backend.
+        hedge_delay_ms: Milliseconds without a first response chunk before the request
+            is hedged to a second endpoint. 0 disables hedging.
+        transport: The transport sending the requests. Defaults to a new HTTP transport.
+    """
+
+    def __init__(
+        self,
+        pool: EndpointPool,
+        hedge_delay_ms: int = 0,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.pool = pool
+        self.hedge_delay = hedge_delay_ms / 1000
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send the request to the best endpoint, failing over to the others."""
+        # NOTE: Read the body once, so it can be sent again on failover and hedging
+        await request.aread()
+
+        tried: set[str] = set()
+        last_error: Exception | None = None
+
+        while (endpoint := self.pool.choose(exclude=tried)) is not None:
+            tried.add(endpoint.url)
+            is_last_attempt = len(tried) == len(self.pool)
+
+            try:
+                if self.hedge_delay > 0 and not is_last_attempt:
+                    response = await self._send_hedged(request, endpoint, tried)
+                else:
+                    response = await self._send(request, endpoint)
+            except httpx.TransportError as e:
+                logger.warning(f"Request to {endpoint.url} failed, failing over: {e!r}")
+                last_error = e
+                continue
+
+            if response.status_code in RETRYABLE_STATUS_CODES and not is_last_attempt:
+                await response.aclose()
+                continue
+
+            return response
+
+        raise last_error or httpx.ConnectError("No endpoint available", request=request)
+
+    async def aclose(self) -> None:  # noqa: D102
+        await self._transport.aclose()
+
+    async def _send(
+        self, request: httpx.Request, endpoint: Endpoint, read_first_chunk: bool = False
+    ) -> httpx.Response:
+        endpoint.in_flight += 1
+        start_time = time.monotonic()
+
+        def release() -> None:
+            endpoint.in_flight -= 1
+
+        try:
+            response = await self._transport.handle_async_request(
+                self.pool.rewrite_request(request, endpoint)
+            )
+
+            iterator = None
+            first_chunk = b""
+            if read_first_chunk is True:
+                iterator = aiter(response.stream)
+                first_chunk = await anext(iterator, b"")
+        except httpx.TransportError:
+            release()
+            self.pool.record_failure(endpoint)
+            raise
+        except BaseException:
+            release()
+            raise
+
+        if response.status_code >= min(RETRYABLE_STATUS_CODES):
+            self.pool.record_failure(endpoint)
+        else:
+            self.pool.record_success(endpoint, latency=time.monotonic() - start_time)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=TrackedStream(
+                response.stream,
+                on_close=release,
+                iterator=iterator,
+                first_chunk=first_chunk,
+            ),
+            extensions=response.extensions,
+        )
+
+    async def _send_hedged(
+        self, request: httpx.Request, endpoint: Endpoint, tried: set[str]
+    ) -> httpx.Response:
+        primary = asyncio.create_task(
+            self._send(request, endpoint, read_first_chunk=True)
+        )
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+
+        if done:
+            return primary.result()
+
+        backup_endpoint = self.pool.choose(exclude=tried)
+        if backup_endpoint is None:
+            return await primary
+
+        tried.add(backup_endpoint.url)
+        logger.debug(f"Hedging slow request of {endpoint.url} to {backup_endpoint.url}")
+
+        backup = asyncio.create_task(
+            self._send(request, backup_endpoint, read_first_chunk=True)
+        )
+        pending = {primary, backup}
+        winner = None
+
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = _pick_hedged_winner(
+                    [task for task in (primary, backup) if task in done]
+                )
+
+            # NOTE: Both requests failed, raise the error of the primary request
+            winner = winner or primary
+            return winner.result()
+        finally:
+            # NOTE: Close every other response, so its endpoint is released
+            for task in (primary, backup):
+                if task is winner:
+                    continue
+
+                task.cancel()
+                task.add_done_callback(_close_late_response)
+
+
+def _pick_hedged_winner(done: list[asyncio.Task]) -> asyncio.Task | None:
+    """Return the completed request to answer with, preferring successful statuses."""
+    responses = [task for task in done if task.exception() is None]
+
+    for task in responses:
+        if task.result().status_code < min(RETRYABLE_STATUS_CODES):
+            return task
+
+    return responses[0] if responses else None
+
+
+late_response_tasks: set[asyncio.Task] = set()
+
+
+def _close_late_response(task: asyncio.Task) -> None:
+    if task.cancelled() or task.exception() is not None:
+        return
+
+    close_task = asyncio.create_task(task.result().aclose())
+    late_response_tasks.add(close_task)
+    close_task.add_done_callback(late_response_tasks.discard)
+
+
+def get_backend_urls(backend: str) -> list[str]:
+    """Return the endpoint URLs of a backend, the configured base URL first.
+
+    Args:
+        backend: Either `model` or `whisper`.
+
+    Returns:
+        The base URLs of the endpoints.
+    """
+    if backend == "model":
+        if env_settings.enable_openai_api is True:
+            return [env_settings.model_api_base]
+
+        return [env_settings.model_api_base, *env_settings.model_api_replicas]
+
+    if backend == "whisper":
+        return [env_settings.whisper_api_base, *env_settings.whisper_api_replicas]
+
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+@cache
+def get_endpoint_pool(backend: str) -> EndpointPool:
+    """Return the process wide endpoint pool of a backend.
+
+    Args:
+        backend: Either `model` or `whisper`.
+
+    Returns:
+        The EndpointPool of the backend.
+    """
+    return EndpointPool(
+        urls=get_backend_urls(backend),
+        failure_threshold=env_settings.endpoint_failure_threshold,
+        cooldown=env_settings.endpoint_cooldown,
+        ewma_alpha=env_settings.endpoint_latency_ewma_alpha,
+    )
+
+
+@cache
+def get_load_balanced_http_client(backend: str) -> httpx.AsyncClient | None:
+    """Return the shared httpx client balancing the requests of a backend.
+
+    Args:
+        backend: Either `model` or `whisper`.
+
+    Returns:
+        The httpx client, or None if the backend has a single endpoint.
+    """
+    pool = get_endpoint_pool(backend)
+
+    if len(pool) == 1:
+        return None
+
+    return DefaultAsyncHttpxClient(
+        transport=LoadBalancingTransport(
+            pool=pool, hedge_delay_ms=env_settings.endpoint_hedge_delay_ms
+        )
+    )
+
+
+health_check_tasks: set[asyncio.Task] = set()
+
+
+async def run_health_checks(pool: EndpointPool, interval: float) -> None:
+    """Periodically probe the endpoints of a pool.
+
+    Args:
+        pool: The endpoint pool to probe.
+        interval: Seconds between two probes.
+    """
+    async with httpx.AsyncClient(timeout=HEALTH_CHECK_TIMEOUT) as client:
+        while True:
+            await pool.check_health(client)
+            await asyncio.sleep(interval)
+
+
+def start_health_checks() -> None:
+    """Start the health checks of all backends with multiple endpoints."""
+    if env_settings.endpoint_health_check_interval == 0:
+        return
+
+    for backend in ("model", "whisper"):
+        pool = get_endpoint_pool(backend)
+
+        if len(pool) > 1:
+            task = asyncio.create_task(
+                run_health_checks(pool, env_settings.endpoint_health_check_interval)
+            )
+            health_check_tasks.add(task)
+
+
+def stop_health_checks() -> None:
+    """Cancel the running health checks."""
+    for task in health_check_tasks:
+        task.cancel()
+
+    health_check_tasks.clear()
@@ -0,0 +1,283 @@
+"""Latency and throughput instrumentation of the chat turns.
+
+Every chat turn records its time to first token, tokens per second and total duration,
+labelled by model and chat profile. Graph node, transcription and SQL statement
+durations and the wait for a pooled database connection are recorded separately. The
+measurements are exposed as Prometheus histograms and can be attached to the Langfuse
+trace of the turn as scores. Cache hits and misses,
+dropped traces, slow queries and maintained rows are counted separately.
+
+Examples:
+    >>> turn_metrics = TurnMetrics(model="gpt-4o-mini", profile="audio")
+    >>> turn_metrics.mark_token()
+    >>> summary = turn_metrics.finish()
+    >>> sorted(summary)
+    ['time_to_first_token', 'tokens', 'tokens_per_second', 'turn_duration']
+
+The module contains the following:
+
+- `TurnMetrics` - Collects the measurements of a single chat turn.
+- `NodeTimingCallbackHandler` - Callback handler recording graph node durations.
+- `observe_duration(metric_name, **labels)` - Context manager recording a duration.
+- `increment(metric_name, amount, **labels)` - Increments a counter.
+- `record_langfuse_scores(trace_id, summary)` - Attaches a turn summary to a trace.
+- `get_metrics_payload()` - Returns the Prometheus exposition of the metrics.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langfuse import get_client
+from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120)
+THROUGHPUT_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+TRANSCRIPTION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+DB_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30)
+
+HISTOGRAMS = {
+    "time_to_first_token": Histogram(
+        "podflix_time_to_first_token_seconds",
+        "Seconds from the user message to the first generated token.",
+        ["model", "profile"],
+        buckets=LATENCY_BUCKETS,
+    ),
+    "tokens_per_second": Histogram(
+        "podflix_tokens_per_second",
+        "Generated tokens per second after the first token.",
+        ["model", "profile"],
+        buckets=THROUGHPUT_BUCKETS,
+    ),
+    "turn_duration": Histogram(
+        "podflix_turn_duration_seconds",
+        "Seconds from the user message to the end of the answer.",
+        ["model", "profile", "status"],
+        buckets=LATENCY_BUCKETS,
+    ),
+    "node_duration": Histogram(
+        "podflix_node_duration_seconds",
+        "Seconds spent in a graph node, e.g. retrieval or generation.",
+        ["node"],
+        buckets=LATENCY_BUCKETS,
+    ),
+    "transcription_duration": Histogram(
+        "podflix_transcription_duration_seconds",
+        "Seconds spent transcribing an episode.",
+        ["source"],
+        buckets=TRANSCRIPTION_BUCKETS,
+    ),
+    "db_pool_wait": Histogram(
+        "podflix_db_pool_wait_seconds",
+        "Seconds spent waiting for a connection of the database pool.",
+        ["pool"],
+        buckets=DB_LATENCY_BUCKETS,
+    ),
+    "db_query_duration": Histogram(
+        "podflix_db_query_duration_seconds",
+        "Seconds spent executing a SQL statement, by statement fingerprint.",
+        ["operation", "fingerprint"],
+        buckets=DB_LATENCY_BUCKETS,
+    ),
+}
+
+COUNTERS = {
+    "completion_cache_requests": Counter(
+        "podflix_completion_cache_requests",
+        "Lookups of the deterministic completion cache.",
+        ["result"],
+    ),
+    "trace_buffer_dropped": Counter(
+        "podflix_trace_buffer_dropped",
+        "Tracing work dropped because Langfuse could not keep up.",
+    ),
+    "db_slow_queries": Counter(
+        "podflix_db_slow_queries",
+        "SQL statements slower than the slow query threshold.",
+        ["operation", "fingerprint"],
+    ),
+    "db_maintenance_rows": Counter(
+        "podflix_db_maintenance_rows",
+        "Rows archived, deleted or purged by the maintenance job.",
+        ["task"],
+    ),
+}
+
+
+def observe(metric_name: str, value: float, **labels: str) -> None:
+    """Record a value into a histogram.
+
+    Args:
+        metric_name: The name of the histogram, e.g. `turn_duration`.
+        value: The observed value.
+        **labels: The label values of the histogram.
+    """
+    histogram = HISTOGRAMS.get(metric_name)
+
+    if histogram is not None:
+        histogram.labels(**labels).observe(value)
+
+
+def increment(metric_name: str, amount: float = 1, **labels: str) -> None:
+    """Increment a counter.
+
+    Args:
+        metric_name: The name of the counter, e.g. `completion_cache_requests`.
+        amount: The increment of the counter.
+        **labels: The label values of the counter.
+    """
+    counter = COUNTERS.get(metric_name)
+
+    if counter is None:
+        return
+
+    if labels:
+        counter = counter.labels(**labels)
+
+    counter.inc(amount)
+
+
+@contextmanager
+def observe_duration(metric_name: str, **labels: str) -> Iterator[None]:
+    """Record the duration of the block into a histogram.
+
+    Examples:
+        >>> with observe_duration("transcription_duration", source="youtube"):
+        ...     transcription = await fetch_youtube_transcription(url)
+
+    Args:
+        metric_name: The name of the histogram.
+        **labels: The label values of the histogram.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric_name, time.perf_counter() - start_time, **labels)
+
+
+class TurnMetrics:
+    """Collect the latency and throughput measurements of a single chat turn.
+
+    The streamed chunks are counted as tokens, which matches the one token per chunk
+    streaming of the OpenAI compatible backends.
+
+    Args:
+        model: The name of the model answering the turn.
+        profile: The application or chat profile of the turn.
+    """
+
+    def __init__(self, model: str, profile: str):
+        self.model = model
+        self.profile = profile
+
+        self.start_time = time.perf_counter()
+        self.first_token_time: float | None = None
+        self.tokens = 0
+
+    def mark_token(self) -> None:
+        """Record that a token was generated."""
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+
+        self.tokens += 1
+
+    def finish(self, status: str = "success") -> dict[str, float]:
+        """Record the measurements of the turn into the histograms.
+
+        Args:
+            status: The outcome of the turn, e.g. `success`, `cancelled` or `error`.
+
+        Returns:
+            A summary of the turn measurements.
+        """
+        end_time = time.perf_counter()
+        labels = {"model": self.model, "profile": self.profile}
+
+        summary = {
+            "turn_duration": end_time - self.start_time,
+            "tokens": float(self.tokens),
+        }
+        observe("turn_duration", summary["turn_duration"], status=status, **labels)
+
+        if self.first_token_time is not None:
+            summary["time_to_first_token"] = self.first_token_time - self.start_time
+            observe("time_to_first_token", summary["time_to_first_token"], **labels)
+
+            generation_time = end_time - self.first_token_time
+            if self.tokens > 1 and generation_time > 0:
+                summary["tokens_per_second"] = (self.tokens - 1) / generation_time
+                observe("tokens_per_second", summary["tokens_per_second"], **labels)
+
+        logger.debug(f"Turn metrics: {summary}")
+
+        return summary
+
+
+class NodeTimingCallbackHandler(BaseCallbackHandler):
+    """Record the duration of every graph node run into the node histogram."""
+
+    def __init__(self):
+        self._node_runs: dict[UUID, tuple[str, float]] = {}
+
+    def on_chain_start(  # noqa: D102
+        self,
+        serialized: dict[str, Any],
+        inputs: dict[str, Any],
+        *,
+        run_id: UUID,
+        metadata: dict[str, Any] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        node = (metadata or {}).get("langgraph_node")
+
+        # NOTE: Only the node run itself, not the runnables called inside of it
+        if node is not None and kwargs.get("name") == node:
+            self._node_runs[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:  # noqa: D102
+        self._observe_node(run_id)
+
+    def on_chain_error(  # noqa: D102
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._observe_node(run_id)
+
+    def _observe_node(self, run_id: UUID) -> None:
+        node_run = self._node_runs.pop(run_id, None)
+
+        if node_run is not None:
+            node, start_time = node_run
+            observe("node_duration", time.perf_counter() - start_time, node=node)
+
+
+def record_langfuse_scores(trace_id: str | None, summary: dict[str, float]) -> None:
+    """Attach the measurements of a turn to its Langfuse trace as scores.
+
+    Args:
+        trace_id: The Langfuse trace id of the turn. Nothing is recorded if None.
+        summary: The summary returned by `TurnMetrics.finish`.
+    """
+    if trace_id is None:
+        return
+
+    try:
+        client = get_client()
+        for name, value in summary.items():
+            client.create_score(
+                trace_id=trace_id, name=name, value=value, data_type="NUMERIC"
+            )
+    except Exception as e:
+        logger.warning(f"Could not record the turn metrics in Langfuse: {e}")
+
+
+def get_metrics_payload() -> tuple[bytes, str]:
+    """Return the Prometheus exposition of the metrics.
+
+    Returns:
+        A tuple of the payload and its content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -5,13 +5,14 @@ from typing import Any, BinaryIO
 
 from langchain_core.language_models.fake_chat_models import FakeListChatModel
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from openai import AsyncOpenAI
 from openai.types import AudioResponseFormat
 from openai.types.audio.transcription import Transcription
 from openai.types.audio.transcription_verbose import TranscriptionVerbose
 
 from podflix.env_settings import env_settings
+from podflix.utils.load_balancer import get_load_balanced_http_client
 
 
 def get_mock_model(
@@ -76,10 +77,37 @@ def get_chat_model(
         model_name=model_name,
         openai_api_base=openai_api_base,
         openai_api_key=openai_api_key,
+        http_async_client=get_load_balanced_http_client("model"),
         **chat_model_kwargs,
     )
 
 
+def get_embedding_model(model_name: str | None = None) -> OpenAIEmbeddings:
+    """Create an embedding model for the OpenAI compatible embedding server.
+
+    Examples:
+        >>> model = get_embedding_model()
+        >>> isinstance(model, OpenAIEmbeddings)
+        True
+
+    Args:
+        model_name: The name of the embedding model. If None, uses the default from env_settings.
+
+    Returns:
+        A configured OpenAIEmbeddings instance.
+    """
+    if model_name is None:
+        model_name = env_settings.embedding_model_name
+
+    return OpenAIEmbeddings(
+        model=model_name,
+        openai_api_base=f"{env_settings.embedding_host}/v1",
+        openai_api_key="DUMMY_KEY",
+        # NOTE: Token based chunking only works with OpenAI tokenizers
+        check_embedding_ctx_length=False,
+    )
+
+
 async def transcribe_audio_file(
     file: BinaryIO | Path,
     model_name: str | None = None,
@@ -116,7 +144,9 @@ async def transcribe_audio_file(
         openai_api_key = "DUMMY_KEY"
 
     client = AsyncOpenAI(
-        base_url=f"{env_settings.whisper_api_base}/v1", api_key=openai_api_key
+        base_url=f"{env_settings.whisper_api_base}/v1",
+        api_key=openai_api_key,
+        http_client=get_load_balanced_http_client("whisper"),
     )
 
     if isinstance(file, Path):
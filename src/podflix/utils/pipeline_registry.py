@@ -0,0 +1,249 @@
+"""Registry of reusable prompt/model pipelines.
+
+Building a `ChatPromptTemplate`, a `ChatOpenAI` client and composing them into a
+runnable on every graph invocation is wasted work. The registry builds each
+pipeline once per distinct prompt and model configuration and hands out the same
+runnable on later calls.
+
+Examples:
+    >>> from podflix.utils.pipeline_registry import pipeline_registry
+    >>> chain = pipeline_registry.get_pipeline("rag", prompt)
+    >>> chain is pipeline_registry.get_pipeline("rag", prompt)
+    True
+
+The module contains the following:
+
+- `get_prompt_key(prompt)` - Returns the content hash of a prompt template, computed
+    once per prompt object.
+- `PipelineRegistry` - Caches chat models and `prompt | model | parser` pipelines.
+- `pipeline_registry` - The process wide registry instance.
+- `warmup_model_backends()` - Sends a tiny request to each configured model backend.
+"""
+
+import asyncio
+import io
+import json
+import wave
+import weakref
+from typing import Any
+
+from langchain_core.load import dumps
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+from loguru import logger
+
+from podflix.env_settings import env_settings
+from podflix.utils.general import get_content_hash
+from podflix.utils.model import (
+    get_chat_model,
+    get_embedding_model,
+    transcribe_audio_file,
+)
+
+
+def get_model_config_key(
+    model_name: str | None = None, chat_model_kwargs: dict[str, Any] | None = None
+) -> str:
+    """Build a hashable key of a chat model configuration.
+
+    Examples:
+        >>> get_model_config_key("model", {"temperature": 0})
+        '{"chat_model_kwargs": {"temperature": 0}, "model_name": "model"}'
+
+    Args:
+        model_name: The name of the model. None means the default model.
+        chat_model_kwargs: Additional keyword arguments of the chat model.
+
+    Returns:
+        A string uniquely identifying the configuration.
+    """
+    return json.dumps(
+        {"model_name": model_name, "chat_model_kwargs": chat_model_kwargs or {}},
+        sort_keys=True,
+        default=str,
+    )
+
+
+_prompt_keys: dict[int, tuple[weakref.ref, str]] = {}
+
+
+def get_prompt_key(prompt: ChatPromptTemplate) -> str:
+    """Build a key of a prompt template from its serialized messages and variables.
+
+    Serializing and hashing a prompt is only done the first time a prompt object is
+    seen. Module level prompts are hashed once per process, ad-hoc prompts once per
+    object. The entry is dropped when the prompt is garbage collected.
+
+    Examples:
+        >>> get_prompt_key(prompt) == get_prompt_key(prompt.model_copy())
+        True
+
+    Args:
+        prompt: The prompt template.
+
+    Returns:
+        The content hash of the serialized prompt.
+    """
+    prompt_id = id(prompt)
+    cached = _prompt_keys.get(prompt_id)
+
+    # NOTE: The weakref guards against a new prompt reusing the id of a collected one
+    if cached is not None and cached[0]() is prompt:
+        return cached[1]
+
+    def forget(prompt_ref: weakref.ref) -> None:
+        if _prompt_keys.get(prompt_id, (None,))[0] is prompt_ref:
+            del _prompt_keys[prompt_id]
+
+    prompt_key = get_content_hash(dumps(prompt, sort_keys=True))
+    _prompt_keys[prompt_id] = (weakref.ref(prompt, forget), prompt_key)
+
+    return prompt_key
+
+
+class PipelineRegistry:
+    """Build chat models and pipelines once and reuse them across invocations."""
+
+    def __init__(self):
+        self._models: dict[str, ChatOpenAI] = {}
+        self._pipelines: dict[tuple[str, str, str], Runnable] = {}
+
+    def get_chat_model(
+        self,
+        model_name: str | None = None,
+        chat_model_kwargs: dict[str, Any] | None = None,
+    ) -> ChatOpenAI:
+        """Return the shared chat model of the given configuration.
+
+        Args:
+            model_name: The name of the model. If None, uses the default from env_settings.
+            chat_model_kwargs: Additional keyword arguments to pass to ChatOpenAI.
+
+        Returns:
+            The cached ChatOpenAI instance.
+        """
+        config_key = get_model_config_key(model_name, chat_model_kwargs)
+
+        if config_key not in self._models:
+            self._models[config_key] = get_chat_model(
+                model_name=model_name, chat_model_kwargs=chat_model_kwargs
+            )
+
+        return self._models[config_key]
+
+    def get_pipeline(
+        self,
+        name: str,
+        prompt: ChatPromptTemplate,
+        model_name: str | None = None,
+        chat_model_kwargs: dict[str, Any] | None = None,
+    ) -> Runnable:
+        """Return the shared `prompt | model | StrOutputParser()` pipeline.
+
+        Args:
+            name: A unique name of the pipeline, e.g. the graph node using it.
+            prompt: The prompt template of the pipeline.
+            model_name: The name of the model. If None, uses the default from env_settings.
+            chat_model_kwargs: Additional keyword arguments to pass to ChatOpenAI.
+
+        Returns:
+            The cached runnable pipeline.
+        """
+        # NOTE: A changed prompt under the same name must not reuse the old pipeline
+        pipeline_key = (
+            name,
+            get_prompt_key(prompt),
+            get_model_config_key(model_name, chat_model_kwargs),
+        )
+
+        if pipeline_key not in self._pipelines:
+            model = self.get_chat_model(
+                model_name=model_name, chat_model_kwargs=chat_model_kwargs
+            )
+            self._pipelines[pipeline_key] = prompt | model | StrOutputParser()
+
+        return self._pipelines[pipeline_key]
+
+    def clear(self) -> None:
+        """Remove all cached models and pipelines."""
+        self._models.clear()
+        self._pipelines.clear()
+
+    async def warmup(self) -> None:
+        """Send a single token request through the default and all cached chat models.
+
+        Returns:
+            None
+        """
+        self.get_chat_model()
+
+        await asyncio.gather(
+            *[model.ainvoke("Hi", max_tokens=1) for model in self._models.values()]
+        )
+
+
+pipeline_registry = PipelineRegistry()
+
+
+def get_silent_wav(duration: float = 0.5, sample_rate: int = 16000) -> io.BytesIO:
+    """Create an in-memory wav file containing silence.
+
+    Examples:
+        >>> get_silent_wav().name
+        'warmup.wav'
+
+    Args:
+        duration: The duration of the audio in seconds.
+        sample_rate: The sample rate of the audio.
+
+    Returns:
+        A file-like object with the wav content.
+    """
+    buffer = io.BytesIO()
+
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"\x00\x00" * int(duration * sample_rate))
+
+    buffer.seek(0)
+    buffer.name = "warmup.wav"
+
+    return buffer
+
+
+async def warmup_model_backends() -> None:
+    """Send a tiny request to the chat, embedding and whisper backends.
+
+    Backends such as llama.cpp load the model weights on the first request. Warming
+    them up at startup moves this cost away from the first user. Failures are only
+    logged, a backend that is down must not prevent the application from starting.
+
+    Examples:
+        >>> await warmup_model_backends()
+
+    Returns:
+        None
+    """
+    warmups = {
+        "chat": pipeline_registry.warmup(),
+        "embedding": get_embedding_model().aembed_query("Hi"),
+        "whisper": transcribe_audio_file(file=get_silent_wav(), response_format="json"),
+    }
+
+    results = await asyncio.gather(
+        *[
+            asyncio.wait_for(warmup, timeout=env_settings.timeout_limit)
+            for warmup in warmups.values()
+        ],
+        return_exceptions=True,
+    )
+
+    for backend_name, result in zip(warmups, results, strict=True):
+        if isinstance(result, BaseException):
+            logger.warning(f"Warm-up of the {backend_name} backend failed: {result!r}")
+        else:
+            logger.info(f"Warm-up of the {backend_name} backend completed")
@@ -0,0 +1,329 @@
+"""Sampled and buffered Langfuse tracing of the graph runs.
+
+Tracing every turn with a `LangfuseCallbackHandler` costs CPU in the request path, since
+every callback event is serialized into spans before the turn can continue. Instead, the
+graph runs get a `TracingCallbackHandler`, which only appends the callback events to a
+bounded buffer. A background worker thread forwards them to a Langfuse handler.
+
+- A turn is sampled with the rate of its app type, see `TRACE_SAMPLE_RATES`.
+- The events of a turn that isn't sampled are kept in memory until the turn ends. They
+  are sent anyway if the turn fails or is slower than `TRACE_SLOW_TURN_SECONDS`.
+- When Langfuse is slow and the buffer is full, the oldest events are dropped, so a
+  Langfuse outage never blocks a user turn.
+
+Examples:
+    >>> handler = create_tracing_handler("audio")
+    >>> await graph.ainvoke(inputs, config={"callbacks": [handler]})
+    >>> handler.finish(status="success", duration=1.2)
+
+The module contains the following:
+
+- `TracingPolicy` - Decides which turns are traced.
+- `TraceBuffer` - Bounded drop-oldest buffer drained by a worker thread.
+- `TracingCallbackHandler` - Callback handler forwarding events through the buffer.
+- `create_tracing_handler(app_type)` - Creates the tracing handler of a turn.
+- `tracing_policy` / `trace_buffer` - The process wide instances.
+"""
+
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langfuse.langchain import CallbackHandler as LangfuseCallbackHandler
+from loguru import logger
+
+from podflix.env_settings import env_settings
+from podflix.utils.metrics import increment, record_langfuse_scores
+
+TRACED_CALLBACKS = (
+    "on_agent_action",
+    "on_agent_finish",
+    "on_chain_start",
+    "on_chain_end",
+    "on_chain_error",
+    "on_chat_model_start",
+    "on_llm_start",
+    "on_llm_end",
+    "on_llm_error",
+    "on_retriever_start",
+    "on_retriever_end",
+    "on_retriever_error",
+    "on_tool_start",
+    "on_tool_end",
+    "on_tool_error",
+)
+
+
+class TracingPolicy:
+    """Decide which turns are traced.
+
+    Args:
+        sample_rates: Sample rate per app type, e.g. `{"audio": 0.1}`.
+        default_sample_rate: Sample rate of the app types without their own rate.
+        slow_turn_seconds: Duration above which a turn is always traced.
+    """
+
+    def __init__(
+        self,
+        sample_rates: dict[str, float] | None = None,
+        default_sample_rate: float = 1.0,
+        slow_turn_seconds: float = 10.0,
+    ):
+        self.sample_rates = sample_rates or {}
+        self.default_sample_rate = default_sample_rate
+        self.slow_turn_seconds = slow_turn_seconds
+
+    def sample(self, app_type: str) -> bool:
+        """Decide upfront whether a turn of the app type is traced.
+
+        Args:
+            app_type: The app type or chat profile of the turn.
+
+        Returns:
+            True if the turn is sampled.
+        """
+        sample_rate = self.sample_rates.get(app_type, self.default_sample_rate)
+
+        return random.random() < sample_rate
+
+    def should_keep(self, sampled: bool, status: str, duration: float) -> bool:
+        """Decide at the end of a turn whether its trace is sent.
+
+        Args:
+            sampled: Whether the turn was sampled upfront.
+            status: The outcome of the turn, e.g. `success`, `cancelled` or `error`.
+            duration: The duration of the turn in seconds.
+
+        Returns:
+            True if the trace of the turn is sent to Langfuse.
+        """
+        return sampled or status == "error" or duration >= self.slow_turn_seconds
+
+
+class TraceBuffer:
+    """Bounded buffer of tracing work drained by a background worker thread.
+
+    Adding work never blocks. When the buffer is full, the oldest work is dropped.
+
+    Args:
+        max_size: Maximum number of buffered items.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self.dropped = 0
+
+        self._items: deque[Callable[[], None]] = deque(maxlen=max_size)
+        self._condition = threading.Condition()
+        self._busy = False
+        self._worker: threading.Thread | None = None
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._items)
+
+    def put(self, item: Callable[[], None]) -> None:
+        """Add work to the buffer, dropping the oldest work if it is full.
+
+        Args:
+            item: The callable sending the work to Langfuse.
+        """
+        with self._condition:
+            if len(self._items) == self.max_size:
+                self.dropped += 1
+                increment("trace_buffer_dropped")
+
+            self._items.append(item)
+            self._condition.notify()
+
+        self._ensure_worker()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the buffered work is processed.
+
+        Args:
+            timeout: Maximum seconds to wait.
+
+        Returns:
+            True if the buffer is drained, False if the timeout is reached.
+        """
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            while self._items or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+
+                self._condition.wait(timeout=remaining)
+
+        return True
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        with self._condition:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="trace-buffer", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._items:
+                    self._busy = False
+                    self._condition.notify_all()
+                    self._condition.wait()
+
+                item = self._items.popleft()
+                self._busy = True
+
+            try:
+                # NOTE: Isolate the context changes of the handler, like LangChain does
+                contextvars.Context().run(item)
+            except Exception as e:
+                logger.warning(f"Sending a trace to Langfuse failed: {e!r}")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Forward the callback events of a graph run to Langfuse through the buffer.
+
+    Events of a sampled turn are forwarded right away, the events of other turns are
+    kept until `finish` decides whether the turn is traced.
+
+    Args:
+        sampled: Whether the turn was sampled upfront.
+        policy: The policy deciding which turns are traced.
+        buffer: The buffer the events are sent through.
+        handler_factory: Creates the Langfuse handler, called in the worker thread.
+            Defaults to a Langfuse handler using `trace_id` as the trace id, if set.
+    """
+
+    # NOTE: Recording an event is cheap, so skip the thread pool of sync handlers
+    run_inline = True
+
+    def __init__(
+        self,
+        sampled: bool,
+        policy: TracingPolicy | None = None,
+        buffer: TraceBuffer | None = None,
+        handler_factory: Callable[[], BaseCallbackHandler] | None = None,
+    ):
+        self.sampled = sampled
+        self.policy = policy if policy is not None else tracing_policy
+        # NOTE: An empty buffer is falsy, so compare with None
+        self.buffer = buffer if buffer is not None else trace_buffer
+        self.handler_factory = handler_factory
+
+        self.trace_id: str | None = None
+        self.handler: BaseCallbackHandler | None = None
+        self._pending: list[Callable[[], None]] = []
+        self._token_run_ids: set[UUID] = set()
+
+    @property
+    def last_trace_id(self) -> str | None:
+        """The Langfuse trace id of the turn, set once its events are sent."""
+        return getattr(self.handler, "last_trace_id", None)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:  # noqa: D102
+        # NOTE: Langfuse only uses the first token to set the completion start time
+        if run_id in self._token_run_ids:
+            return
+
+        self._token_run_ids.add(run_id)
+        self._record("on_llm_new_token", (token,), {"run_id": run_id, **kwargs})
+
+    def finish(
+        self, status: str, duration: float, scores: dict[str, float] | None = None
+    ) -> bool:
+        """End the turn and send its trace if the policy keeps it.
+
+        Args:
+            status: The outcome of the turn, e.g. `success`, `cancelled` or `error`.
+            duration: The duration of the turn in seconds.
+            scores: Optional scores attached to the trace after its events are sent.
+
+        Returns:
+            True if the trace of the turn is sent.
+        """
+        keep = self.policy.should_keep(self.sampled, status, duration)
+        pending, self._pending = self._pending, []
+
+        if keep is False:
+            return False
+
+        if pending:
+            self.buffer.put(lambda: [event() for event in pending])
+
+        if scores:
+            self.buffer.put(lambda: record_langfuse_scores(self.last_trace_id, scores))
+
+        return True
+
+    def _record(self, name: str, args: tuple, kwargs: dict) -> None:
+        def send() -> None:
+            if self.handler is None:
+                self.handler = self._create_handler()
+
+            getattr(self.handler, name)(*args, **kwargs)
+
+        if self.sampled is True:
+            self.buffer.put(send)
+        else:
+            self._pending.append(send)
+
+    def _create_handler(self) -> BaseCallbackHandler:
+        if self.handler_factory is not None:
+            return self.handler_factory()
+
+        if self.trace_id is None:
+            return LangfuseCallbackHandler()
+
+        return LangfuseCallbackHandler(trace_context={"trace_id": self.trace_id})
+
+
+def _make_recorder(name: str) -> Callable[..., None]:
+    def record(self: TracingCallbackHandler, *args: Any, **kwargs: Any) -> None:
+        self._record(name, args, kwargs)
+
+    record.__name__ = name
+
+    return record
+
+
+for _name in TRACED_CALLBACKS:
+    setattr(TracingCallbackHandler, _name, _make_recorder(_name))
+
+
+tracing_policy = TracingPolicy(
+    sample_rates=env_settings.trace_sample_rates,
+    default_sample_rate=env_settings.trace_sample_rate,
+    slow_turn_seconds=env_settings.trace_slow_turn_seconds,
+)
+trace_buffer = TraceBuffer(max_size=env_settings.trace_buffer_max_size)
+
+
+def create_tracing_handler(app_type: str | None = None) -> TracingCallbackHandler:
+    """Create the tracing handler of a turn, sampled with the rate of the app type.
+
+    Examples:
+        >>> handler = create_tracing_handler("audio")
+        >>> isinstance(handler.sampled, bool)
+        True
+
+    Args:
+        app_type: The app type of the turn. Defaults to `APP_TYPE`.
+
+    Returns:
+        A new TracingCallbackHandler for the turn.
+    """
+    sampled = tracing_policy.sample(app_type or env_settings.app_type)
+
+    return TracingCallbackHandler(sampled=sampled)
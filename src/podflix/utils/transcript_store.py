@@ -0,0 +1,165 @@
+"""Process wide store of the transcripts shared by the chat sessions.
+
+A transcript is several megabytes for a long episode. Instead of copying it into every
+Chainlit user session, sessions hold a `TranscriptHandle` to a single shared copy,
+keyed by the content hash of the transcript. The shared copy is reference counted, and
+once no session uses it anymore it is evicted in least recently used order.
+
+Examples:
+    >>> handle = transcript_store.acquire("episode", "Hello world", segments)
+    >>> handle.text
+    'Hello world'
+    >>> handle.release()
+
+The module contains the following:
+
+- `SharedTranscript` - A transcript shared by the sessions.
+- `TranscriptHandle` - The reference of a session to a shared transcript.
+- `TranscriptStore` - Reference counted and LRU bounded store of the transcripts.
+- `transcript_store` - The process wide instance.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+
+from podflix.env_settings import env_settings
+from podflix.graph.query_router import SegmentIndex
+
+
+@dataclass(eq=False)
+class SharedTranscript:
+    """A transcript together with the number of sessions using it."""
+
+    episode_id: str
+    text: str
+    segments: list[dict]
+    references: int = 0
+
+    @cached_property
+    def segment_index(self) -> SegmentIndex:
+        """The segment index of the transcript, built once for all sessions."""
+        return SegmentIndex(self.segments)
+
+
+class TranscriptHandle:
+    """The reference of a session to a shared transcript.
+
+    Args:
+        store: The store holding the transcript.
+        transcript: The shared transcript.
+    """
+
+    def __init__(self, store: "TranscriptStore", transcript: SharedTranscript):
+        self._store = store
+        self._transcript = transcript
+        self.released = False
+
+    @property
+    def episode_id(self) -> str:
+        """The identifier of the episode, i.e. the content hash of the transcript."""
+        return self._transcript.episode_id
+
+    @property
+    def text(self) -> str:
+        """The whole transcript text."""
+        return self._transcript.text
+
+    @property
+    def segments(self) -> list[dict]:
+        """The transcript segments."""
+        return self._transcript.segments
+
+    @property
+    def segment_index(self) -> SegmentIndex:
+        """The shared segment index of the transcript."""
+        return self._transcript.segment_index
+
+    def release(self) -> None:
+        """Release the reference, releasing an already released handle does nothing."""
+        if self.released is True:
+            return
+
+        self.released = True
+        self._store.release(self._transcript)
+
+
+class TranscriptStore:
+    """Deduplicate the transcripts of the sessions by their episode id.
+
+    Transcripts used by a session are never evicted. Once `max_entries` is reached,
+    the least recently used transcripts without sessions are evicted.
+
+    Args:
+        max_entries: Maximum number of stored transcripts.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+
+        self._transcripts: OrderedDict[str, SharedTranscript] = OrderedDict()
+
+    def __len__(self) -> int:  # noqa: D105
+        return len(self._transcripts)
+
+    def __contains__(self, episode_id: str) -> bool:  # noqa: D105
+        return episode_id in self._transcripts
+
+    def acquire(
+        self, episode_id: str, text: str, segments: list[dict]
+    ) -> TranscriptHandle:
+        """Return a handle to the transcript of the episode, storing it if needed.
+
+        If the transcript of the episode is already stored, the given text and segments
+        are dropped in favour of the shared copy.
+
+        Args:
+            episode_id: The identifier of the episode, e.g. the transcript content hash.
+            text: The whole transcript text.
+            segments: The transcript segments.
+
+        Returns:
+            A handle to release once the session doesn't use the transcript anymore.
+        """
+        transcript = self._transcripts.get(episode_id)
+
+        if transcript is None:
+            transcript = SharedTranscript(
+                episode_id=episode_id, text=text, segments=segments
+            )
+            self._transcripts[episode_id] = transcript
+        else:
+            self._transcripts.move_to_end(episode_id)
+
+        transcript.references += 1
+        self._evict()
+
+        return TranscriptHandle(store=self, transcript=transcript)
+
+    def release(self, transcript: SharedTranscript) -> None:
+        """Release a reference to the transcript, see `TranscriptHandle.release`.
+
+        Args:
+            transcript: The shared transcript.
+        """
+        transcript.references -= 1
+        self._evict()
+
+    def _evict(self) -> None:
+        if len(self._transcripts) <= self.max_entries:
+            return
+
+        unused_episode_ids = [
+            episode_id
+            for episode_id, transcript in self._transcripts.items()
+            if transcript.references <= 0
+        ]
+        overflow = len(self._transcripts) - self.max_entries
+
+        for episode_id in unused_episode_ids[:overflow]:
+            del self._transcripts[episode_id]
+
+
+transcript_store = TranscriptStore(
+    max_entries=env_settings.transcript_store_max_entries
+)
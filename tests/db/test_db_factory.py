@@ -0,0 +1,93 @@
+"""Tests for the database interfaces."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from podflix.db.db_factory import SQLiteDBInterface, encode_json_text
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 1234,
+    "temp_store": "MEMORY",
+    "cache_size": -2048,
+}
+# NOTE: SQLite reports the enum pragmas as integers
+EXPECTED_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": 1,
+    "busy_timeout": 1234,
+    "temp_store": 2,
+    "cache_size": -2048,
+}
+
+
+def read_pragmas(conn: sa.Connection) -> dict:
+    """Read the pragmas of the tuned profile from a connection."""
+    return {name: conn.execute(sa.text(f"PRAGMA {name}")).scalar() for name in PRAGMAS}
+
+
+def test_sqlite_profile_is_applied_to_sync_connections(tmp_path: Path) -> None:
+    """Every sync connection should use the pragmas of the profile."""
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas=PRAGMAS)
+
+    with db_interface.create_engine().connect() as conn:
+        assert read_pragmas(conn) == EXPECTED_PRAGMAS
+
+
+async def test_sqlite_profile_is_applied_to_aiosqlite_connections(
+    tmp_path: Path,
+) -> None:
+    """Every aiosqlite connection should use the pragmas of the profile."""
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas=PRAGMAS)
+    engine = create_async_engine(db_interface.async_connection())
+    db_interface.configure_engine(engine.sync_engine)
+    db_interface.configure_engine(engine.sync_engine)
+
+    async with engine.connect() as conn:
+        assert await conn.run_sync(read_pragmas) == EXPECTED_PRAGMAS
+
+    await engine.dispose()
+
+
+def test_empty_sqlite_profile_keeps_the_defaults(tmp_path: Path) -> None:
+    """An empty profile should leave the rollback journal untouched."""
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+
+    with db_interface.create_engine().connect() as conn:
+        assert conn.execute(sa.text("PRAGMA journal_mode")).scalar() == "delete"
+
+
+def test_sqlite_binds_lists_and_dicts_as_json(tmp_path: Path) -> None:
+    """Chainlit list and dict parameters should be stored as JSON text."""
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+    engine = db_interface.create_engine()
+
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE t (tags TEXT, metadata TEXT)"))
+        conn.execute(
+            sa.text("INSERT INTO t VALUES (:tags, :metadata)"),
+            [{"tags": ["a", "b"], "metadata": {"show": "Youtube"}}],
+        )
+        conn.execute(
+            sa.text("INSERT INTO t VALUES (:tags, :metadata)"),
+            {"tags": ["c"], "metadata": "{}"},
+        )
+
+        rows = conn.execute(sa.text("SELECT tags, metadata FROM t")).all()
+
+    assert rows == [('["a", "b"]', '{"show": "Youtube"}'), ('["c"]', "{}")]
+
+
+def test_json_codec_encodes_scalars() -> None:
+    """The asyncpg JSON encoders should accept scalars, keeping JSON text as is."""
+    assert encode_json_text('{"show": "ai"}') == b'{"show": "ai"}'
+    assert encode_json_text(["podcast", "ai"]) == b'["podcast", "ai"]'
+    assert encode_json_text(3) == b"3"
+    assert encode_json_text(1.5) == b"1.5"
+    assert encode_json_text(False) == b"false"
+    assert encode_json_text(None) == b"null"
@@ -0,0 +1,100 @@
+"""Tests for the process wide engine registry."""
+
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from podflix.db import engine_registry as engine_registry_module
+from podflix.db.db_factory import SQLiteDBInterface
+from podflix.db.engine_registry import (
+    EngineRegistry,
+    InstrumentedAsyncAdaptedQueuePool,
+    InstrumentedQueuePool,
+)
+
+POOL_SIZE = 3
+MAX_OVERFLOW = 2
+BUSY_TIMEOUT = 1234
+
+
+def test_engines_are_shared_per_database(tmp_path: Path) -> None:
+    """Repeated calls should return the same engines of a database."""
+    registry = EngineRegistry()
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+    other_interface = SQLiteDBInterface(tmp_path / "other.sqlite", pragmas={})
+
+    engine = registry.get_engine(db_interface)
+    async_engine = registry.get_async_engine(db_interface)
+
+    assert registry.get_engine(db_interface) is engine
+    assert registry.get_async_engine(db_interface) is async_engine
+    assert registry.get_engine(other_interface) is not engine
+
+    asyncio.run(registry.dispose())
+
+
+def test_engines_use_the_tuned_pools(tmp_path: Path, monkeypatch) -> None:
+    """The engines should use the instrumented pools with the configured options."""
+    monkeypatch.setattr(engine_registry_module.env_settings, "db_pool_size", POOL_SIZE)
+    monkeypatch.setattr(
+        engine_registry_module.env_settings, "db_max_overflow", MAX_OVERFLOW
+    )
+
+    registry = EngineRegistry()
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+
+    engine = registry.get_engine(db_interface)
+    async_engine = registry.get_async_engine(db_interface)
+
+    assert isinstance(engine.pool, InstrumentedQueuePool)
+    assert isinstance(async_engine.pool, InstrumentedAsyncAdaptedQueuePool)
+    assert engine.pool.size() == POOL_SIZE
+    assert engine.pool._max_overflow == MAX_OVERFLOW
+
+    asyncio.run(registry.dispose())
+
+
+def test_engines_apply_the_sqlite_pragmas(tmp_path: Path) -> None:
+    """The registry should configure the engines with their database interface."""
+    registry = EngineRegistry()
+    db_interface = SQLiteDBInterface(
+        tmp_path / "db.sqlite", pragmas={"busy_timeout": BUSY_TIMEOUT}
+    )
+
+    with registry.get_engine(db_interface).connect() as conn:
+        assert conn.execute(sa.text("PRAGMA busy_timeout")).scalar() == BUSY_TIMEOUT
+
+    async def read_async_busy_timeout() -> int:
+        async with registry.get_async_engine(db_interface).connect() as conn:
+            result = await conn.execute(sa.text("PRAGMA busy_timeout"))
+            return result.scalar()
+
+    assert asyncio.run(read_async_busy_timeout()) == BUSY_TIMEOUT
+
+    asyncio.run(registry.dispose())
+
+
+def test_pool_wait_is_observed(tmp_path: Path, monkeypatch) -> None:
+    """Checking out a connection should record the pool wait."""
+    observations = []
+    monkeypatch.setattr(
+        engine_registry_module,
+        "observe",
+        lambda name, value, **labels: observations.append((name, value, labels)),
+    )
+
+    registry = EngineRegistry()
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+
+    with registry.get_engine(db_interface).connect() as conn:
+        conn.execute(sa.text("SELECT 1"))
+
+    assert [(name, labels) for name, _, labels in observations] == [
+        ("db_pool_wait", {"pool": "sync"})
+    ]
+    assert observations[0][1] >= 0
+
+    asyncio.run(registry.dispose())
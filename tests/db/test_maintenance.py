@@ -0,0 +1,260 @@
+"""Tests for the retention, archiving and compaction maintenance job."""
+
+from __future__ import annotations
+
+import json
+import time
+import zlib
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+from podflix.db import maintenance as maintenance_module
+from podflix.db.db_factory import SQLiteDBInterface
+from podflix.db.maintenance import (
+    MaintenanceJob,
+    TableArchiveSink,
+    decompress_thread_archive,
+    get_retention_cutoff,
+)
+from podflix.db.migrations import MigrationRunner, get_migrations
+
+RETENTION_DAYS = 30
+EXPIRED_THREADS = 2
+KEPT_THREADS = 2
+DELETED_ELEMENTS = 2
+EXPIRED_SESSION_STATES = 50
+OLD_TIMESTAMP = "2020-01-01T00:00:00.000000Z"
+
+
+class FakeStorageClient:
+    """Storage client recording the deleted files, failing for some keys."""
+
+    def __init__(self, failing_keys: set[str] | None = None):
+        self.failing_keys = failing_keys or set()
+        self.deleted_keys = []
+
+    def sync_delete_file(self, object_key: str) -> bool:
+        """Delete the file of a key, unless the key is failing."""
+        if object_key in self.failing_keys:
+            return False
+
+        self.deleted_keys.append(object_key)
+        return True
+
+
+@pytest.fixture
+def engine(tmp_path: Path, monkeypatch) -> sa.Engine:
+    """A migrated SQLite database, with the pauses between batches disabled."""
+    monkeypatch.setattr(maintenance_module, "BATCH_PAUSE_SECONDS", 0)
+
+    db_interface = SQLiteDBInterface(tmp_path / "db.sqlite", pragmas={})
+    engine = db_interface.create_engine()
+    MigrationRunner(engine, get_migrations()).upgrade()
+
+    yield engine
+
+    engine.dispose()
+
+
+def insert_thread(conn, thread_id: str, created_at: str, step_created_at: str) -> None:
+    """Insert a thread with a step, an element, a feedback and a transcript."""
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO threads ("id", "createdAt", "name", "userIdentifier")
+            VALUES (:id, :created_at, 'Episode chat', 'admin')
+            """
+        ),
+        {"id": thread_id, "created_at": created_at},
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO steps
+                ("id", "name", "type", "threadId", "streaming", "output", "createdAt")
+            VALUES (
+                :id, 'assistant', 'assistant_message', :thread_id, false, 'an answer',
+                :created_at
+            )
+            """
+        ),
+        {
+            "id": f"{thread_id}-step",
+            "thread_id": thread_id,
+            "created_at": step_created_at,
+        },
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO elements ("id", "threadId", "name", "forId", "objectKey")
+            VALUES (:id, :thread_id, 'audio', :for_id, :object_key)
+            """
+        ),
+        {
+            "id": f"{thread_id}-element",
+            "thread_id": thread_id,
+            "for_id": f"{thread_id}-step",
+            "object_key": f"admin/{thread_id}-element",
+        },
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO feedbacks ("id", "forId", "threadId", "value")
+            VALUES (:id, :for_id, :thread_id, 1)
+            """
+        ),
+        {
+            "id": f"{thread_id}-feedback",
+            "for_id": f"{thread_id}-step",
+            "thread_id": thread_id,
+        },
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO transcripts ("threadId", "episodeId", "content")
+            VALUES (:thread_id, 'episode', :content)
+            """
+        ),
+        {
+            "thread_id": thread_id,
+            "content": zlib.compress(
+                json.dumps({"text": "the transcript", "segments": []}).encode("utf-8")
+            ),
+        },
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO transcripts_fts ("text", "threadId", "episodeId")
+            VALUES ('the transcript', :thread_id, 'episode')
+            """
+        ),
+        {"thread_id": thread_id},
+    )
+
+
+def count_rows(conn, table: str) -> int:
+    """Return the number of rows of a table."""
+    return conn.execute(sa.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+def select_ids(conn, table: str) -> set[str]:
+    """Return the identifiers of the rows of a table."""
+    return {row[0] for row in conn.execute(sa.text(f'SELECT "id" FROM {table}'))}
+
+
+def test_expired_threads_are_archived_then_deleted(engine: sa.Engine) -> None:
+    """Only the threads without recent activity should be archived, batch by batch."""
+    recent = get_retention_cutoff(1)
+
+    with engine.begin() as conn:
+        insert_thread(conn, "old-1", OLD_TIMESTAMP, OLD_TIMESTAMP)
+        insert_thread(conn, "old-2", OLD_TIMESTAMP, OLD_TIMESTAMP)
+        insert_thread(conn, "resumed", OLD_TIMESTAMP, recent)
+        insert_thread(conn, "recent", recent, recent)
+
+    job = MaintenanceJob(
+        engine,
+        retention_days=RETENTION_DAYS,
+        batch_size=1,
+        archive_sink=TableArchiveSink(),
+        storage_client=FakeStorageClient(),
+    )
+
+    assert job.archive_expired_threads() == EXPIRED_THREADS
+
+    with engine.connect() as conn:
+        assert select_ids(conn, "threads") == {"resumed", "recent"}
+
+        for table in (
+            "steps",
+            "elements",
+            "feedbacks",
+            "transcripts",
+            "transcripts_fts",
+        ):
+            assert count_rows(conn, table) == KEPT_THREADS
+
+        content = conn.execute(
+            sa.text(
+                """SELECT "content" FROM thread_archive WHERE "threadId" = 'old-1'"""
+            )
+        ).scalar()
+
+    archive = decompress_thread_archive(content)
+
+    assert archive["thread"]["name"] == "Episode chat"
+    assert [step["output"] for step in archive["steps"]] == ["an answer"]
+    assert archive["elements"][0]["objectKey"] == "admin/old-1-element"
+    assert archive["feedbacks"][0]["value"] == 1
+    assert archive["transcript"]["text"] == "the transcript"
+
+
+def test_orphaned_elements_are_deleted_with_their_files(engine: sa.Engine) -> None:
+    """Elements without thread or step should go, unless their file can't be deleted."""
+    with engine.begin() as conn:
+        insert_thread(conn, "kept", OLD_TIMESTAMP, OLD_TIMESTAMP)
+        conn.execute(
+            sa.text(
+                """
+                INSERT INTO elements ("id", "threadId", "name", "forId", "objectKey")
+                VALUES
+                    ('no-thread', 'missing', 'audio', NULL, 'admin/no-thread'),
+                    ('no-step', 'kept', 'audio', 'missing', NULL),
+                    ('failing', 'missing', 'audio', NULL, 'admin/failing')
+                """
+            )
+        )
+
+    storage_client = FakeStorageClient(failing_keys={"admin/failing"})
+    job = MaintenanceJob(engine, batch_size=1, storage_client=storage_client)
+
+    assert job.delete_orphaned_elements() == DELETED_ELEMENTS
+    assert storage_client.deleted_keys == ["admin/no-thread"]
+
+    with engine.connect() as conn:
+        assert select_ids(conn, "elements") == {"kept-element", "failing"}
+
+
+def test_run_purges_session_states_and_compacts(engine: sa.Engine) -> None:
+    """A run should purge the expired session states and vacuum the free pages."""
+    now = time.time()
+
+    with engine.begin() as conn:
+        conn.execute(
+            sa.text(
+                """
+                INSERT INTO session_state ("key", "value", "expiresAt")
+                VALUES (:key, :value, :expires_at)
+                """
+            ),
+            [
+                {"key": f"expired-{i}", "value": b"x" * 4096, "expires_at": now - 1}
+                for i in range(EXPIRED_SESSION_STATES)
+            ]
+            + [{"key": "live", "value": b"x", "expires_at": now + 3600}],
+        )
+
+    job = MaintenanceJob(
+        engine,
+        retention_days=RETENTION_DAYS,
+        batch_size=20,
+        vacuum_free_ratio=0,
+        archive_sink=TableArchiveSink(),
+        storage_client=FakeStorageClient(),
+    )
+
+    assert job.run() == {
+        "archived_threads": 0,
+        "orphaned_elements": 0,
+        "expired_session_states": EXPIRED_SESSION_STATES,
+    }
+
+    with engine.connect() as conn:
+        assert count_rows(conn, "session_state") == 1
+        assert conn.execute(sa.text("PRAGMA freelist_count")).scalar() == 0
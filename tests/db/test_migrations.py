@@ -0,0 +1,142 @@
+"""Tests for the versioned schema migrations."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+from podflix.db import migrations as migrations_module
+from podflix.db.migrations import (
+    SECONDARY_INDEXES,
+    Index,
+    Migration,
+    MigrationRunner,
+    check_json_columns,
+    convert_json_columns,
+    get_migrations,
+    split_sql_statements,
+)
+
+
+def test_split_sql_statements_keeps_quoted_semicolons() -> None:
+    """Semicolons in strings, identifiers, comments and dollar quotes should be kept."""
+    sql = """
+        INSERT INTO t VALUES ('a;b', 'it''s; fine');
+        -- a comment; with a semicolon
+        SELECT "odd;name" FROM t;
+        CREATE FUNCTION f() RETURNS trigger AS $body$ BEGIN RETURN NEW; END $body$;
+    """
+
+    assert split_sql_statements(sql) == [
+        "INSERT INTO t VALUES ('a;b', 'it''s; fine')",
+        '-- a comment; with a semicolon\n        SELECT "odd;name" FROM t',
+        "CREATE FUNCTION f() RETURNS trigger AS $body$ BEGIN RETURN NEW; END $body$",
+    ]
+
+
+def test_index_create_statement() -> None:
+    """Concurrent index creation should only be requested explicitly."""
+    index = Index("steps_idx", "steps", ("threadId", "createdAt"))
+
+    assert index.create_statement() == (
+        'CREATE INDEX IF NOT EXISTS steps_idx ON steps ("threadId", "createdAt")'
+    )
+    assert "CONCURRENTLY" in index.create_statement(concurrently=True)
+    assert Index("t_idx", "t", ("metadata",), using="GIN").create_statement() == (
+        'CREATE INDEX IF NOT EXISTS t_idx ON t USING GIN ("metadata")'
+    )
+
+
+def test_upgrade_applies_pending_migrations_once(tmp_path: Path) -> None:
+    """A new database should get the schema and the indexes, then be up to date."""
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    runner = MigrationRunner(engine)
+
+    assert runner.upgrade() == [1, 2, 5, 6]
+    assert runner.upgrade() == []
+
+    with engine.connect() as conn:
+        index_names = set(
+            conn.execute(
+                sa.text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            ).scalars()
+        )
+
+    assert {index.name for index in SECONDARY_INDEXES} <= index_names
+
+
+def test_upgrade_completes_a_database_initialized_without_migrations(
+    tmp_path: Path,
+) -> None:
+    """Databases created before the migrations should get the missing tables."""
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+
+    with engine.begin() as conn:
+        conn.execute(sa.text('CREATE TABLE users ("id" UUID PRIMARY KEY)'))
+
+    MigrationRunner(engine).upgrade()
+
+    with engine.connect() as conn:
+        table_names = set(sa.inspect(conn).get_table_names())
+
+    assert {"users", "threads", "steps", "transcripts"} <= table_names
+
+
+def test_failed_migration_is_not_recorded(tmp_path: Path) -> None:
+    """A failing migration should stay pending, to be retried by the next upgrade."""
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+
+    def fail(conn: sa.Connection) -> None:
+        raise RuntimeError("boom")
+
+    runner = MigrationRunner(engine, migrations=(Migration(1, "failing", fail),))
+
+    with pytest.raises(RuntimeError):
+        runner.upgrade()
+
+    assert [migration.version for migration in runner.pending()] == [1]
+
+
+def test_jsonb_migrations_are_skipped_outside_postgres(tmp_path: Path) -> None:
+    """The JSONB migrations should only be recorded on SQLite, with the JSON schema."""
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+
+    assert [migration.version for migration in get_migrations()] == [1, 2, 5, 6]
+    assert MigrationRunner(engine, get_migrations("jsonb")).upgrade() == [
+        1,
+        2,
+        3,
+        4,
+        5,
+        6,
+    ]
+
+    with engine.connect() as conn:
+        columns = {
+            column["name"]: str(column["type"])
+            for column in sa.inspect(conn).get_columns("threads")
+        }
+
+    assert columns["metadata"] == "JSON"
+
+
+def test_json_columns_are_only_converted_on_request(monkeypatch) -> None:
+    """Startup migrations should refuse JSON columns instead of rewriting the tables."""
+    jsonb_migrations = {m.version: m for m in get_migrations("jsonb")}
+    converting_migrations = {
+        m.version: m for m in get_migrations("jsonb", convert_json=True)
+    }
+
+    assert jsonb_migrations[3].upgrade is check_json_columns
+    assert converting_migrations[3].upgrade is convert_json_columns
+
+    monkeypatch.setattr(
+        migrations_module,
+        "get_json_columns",
+        lambda conn: [("threads", "metadata", "JSONB")],
+    )
+
+    with pytest.raises(RuntimeError, match="--convert-json-columns"):
+        check_json_columns(conn=None)
@@ -0,0 +1,72 @@
+"""Tests for the per statement instrumentation of the engines."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import sqlalchemy as sa
+from loguru import logger
+
+from podflix.db import query_metrics
+from podflix.db.query_metrics import (
+    QueryInstrumentation,
+    fingerprint_statement,
+    redact_parameters,
+)
+
+
+def test_fingerprint_ignores_literals_and_whitespace() -> None:
+    """Statements differing only by their literals should share a fingerprint."""
+    first = fingerprint_statement("SELECT * FROM steps\n WHERE id = 'a''b' LIMIT 10")
+    second = fingerprint_statement("SELECT *  FROM steps WHERE id = 'c' LIMIT 5")
+
+    assert first == second == "SELECT * FROM steps WHERE id = ? LIMIT ?"
+    assert fingerprint_statement("SELECT 1 FROM t1 WHERE x IN (1, 2, 3)") == (
+        "SELECT ? FROM t1 WHERE x IN (?)"
+    )
+
+
+def test_parameters_are_redacted() -> None:
+    """Only the types and lengths of the parameters should be kept."""
+    assert redact_parameters(("secret", 3, None, b"abcd")) == (
+        "<str:6>",
+        "<int>",
+        None,
+        "<bytes:4>",
+    )
+    assert redact_parameters([{"token": "secret"}]) == [{"token": "<str:6>"}]
+
+
+def test_statements_are_recorded_and_slow_ones_logged(
+    tmp_path: Path, monkeypatch
+) -> None:
+    """Every statement should be observed and only the slow ones logged."""
+    observations = []
+    monkeypatch.setattr(
+        query_metrics,
+        "observe",
+        lambda name, value, **labels: observations.append((name, labels)),
+    )
+    messages = []
+    handler_id = logger.add(messages.append, level="WARNING")
+
+    instrumentation = QueryInstrumentation(slow_query_threshold_ms=0)
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    instrumentation.attach(engine)
+    instrumentation.attach(engine)
+
+    try:
+        with engine.connect() as conn:
+            conn.execute(sa.text("SELECT :token"), {"token": "secret"})
+    finally:
+        logger.remove(handler_id)
+        engine.dispose()
+
+    assert len(observations) == 1
+    name, labels = observations[0]
+    assert name == "db_query_duration"
+    assert labels["operation"] == "SELECT"
+
+    assert len(messages) == 1
+    assert "secret" not in messages[0]
+    assert labels["fingerprint"] in messages[0]
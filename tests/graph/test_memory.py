@@ -0,0 +1,74 @@
+"""Tests for the bounded conversation memory."""
+
+from __future__ import annotations
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+from langchain_core.runnables import RunnableLambda
+
+from podflix.graph import memory
+from podflix.graph.memory import manage_memory, split_message_window
+
+
+def _conversation(turns: int) -> list:
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(f"question {turn}", id=f"human-{turn}"))
+        messages.append(AIMessage(f"answer {turn}", id=f"ai-{turn}"))
+    return messages
+
+
+def test_window_keeps_last_message_even_over_budget() -> None:
+    """The latest message should always be kept in the window."""
+    messages = [*_conversation(2), HumanMessage("a long question " * 50)]
+
+    older, window = split_message_window(messages, max_tokens=1)
+
+    assert window == messages[-1:]
+    assert older == messages[:-1]
+
+
+def test_window_starts_with_user_message() -> None:
+    """The window should not start with an orphan assistant answer."""
+    messages = [*_conversation(3), HumanMessage("next question")]
+
+    _, window = split_message_window(messages, max_tokens=20)
+
+    assert isinstance(window[0], HumanMessage)
+
+
+def test_all_messages_fit_into_large_budget() -> None:
+    """Nothing should be summarized when the whole conversation fits."""
+    messages = _conversation(3)
+
+    older, window = split_message_window(messages, max_tokens=10_000)
+
+    assert older == []
+    assert window == messages
+
+
+async def test_manage_memory_summarizes_and_removes_older_messages(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Older messages should be folded into the summary and removed from the state."""
+    monkeypatch.setattr(memory.env_settings, "memory_window_max_tokens", 20)
+    captured_inputs = {}
+
+    def fake_summarize(inputs: dict) -> str:
+        captured_inputs.update(inputs)
+        return "new summary"
+
+    monkeypatch.setattr(
+        memory.pipeline_registry,
+        "get_pipeline",
+        lambda **_: RunnableLambda(fake_summarize),
+    )
+
+    messages = [*_conversation(3), HumanMessage("next question", id="human-last")]
+    update = await manage_memory({"messages": messages, "summary": "old summary"})
+
+    assert update["summary"] == "new summary"
+    assert captured_inputs["summary"] == "old summary"
+    assert "question 0" in captured_inputs["new_lines"]
+    assert all(isinstance(message, RemoveMessage) for message in update["messages"])
+    assert "human-last" not in {message.id for message in update["messages"]}
@@ -0,0 +1,136 @@
+"""Tests for the query router answering transcript lookups."""
+
+from __future__ import annotations
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from podflix.graph.podcast_rag import compiled_graph
+from podflix.graph.query_router import (
+    SegmentIndex,
+    classify_query,
+    parse_timestamp,
+    route_query,
+)
+from podflix.utils.transcript_store import TranscriptStore
+
+SEGMENTS = [
+    {"id": 0, "start": 0.0, "end": 10.0, "text": "Welcome to the show."},
+    {"id": 1, "start": 10.0, "end": 20.0, "text": "Today we discuss vector databases."},
+    {"id": 2, "start": 20.0, "end": 30.0, "text": "Databases store the embeddings."},
+]
+
+
+@pytest.mark.parametrize(
+    ("question", "expected"),
+    [
+        ("What was said at 12:30?", ("timestamp", "12:30")),
+        ("what happens around 1:02:03", ("timestamp", "1:02:03")),
+        ("When do they talk about vector databases?", ("topic", "vector databases")),
+        ("Where does the host mention pricing", ("topic", "pricing")),
+        ("What do they say at 5:00", ("timestamp", "5:00")),
+        ("Summarize the episode", ("generate", None)),
+        ("Why do they prefer vector databases?", ("generate", None)),
+        ("Summarize the discussion from 10:00 to 20:00", ("generate", None)),
+        ("What was said from 10:00 to 20:00?", ("generate", None)),
+        ("Why did they change their mind at 12:30?", ("generate", None)),
+        (
+            "Explain the argument they make around 5:00 in detail",
+            ("generate", None),
+        ),
+        (
+            "When do they talk about the costs and why do they think it matters?",
+            ("generate", None),
+        ),
+        (
+            "When do they talk about costs, pricing, the free tier and the limits "
+            "of the paid plans?",
+            ("generate", None),
+        ),
+    ],
+)
+def test_classify_query(question: str, expected: tuple) -> None:
+    """Lookup questions should be detected and everything else generated."""
+    assert classify_query(question) == expected
+
+
+def test_parse_timestamp() -> None:
+    """Timestamps with and without hours should be converted to seconds."""
+    assert parse_timestamp("12:30") == 12 * 60 + 30
+    assert parse_timestamp("1:02:03") == 3600 + 2 * 60 + 3
+
+
+def test_segment_index_finds_segment_at_time() -> None:
+    """The segment spoken at a time should be found by its start time."""
+    segment_index = SegmentIndex(SEGMENTS)
+
+    assert segment_index.find_at(15.0)["id"] == 1
+    assert segment_index.find_at(10.0)["id"] == 1
+
+
+def test_segment_index_finds_nothing_past_the_end() -> None:
+    """A time after the end of the episode should not match its last segment."""
+    segment_index = SegmentIndex(SEGMENTS)
+
+    assert segment_index.find_at(30.0)["id"] == 2  # noqa: PLR2004
+    assert segment_index.find_at(parse_timestamp("99:00")) is None
+
+
+def test_segment_index_search_ranks_by_matched_words() -> None:
+    """Segments matching more query words should be preferred."""
+    segment_index = SegmentIndex(SEGMENTS)
+
+    matches = segment_index.search("vector databases", limit=1)
+
+    assert [segment["id"] for segment in matches] == [1]
+
+
+def _transcript_config() -> dict:
+    """Return a runnable config holding a transcript handle of the segments."""
+    transcript = TranscriptStore().acquire("episode", "", SEGMENTS)
+
+    return {"configurable": {"transcript": transcript}}
+
+
+async def test_route_query_answers_lookup_without_llm() -> None:
+    """A timestamp question should be answered by the router with segment ids."""
+    state = {"messages": [HumanMessage("What was said at 0:25?")]}
+
+    update = await route_query(state, _transcript_config())
+
+    assert update["route"] == "lookup"
+    assert update["segment_ids"] == [2]
+    assert "[0:20]" in update["messages"][0].content
+
+
+async def test_route_query_falls_back_to_generation() -> None:
+    """Without a transcript or for open questions the LLM should be used."""
+    assert (await route_query({"messages": [HumanMessage("What was said at 0:25?")]}))[
+        "route"
+    ] == "generate"
+    assert (
+        await route_query(
+            {"messages": [HumanMessage("Summarize the episode")]},
+            _transcript_config(),
+        )
+    )["route"] == "generate"
+
+
+async def test_route_query_falls_back_past_the_end_of_the_episode() -> None:
+    """A timestamp after the end of the transcript should be left to the LLM."""
+    update = await route_query(
+        {"messages": [HumanMessage("What was said at 99:00?")]}, _transcript_config()
+    )
+
+    assert update["route"] == "generate"
+
+
+async def test_graph_state_only_holds_the_segment_ids() -> None:
+    """The graph should read the segment index from the config, not its state."""
+    final_state = await compiled_graph.ainvoke(
+        {"messages": [HumanMessage("What was said at 0:25?")]},
+        config=_transcript_config(),
+    )
+
+    assert final_state["segment_ids"] == [2]
+    assert "segment_index" not in final_state
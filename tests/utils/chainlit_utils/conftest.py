@@ -0,0 +1,21 @@
+"""Shared fixtures of the Chainlit utilities tests."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+
+from podflix.db.migrations import MigrationRunner
+
+
+@pytest.fixture
+def sqlite_data_layer(tmp_path: Path) -> SQLAlchemyDataLayer:
+    """Create a data layer on a fresh SQLite database with the podflix schema."""
+    db_path = tmp_path / "db.sqlite"
+
+    MigrationRunner(sa.create_engine(f"sqlite:///{db_path}")).upgrade()
+
+    return SQLAlchemyDataLayer(conninfo=f"sqlite+aiosqlite:///{db_path}")
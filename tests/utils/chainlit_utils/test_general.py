@@ -0,0 +1,104 @@
+"""Tests for the Chainlit session utilities."""
+
+from __future__ import annotations
+
+from uuid import uuid4
+
+import pytest
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+
+from podflix.utils.chainlit_utils import general
+from podflix.utils.chainlit_utils.thread_stores import ThreadHistoryStore
+
+TURNS = 30
+PAGE_SIZE = 4
+
+
+class FakeUserSession(dict):
+    """Stub of the Chainlit user session."""
+
+    def set(self, key: str, value) -> None:  # noqa: D102
+        self[key] = value
+
+
+async def insert_conversation(data_layer: SQLAlchemyDataLayer, thread_id: str) -> None:
+    """Insert the question/answer steps of a thread, one second apart."""
+    for turn in range(TURNS):
+        for offset, step_type in enumerate(("user_message", "assistant_message")):
+            await data_layer.execute_sql(
+                query="""
+                    INSERT INTO steps
+                        ("id", "name", "type", "threadId", "streaming", "output",
+                         "createdAt")
+                    VALUES (:id, :type, :type, :thread_id, false, :output, :created_at)
+                """,
+                parameters={
+                    "id": str(uuid4()),
+                    "type": step_type,
+                    "thread_id": thread_id,
+                    "output": f"{step_type} {turn}",
+                    "created_at": f"2025-01-01T00:{turn:02d}:{offset:02d}Z",
+                },
+            )
+
+
+@pytest.fixture
+def user_session(
+    sqlite_data_layer: SQLAlchemyDataLayer, monkeypatch: pytest.MonkeyPatch
+) -> FakeUserSession:
+    """Run the session utilities on a fake user session and a SQLite data layer."""
+    user_session = FakeUserSession()
+    thread_id = str(uuid4())
+
+    monkeypatch.setattr(general.cl, "user_session", user_session)
+    monkeypatch.setattr(general, "get_current_chainlit_thread_id", lambda: thread_id)
+    monkeypatch.setattr(general, "get_lf_session_url", lambda session_id: None)
+    monkeypatch.setattr(
+        general,
+        "thread_history_store",
+        ThreadHistoryStore(data_layer=sqlite_data_layer),
+    )
+    monkeypatch.setattr(general.env_settings, "resume_history_max_messages", PAGE_SIZE)
+    user_session["thread_id"] = thread_id
+
+    return user_session
+
+
+async def test_resume_fills_the_memory_window_with_older_messages(
+    user_session: FakeUserSession,
+    sqlite_data_layer: SQLAlchemyDataLayer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Short recent messages should be completed by older pages up to the budget."""
+    thread_id = user_session["thread_id"]
+    await insert_conversation(sqlite_data_layer, thread_id)
+    monkeypatch.setattr(general.env_settings, "memory_window_max_tokens", 60)
+
+    await general.resume_user_session(
+        {"id": thread_id, "userIdentifier": "admin", "steps": []}
+    )
+
+    messages = user_session["message_history"].messages
+
+    assert PAGE_SIZE < len(messages) < TURNS * 2
+    assert messages[-1].content == f"assistant_message {TURNS - 1}"
+    assert user_session["message_history_cursor"] is not None
+
+
+async def test_fill_stops_when_the_thread_has_no_older_messages(
+    user_session: FakeUserSession,
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """A large budget should load the whole thread and clear the cursor."""
+    thread_id = user_session["thread_id"]
+    await insert_conversation(sqlite_data_layer, thread_id)
+
+    user_session["message_history"] = await general.load_thread_message_history(
+        {"id": thread_id}
+    )
+
+    assert await general.fill_message_history_window(max_tokens=100_000) == (
+        TURNS * 2 - PAGE_SIZE
+    )
+    assert user_session["message_history"].messages[0].content == "user_message 0"
+    assert user_session["message_history_cursor"] is None
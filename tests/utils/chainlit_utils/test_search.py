@@ -0,0 +1,107 @@
+"""Tests for the full-text search of the steps and transcripts."""
+
+from __future__ import annotations
+
+from uuid import uuid4
+
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+
+from podflix.utils.chainlit_utils.search import SearchIndex, build_fts5_query
+from podflix.utils.chainlit_utils.thread_stores import ThreadTranscriptStore
+
+UPSERT_STEP_SQL = """
+    INSERT INTO steps ("id", "name", "type", "threadId", "streaming", "output", "createdAt")
+    VALUES (:id, 'assistant', 'assistant_message', :thread_id, false, :output, :created_at)
+    ON CONFLICT ("id") DO UPDATE SET "output" = EXCLUDED."output"
+"""
+
+
+async def create_thread(data_layer: SQLAlchemyDataLayer, user_identifier: str) -> str:
+    """Create a thread of a user and return its identifier."""
+    thread_id = str(uuid4())
+
+    await data_layer.execute_sql(
+        query="""
+            INSERT INTO threads ("id", "name", "userIdentifier", "metadata")
+            VALUES (:id, 'My thread', :user_identifier, '{}')
+        """,
+        parameters={"id": thread_id, "user_identifier": user_identifier},
+    )
+
+    return thread_id
+
+
+def test_build_fts5_query_quotes_every_word() -> None:
+    """The FTS5 syntax of the user query should be neutralized."""
+    assert build_fts5_query('vector* OR "db"') == '"vector" "OR" "db"'
+    assert build_fts5_query("  ?! ") == ""
+
+
+async def test_steps_are_indexed_as_they_are_written(
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """Inserted, updated and deleted steps should be reflected by the search."""
+    search_index = SearchIndex(data_layer=sqlite_data_layer)
+    thread_id = await create_thread(sqlite_data_layer, "alice")
+    other_thread_id = await create_thread(sqlite_data_layer, "bob")
+    step_id = str(uuid4())
+
+    for step_thread_id, output in [
+        (thread_id, "Retrieval augmented generation"),
+        (other_thread_id, "Retrieval for bob"),
+    ]:
+        await sqlite_data_layer.execute_sql(
+            query=UPSERT_STEP_SQL,
+            parameters={
+                "id": step_id if step_thread_id == thread_id else str(uuid4()),
+                "thread_id": step_thread_id,
+                "output": output,
+                "created_at": "2025-01-01T00:00:00Z",
+            },
+        )
+
+    results = await search_index.search("retrieval", user_identifier="alice")
+    assert [step["id"] for step in results["steps"]] == [step_id]
+    assert results["steps"][0]["snippet"] == "[Retrieval] augmented generation"
+
+    await sqlite_data_layer.execute_sql(
+        query=UPSERT_STEP_SQL,
+        parameters={
+            "id": step_id,
+            "thread_id": thread_id,
+            "output": "Vector databases",
+            "created_at": "2025-01-01T00:00:00Z",
+        },
+    )
+
+    assert (await search_index.search("retrieval", "alice"))["steps"] == []
+    assert len((await search_index.search("vector", "alice"))["steps"]) == 1
+
+    await sqlite_data_layer.execute_sql(
+        query='DELETE FROM steps WHERE "id" = :id', parameters={"id": step_id}
+    )
+
+    assert (await search_index.search("vector", "alice"))["steps"] == []
+
+
+async def test_saved_transcripts_are_searchable(
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """A transcript should be searchable once saved, and reindexed when replaced."""
+    store = ThreadTranscriptStore(data_layer=sqlite_data_layer)
+    search_index = SearchIndex(data_layer=sqlite_data_layer)
+    thread_id = await create_thread(sqlite_data_layer, "alice")
+
+    # NOTE: Bypass the queue waiting for the first user message of a Chainlit session
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, thread_id, "episode-1", "Welcome to the podcast about rust", []
+    )
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, thread_id, "episode-2", "Welcome to the podcast about python", []
+    )
+
+    assert (await search_index.search("rust", "alice"))["transcripts"] == []
+
+    transcripts = (await search_index.search("python podcast", "alice"))["transcripts"]
+    assert [transcript["episodeId"] for transcript in transcripts] == ["episode-2"]
+    assert (await search_index.search("python", "bob"))["transcripts"] == []
@@ -0,0 +1,152 @@
+"""Tests for the externalized session state."""
+
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from langchain_community.chat_message_histories import ChatMessageHistory
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from podflix.db.migrations import MigrationRunner
+from podflix.utils.chainlit_utils.session_state import (
+    InMemorySessionStateBackend,
+    RedisSessionStateBackend,
+    SessionStateBackend,
+    SQLSessionStateBackend,
+    deserialize_session_state,
+    serialize_session_state,
+)
+from podflix.utils.pydantic_models import OpenAIChatGenerationSettings
+
+
+class FakeRedis:
+    """Stub of the Redis commands used by the Redis backend."""
+
+    def __init__(self):
+        self.values: dict[str, bytes] = {}
+        self.expirations: dict[str, int | None] = {}
+
+    async def get(self, key: str) -> bytes | None:  # noqa: D102
+        return self.values.get(key)
+
+    async def set(self, key: str, value: bytes, ex: int | None = None) -> None:  # noqa: D102
+        self.values[key] = value
+        self.expirations[key] = ex
+
+    async def delete(self, key: str) -> None:  # noqa: D102
+        self.values.pop(key, None)
+
+
+def test_session_state_serialization_round_trip() -> None:
+    """The message history, settings and cursor should survive serialization."""
+    message_history = ChatMessageHistory()
+    message_history.add_user_message("What is RAG?")
+    message_history.add_ai_message("Retrieval augmented generation.")
+
+    content = serialize_session_state(
+        {
+            "session_id": "session-1",
+            "message_history": message_history,
+            "message_history_cursor": ("2025-01-01T00:00:00Z", "step-1"),
+            "settings": OpenAIChatGenerationSettings(),
+        }
+    )
+    state = deserialize_session_state(content)
+
+    assert state["session_id"] == "session-1"
+    assert state["message_history"].messages == message_history.messages
+    assert state["message_history_cursor"] == ("2025-01-01T00:00:00Z", "step-1")
+    assert OpenAIChatGenerationSettings(**state["settings"]) == (
+        OpenAIChatGenerationSettings()
+    )
+
+
+@pytest.fixture
+async def sqlite_engine(tmp_path: Path) -> AsyncEngine:
+    """Create an async engine on a fresh SQLite database with the podflix schema."""
+    db_path = tmp_path / "db.sqlite"
+
+    MigrationRunner(sa.create_engine(f"sqlite:///{db_path}")).upgrade()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+
+    yield engine
+
+    await engine.dispose()
+
+
+@pytest.fixture(params=["memory", "sql", "redis"])
+def backend(
+    request: pytest.FixtureRequest, sqlite_engine: AsyncEngine
+) -> SessionStateBackend:
+    """Create each session state backend."""
+    if request.param == "sql":
+        return SQLSessionStateBackend(engine=sqlite_engine)
+
+    if request.param == "redis":
+        return RedisSessionStateBackend(client=FakeRedis())
+
+    return InMemorySessionStateBackend()
+
+
+async def test_backend_set_get_delete(backend: SessionStateBackend) -> None:
+    """Every backend should store, replace and delete values."""
+    assert await backend.get("key") is None
+
+    await backend.set("key", b"first", ex=60)
+    await backend.set("key", b"second", ex=60)
+    assert await backend.get("key") == b"second"
+
+    await backend.delete("key")
+    assert await backend.get("key") is None
+
+
+@pytest.mark.parametrize("backend_type", ["memory", "sql"])
+async def test_backend_expires_values(
+    backend_type: str,
+    sqlite_engine: AsyncEngine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Values should not be returned after their expiration."""
+    if backend_type == "sql":
+        backend = SQLSessionStateBackend(engine=sqlite_engine)
+    else:
+        backend = InMemorySessionStateBackend()
+
+    now = time.time()
+    await backend.set("key", b"value", ex=10)
+
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+
+    assert await backend.get("key") is None
+
+
+async def test_sql_backend_raises_database_errors(tmp_path: Path) -> None:
+    """A failing query should raise instead of looking like a missing value."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'empty.sqlite'}")
+    backend = SQLSessionStateBackend(engine=engine)
+
+    with pytest.raises(sa.exc.OperationalError):
+        await backend.get("key")
+
+    await engine.dispose()
+
+
+async def test_memory_backend_evicts_expired_values_without_reading_them(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Expired values should be dropped by later writes, even if never read again."""
+    backend = InMemorySessionStateBackend()
+    now = time.time()
+
+    await backend.set("expired", b"value", ex=10)
+    await backend.set("replaced", b"first", ex=10)
+    await backend.set("replaced", b"second", ex=60)
+
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    await backend.set("fresh", b"value", ex=10)
+
+    assert len(backend) == 2  # noqa: PLR2004
+    assert await backend.get("replaced") == b"second"
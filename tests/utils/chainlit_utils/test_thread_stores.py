@@ -0,0 +1,120 @@
+"""Tests for the thread transcript, history and metadata stores."""
+
+from __future__ import annotations
+
+from uuid import uuid4
+
+from chainlit.data.sql_alchemy import SQLAlchemyDataLayer
+
+from podflix.utils.chainlit_utils.thread_stores import (
+    ThreadFinder,
+    ThreadHistoryStore,
+    ThreadTranscriptStore,
+    compress_transcript,
+    decompress_transcript,
+)
+
+SEGMENTS = [{"id": 0, "start": 0.0, "end": 1.5, "text": "Hello world"}]
+
+
+def test_transcript_compression_round_trip() -> None:
+    """A compressed transcript should be restored unchanged."""
+    content = compress_transcript(text="Hello world " * 100, segments=SEGMENTS)
+
+    assert len(content) < len("Hello world " * 100)
+    assert decompress_transcript(content) == {
+        "text": "Hello world " * 100,
+        "segments": SEGMENTS,
+    }
+
+
+async def test_thread_transcript_store_save_and_load(
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """A saved transcript should be loaded for its thread only."""
+    store = ThreadTranscriptStore(data_layer=sqlite_data_layer)
+    thread_id = str(uuid4())
+
+    # NOTE: Bypass the queue waiting for the first user message of a Chainlit session
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, thread_id, "episode-1", "Hello world", SEGMENTS
+    )
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, thread_id, "episode-2", "Hello again", SEGMENTS
+    )
+
+    assert await store.load(thread_id) == {
+        "episode_id": "episode-2",
+        "text": "Hello again",
+        "segments": SEGMENTS,
+    }
+    assert await store.load(str(uuid4())) is None
+
+
+async def test_thread_history_store_paginates_recent_messages(
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """Pages should hold the most recent messages, oldest first, until none are left."""
+    store = ThreadHistoryStore(data_layer=sqlite_data_layer)
+    thread_id = str(uuid4())
+    steps = [
+        ("user_message", "question 1", "2025-01-01T00:00:01Z"),
+        ("assistant_message", "answer 1", "2025-01-01T00:00:02Z"),
+        ("run", "graph run", "2025-01-01T00:00:02Z"),
+        ("user_message", "question 2", "2025-01-01T00:00:03Z"),
+        ("assistant_message", "answer 2", "2025-01-01T00:00:03Z"),
+    ]
+
+    for index, (step_type, output, created_at) in enumerate(steps):
+        await sqlite_data_layer.execute_sql(
+            query="""
+                INSERT INTO steps ("id", "name", "type", "threadId", "streaming", "output", "createdAt")
+                VALUES (:id, :name, :type, :thread_id, false, :output, :created_at)
+            """,
+            parameters={
+                # NOTE: Steps created at the same time are ordered by their id
+                "id": f"00000000-0000-0000-0000-00000000000{index}",
+                "name": step_type,
+                "type": step_type,
+                "thread_id": thread_id,
+                "output": output,
+                "created_at": created_at,
+            },
+        )
+
+    page = await store.load_page(thread_id, limit=3)
+    assert [step["output"] for step in page.steps] == [
+        "answer 1",
+        "question 2",
+        "answer 2",
+    ]
+    assert page.cursor is not None
+
+    older_page = await store.load_page(thread_id, limit=3, before=page.cursor)
+    assert [step["output"] for step in older_page.steps] == ["question 1"]
+    assert older_page.cursor is None
+
+    assert (await store.load_page(str(uuid4()), limit=3)).steps == []
+
+
+async def test_thread_finder_filters_threads_by_metadata(
+    sqlite_data_layer: SQLAlchemyDataLayer,
+) -> None:
+    """Threads tagged with the show of their transcript should be found by it."""
+    store = ThreadTranscriptStore(data_layer=sqlite_data_layer)
+    finder = ThreadFinder(data_layer=sqlite_data_layer, schema_mode="json")
+    youtube_thread_id = str(uuid4())
+    upload_thread_id = str(uuid4())
+
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, youtube_thread_id, "episode-1", "Hello", SEGMENTS, show="Youtube"
+    )
+    await ThreadTranscriptStore.save.__wrapped__(
+        store, upload_thread_id, "episode-2", "Hello", SEGMENTS, show="Local Uploads"
+    )
+
+    threads = await finder.find({"show": "Youtube"})
+    assert [thread["id"] for thread in threads] == [youtube_thread_id]
+    assert threads[0]["metadata"] == {"episode_id": "episode-1", "show": "Youtube"}
+
+    assert await finder.find({"show": "Youtube", "episode_id": "episode-2"}) == []
@@ -0,0 +1,92 @@
+"""Tests for the streamed token coalescer."""
+
+from __future__ import annotations
+
+import asyncio
+
+from podflix.utils.chainlit_utils.token_coalescer import TokenCoalescer
+
+
+class RecordingTarget:
+    """Stream target recording every emitted chunk."""
+
+    def __init__(self) -> None:
+        self.emits: list[str] = []
+
+    async def stream_token(self, token: str) -> None:
+        """Record the emitted token."""
+        self.emits.append(token)
+
+
+async def test_tokens_are_flushed_on_size_threshold() -> None:
+    """Tokens should be emitted together once the size threshold is reached."""
+    target = RecordingTarget()
+    coalescer = TokenCoalescer(target, flush_interval_ms=10_000, flush_max_chars=4)
+
+    for token in ["ab", "cd", "ef"]:
+        await coalescer.add(token)
+
+    assert target.emits == ["abcd"]
+
+    await coalescer.flush()
+
+    assert target.emits == ["abcd", "ef"]
+
+
+async def test_tokens_are_flushed_on_time_threshold() -> None:
+    """Buffered tokens should not wait longer than the flush interval."""
+    target = RecordingTarget()
+    coalescer = TokenCoalescer(target, flush_interval_ms=10, flush_max_chars=1000)
+
+    await coalescer.add("a")
+    await coalescer.add("b")
+    await asyncio.sleep(0.05)
+
+    assert target.emits == ["ab"]
+
+
+async def test_context_manager_flushes_at_the_end() -> None:
+    """The remaining tokens should always be flushed when the stream ends."""
+    target = RecordingTarget()
+
+    async with TokenCoalescer(
+        target, flush_interval_ms=10_000, flush_max_chars=1000
+    ) as coalescer:
+        for token in ["Hello", " ", "world"]:
+            await coalescer.add(token)
+
+        assert target.emits == []
+
+    assert target.emits == ["Hello world"]
+
+
+async def test_single_char_threshold_disables_coalescing() -> None:
+    """A threshold of one character should emit every token immediately."""
+    target = RecordingTarget()
+    coalescer = TokenCoalescer(target, flush_max_chars=1)
+
+    for token in ["a", "b"]:
+        await coalescer.add(token)
+
+    assert target.emits == ["a", "b"]
+
+
+async def test_flush_waits_for_slow_websocket_to_drain() -> None:
+    """Flushing should wait while the websocket write queue is over its limit."""
+    target = RecordingTarget()
+    pending = {"packets": 10}
+    coalescer = TokenCoalescer(
+        target,
+        flush_max_chars=1,
+        max_pending_packets=5,
+        pending_packets=lambda: pending["packets"],
+    )
+
+    flush_task = asyncio.create_task(coalescer.add("a"))
+    await asyncio.sleep(0.05)
+
+    assert target.emits == ["a"]
+    assert not flush_task.done()
+
+    pending["packets"] = 0
+    await asyncio.wait_for(flush_task, timeout=1)
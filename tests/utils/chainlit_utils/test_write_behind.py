@@ -0,0 +1,135 @@
+"""Tests for the write-behind data layer."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from podflix.db.migrations import MigrationRunner
+from podflix.utils.chainlit_utils.write_behind import WriteBehindDataLayer
+
+UPDATES = 20
+
+
+@pytest.fixture
+def write_behind_data_layer(tmp_path: Path) -> WriteBehindDataLayer:
+    """Create a write-behind data layer with a window longer than the tests."""
+    db_path = tmp_path / "db.sqlite"
+
+    MigrationRunner(sa.create_engine(f"sqlite:///{db_path}")).upgrade()
+
+    return WriteBehindDataLayer(
+        conninfo=f"sqlite+aiosqlite:///{db_path}", write_behind_ms=60_000
+    )
+
+
+def make_step(thread_id: str, step_id: str, output: str) -> dict:
+    """Return a step dictionary like the ones of a streamed Chainlit message."""
+    return {
+        "id": step_id,
+        "threadId": thread_id,
+        "name": "Assistant",
+        "type": "assistant_message",
+        "output": output,
+        "createdAt": "2025-01-01T00:00:00Z",
+        "streaming": True,
+        "metadata": {},
+    }
+
+
+async def test_step_updates_are_coalesced(
+    write_behind_data_layer: WriteBehindDataLayer,
+) -> None:
+    """Repeated updates of the steps should be written once, with their last values."""
+    statements = []
+    event.listen(
+        write_behind_data_layer.engine.sync_engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    thread_id = str(uuid4())
+    step_ids = [str(uuid4()), str(uuid4())]
+
+    for index in range(UPDATES):
+        for step_id in step_ids:
+            await write_behind_data_layer.buffer_step(
+                make_step(thread_id, step_id, output="token " * (index + 1))
+            )
+
+    assert statements == []
+    assert write_behind_data_layer.pending_steps == len(step_ids)
+
+    assert await write_behind_data_layer.flush() == len(step_ids)
+    assert await write_behind_data_layer.flush() == 0
+
+    rows = await write_behind_data_layer.execute_sql(
+        query='SELECT "output" FROM steps WHERE "threadId" = :thread_id',
+        parameters={"thread_id": thread_id},
+    )
+    assert [row["output"] for row in rows] == ["token " * UPDATES] * len(step_ids)
+
+    # NOTE: One thread insert and one step upsert for all the updates
+    assert len([s for s in statements if s.lstrip().startswith("INSERT")]) == 2  # noqa: PLR2004
+
+
+async def test_later_writes_keep_the_fields_they_do_not_set(
+    write_behind_data_layer: WriteBehindDataLayer,
+) -> None:
+    """A write without a field should keep its buffered value, like an upsert."""
+    thread_id = str(uuid4())
+    step_id = str(uuid4())
+
+    await write_behind_data_layer.buffer_step(make_step(thread_id, step_id, "answer"))
+    await write_behind_data_layer.buffer_step(
+        {**make_step(thread_id, step_id, output=None), "streaming": False}
+    )
+    await write_behind_data_layer.flush()
+
+    step = await write_behind_data_layer.get_step(step_id)
+
+    assert step["output"] == "answer"
+    assert not step["streaming"]
+
+
+async def test_failing_steps_are_buffered_again(
+    write_behind_data_layer: WriteBehindDataLayer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A failing step should not drop the others, and should be retried later."""
+    thread_id = str(uuid4())
+    failing_step_id = str(uuid4())
+    write_steps = write_behind_data_layer._write_steps
+
+    async def failing_write_steps(steps: list[dict]) -> None:
+        if any(step["id"] == failing_step_id for step in steps):
+            raise RuntimeError("database is locked")
+
+        await write_steps(steps)
+
+    monkeypatch.setattr(write_behind_data_layer, "_write_steps", failing_write_steps)
+
+    await write_behind_data_layer.buffer_step(make_step(thread_id, str(uuid4()), "ok"))
+    await write_behind_data_layer.buffer_step(
+        make_step(thread_id, failing_step_id, "partial")
+    )
+
+    assert await write_behind_data_layer.flush() == 1
+    assert write_behind_data_layer.pending_steps == 1
+
+    await write_behind_data_layer.buffer_step(
+        {**make_step(thread_id, failing_step_id, "whole answer"), "streaming": False}
+    )
+
+    with pytest.raises(RuntimeError):
+        await write_behind_data_layer.flush(raise_on_error=True)
+
+    monkeypatch.setattr(write_behind_data_layer, "_write_steps", write_steps)
+
+    assert await write_behind_data_layer.flush() == 1
+
+    step = await write_behind_data_layer.get_step(failing_step_id)
+
+    assert step["output"] == "whole answer"
@@ -0,0 +1,65 @@
+"""Tests for the semantic answer cache."""
+
+from __future__ import annotations
+
+import pytest
+
+from podflix.utils import answer_cache
+from podflix.utils.answer_cache import SemanticAnswerCache
+
+
+def test_lookup_returns_similar_answer_of_same_episode() -> None:
+    """A similar question about the same episode should hit the cache."""
+    cache = SemanticAnswerCache(similarity_threshold=0.9)
+    cache.store("episode-1", "What is RAG?", [1.0, 0.0], "RAG answer", "fp")
+
+    hit = cache.lookup("episode-1", [0.98, 0.05], "fp")
+
+    assert hit is not None
+    assert hit.answer == "RAG answer"
+
+
+@pytest.mark.parametrize(
+    ("episode_id", "embedding", "fingerprint"),
+    [
+        ("episode-2", [1.0, 0.0], "fp"),
+        ("episode-1", [0.0, 1.0], "fp"),
+        ("episode-1", [1.0, 0.0], "other-fp"),
+    ],
+)
+def test_lookup_misses(
+    episode_id: str, embedding: list[float], fingerprint: str
+) -> None:
+    """Other episodes, dissimilar questions and other settings should miss."""
+    cache = SemanticAnswerCache(similarity_threshold=0.9)
+    cache.store("episode-1", "What is RAG?", [1.0, 0.0], "RAG answer", "fp")
+
+    assert cache.lookup(episode_id, embedding, fingerprint) is None
+
+
+def test_expired_entries_are_evicted(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Entries older than the ttl should not be served."""
+    now = {"value": 100.0}
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now["value"])
+
+    cache = SemanticAnswerCache(ttl=10)
+    cache.store("episode-1", "question", [1.0], "answer", "fp")
+    now["value"] += 11
+
+    assert cache.lookup("episode-1", [1.0], "fp") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted() -> None:
+    """The least recently used entry should be evicted when the cache is full."""
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store("episode-1", "first", [1.0, 0.0], "first answer", "fp")
+    cache.store("episode-2", "second", [1.0, 0.0], "second answer", "fp")
+
+    # Touch the first entry so that the second one becomes the LRU entry
+    assert cache.lookup("episode-1", [1.0, 0.0], "fp") is not None
+    cache.store("episode-3", "third", [1.0, 0.0], "third answer", "fp")
+
+    assert len(cache) == cache.max_entries
+    assert cache.lookup("episode-2", [1.0, 0.0], "fp") is None
+    assert cache.lookup("episode-1", [1.0, 0.0], "fp") is not None
@@ -0,0 +1,93 @@
+"""Tests for the deterministic completion cache."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from podflix.utils.completion_cache import (
+    CompletionCache,
+    CompletionReplayStream,
+    get_completion_cache_key,
+    is_deterministic_request,
+    record_completion_chunks,
+)
+from podflix.utils.pydantic_models import OpenAIChatGenerationSettings
+
+
+def test_only_seeded_zero_temperature_requests_are_deterministic() -> None:
+    """Sampling requests should never be served from the cache."""
+    assert is_deterministic_request(OpenAIChatGenerationSettings(seed=1, temperature=0))
+    assert not is_deterministic_request(
+        OpenAIChatGenerationSettings(seed=1, temperature=0.7)
+    )
+    assert not is_deterministic_request(
+        OpenAIChatGenerationSettings(seed=1, temperature=0, n=2)
+    )
+
+
+def test_cache_key_depends_on_messages_and_settings() -> None:
+    """The key should change with the messages or the generation settings."""
+    settings = OpenAIChatGenerationSettings(seed=1, temperature=0)
+    messages = [{"role": "user", "content": "Hi", "id": "1"}]
+
+    key = get_completion_cache_key(messages, settings)
+
+    assert key == get_completion_cache_key(
+        [{"role": "user", "content": " Hi\n", "id": "2"}], settings
+    )
+    assert key != get_completion_cache_key(
+        [{"role": "user", "content": "Hello"}], settings
+    )
+    assert key != get_completion_cache_key(
+        messages, settings.model_copy(update={"max_tokens": 10})
+    )
+
+
+def test_memory_cache_evicts_least_recently_used() -> None:
+    """The memory cache should stay within its entry and character bounds."""
+    cache = CompletionCache(max_entries=2, max_chars=10)
+
+    cache.store("a", ["aa"])
+    cache.store("b", ["bb"])
+    assert cache.lookup("a") == ["aa"]
+    cache.store("c", ["cc"])
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") == ["aa"]
+
+    cache.store("d", ["0123456789"])
+
+    assert len(cache) == 1
+    assert cache.lookup("d") == ["0123456789"]
+
+
+def test_disk_cache_persists_and_evicts(tmp_path: Path) -> None:
+    """The disk cache should survive a new instance and keep its entry bound."""
+    cache = CompletionCache(max_entries=2, directory=tmp_path)
+    cache.store("a", ["a"])
+    cache.store("b", ["b"])
+    cache.store("c", ["c"])
+
+    reopened = CompletionCache(max_entries=2, directory=tmp_path)
+
+    assert len(reopened) == len(["b", "c"])
+    assert reopened.lookup("c") == ["c"]
+
+
+async def test_recorded_stream_replays_with_original_chunks() -> None:
+    """A replayed stream should yield the chunk boundaries of the recorded one."""
+    original = CompletionReplayStream(chunks=["Hel", "lo", " world"], model="model")
+    recorded: list[str] = []
+
+    async with original:
+        streamed = [
+            chunk.choices[0].delta.content
+            async for chunk in record_completion_chunks(original, recorded)
+        ]
+
+    replayed = [
+        chunk.choices[0].delta.content
+        async for chunk in CompletionReplayStream(chunks=recorded, model="model")
+    ]
+
+    assert recorded == streamed == replayed == ["Hel", "lo", " world"]
@@ -0,0 +1,142 @@
+"""Tests for the graph runner streaming modes."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Annotated, Sequence, TypedDict
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+
+from podflix.utils import graph_runner
+from podflix.utils.graph_runner import GraphRunner
+
+
+class State(TypedDict):
+    """State of the test graph."""
+
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+
+
+class RecordingMessage:
+    """Assistant message recording the streamed content."""
+
+    def __init__(self) -> None:
+        self.content = ""
+
+    async def stream_token(self, token: str) -> None:
+        """Append the streamed token."""
+        self.content += token
+
+
+class RootRunRecorder(BaseCallbackHandler):
+    """Callback handler recording the run id of the root chain."""
+
+    def __init__(self) -> None:
+        self.root_run_id = None
+
+    def on_chain_start(  # noqa: D102
+        self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs
+    ) -> None:
+        if parent_run_id is None:
+            self.root_run_id = str(run_id)
+
+
+def _build_graph():
+    async def generate(state: State) -> State:
+        model = GenericFakeChatModel(messages=iter(["Hello streamed world"]))
+        response = await model.ainvoke(state["messages"])
+        return {"messages": [AIMessage(content=response.content)]}
+
+    async def silent(state: State) -> State:
+        model = GenericFakeChatModel(messages=iter(["internal"]))
+        await model.ainvoke(state["messages"])
+        return {}
+
+    graph = StateGraph(State)
+    graph.add_node("silent", silent)
+    graph.add_node("generate", generate)
+    graph.add_edge("silent", "generate")
+    graph.add_edge("generate", END)
+    graph.set_entry_point("silent")
+
+    return graph.compile()
+
+
+@pytest.mark.parametrize("stream_mode", ["messages", "events"])
+async def test_stream_modes_stream_only_streamable_nodes(
+    monkeypatch: pytest.MonkeyPatch, stream_mode: str
+) -> None:
+    """Both stream modes should stream the same tokens and keep the root run id."""
+    monkeypatch.setattr(
+        graph_runner.cl, "LangchainCallbackHandler", BaseCallbackHandler
+    )
+    assistant_message = RecordingMessage()
+    root_run_recorder = RootRunRecorder()
+
+    runner = GraphRunner(
+        graph=_build_graph(),
+        graph_inputs={"messages": [HumanMessage("Hi")]},
+        graph_streamable_node_names=["generate"],
+        lf_cb_handler=root_run_recorder,
+        user_id="user",
+        session_id="session",
+        assistant_message=assistant_message,
+        stream_mode=stream_mode,
+    )
+    await runner.run_graph()
+
+    assert assistant_message.content == "Hello streamed world"
+    assert runner.final_state["messages"][-1].content == "Hello streamed world"
+    assert runner.run_id == root_run_recorder.root_run_id
+
+
+async def test_cancelled_run_closes_graph_and_keeps_partial_answer(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Cancelling the run should stop the running node and keep the partial answer."""
+    monkeypatch.setattr(
+        graph_runner.cl, "LangchainCallbackHandler", BaseCallbackHandler
+    )
+    node_cancelled = asyncio.Event()
+
+    async def generate(state: State) -> State:
+        model = GenericFakeChatModel(messages=iter(["partial answer"]))
+        await model.ainvoke(state["messages"])
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            node_cancelled.set()
+            raise
+        return {}
+
+    graph = StateGraph(State)
+    graph.add_node("generate", generate)
+    graph.add_edge("generate", END)
+    graph.set_entry_point("generate")
+
+    assistant_message = RecordingMessage()
+    runner = GraphRunner(
+        graph=graph.compile(),
+        graph_inputs={"messages": [HumanMessage("Hi")]},
+        graph_streamable_node_names=["generate"],
+        lf_cb_handler=BaseCallbackHandler(),
+        user_id="user",
+        session_id="session",
+        assistant_message=assistant_message,
+    )
+
+    task = asyncio.create_task(runner.run_graph())
+    await asyncio.sleep(0.2)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert runner.cancelled is True
+    assert node_cancelled.is_set()
+    assert assistant_message.content == "partial answer"
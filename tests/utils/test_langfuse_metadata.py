@@ -0,0 +1,93 @@
+"""Tests for the cached Langfuse metadata and the URL builders."""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+
+from podflix.env_settings import env_settings
+from podflix.utils import general, langfuse_metadata
+from podflix.utils.langfuse_metadata import LangfuseMetadata
+
+
+class FakeProjects:
+    """Langfuse projects API returning a fixed project list."""
+
+    def __init__(self, project_ids: list[str], fail: bool = False) -> None:
+        self.project_ids = project_ids
+        self.fail = fail
+        self.calls = 0
+
+    def get(self) -> SimpleNamespace:
+        """Return the projects or raise like an unreachable Langfuse."""
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("Langfuse is down")
+        return SimpleNamespace(
+            data=[SimpleNamespace(id=id_) for id_ in self.project_ids]
+        )
+
+
+def _patch_client(monkeypatch: pytest.MonkeyPatch, projects: FakeProjects) -> None:
+    client = SimpleNamespace(api=SimpleNamespace(projects=projects))
+    monkeypatch.setattr(langfuse_metadata, "get_client", lambda: client)
+
+
+def test_refresh_caches_project_id(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A single refresh should check the credentials and cache the project id."""
+    projects = FakeProjects(["project"])
+    _patch_client(monkeypatch, projects)
+    metadata = LangfuseMetadata(ttl=60)
+
+    assert metadata.is_stale() is True
+    assert metadata.refresh() is True
+
+    assert metadata.project_id == "project"
+    assert metadata.is_stale() is False
+    assert projects.calls == 1
+
+
+def test_failed_refresh_keeps_last_project_id(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A Langfuse outage should not drop the known project id."""
+    projects = FakeProjects(["project"])
+    _patch_client(monkeypatch, projects)
+    metadata = LangfuseMetadata(ttl=60)
+    metadata.refresh()
+
+    projects.fail = True
+
+    assert metadata.refresh() is False
+    assert metadata.credentials_valid is False
+    assert metadata.project_id == "project"
+
+
+async def test_url_builders_use_cached_project_id(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """The URL builders should never wait for Langfuse."""
+    metadata = LangfuseMetadata(ttl=60)
+    monkeypatch.setattr(general, "langfuse_metadata", metadata)
+    monkeypatch.setattr(metadata, "refresh", lambda: pytest.fail("must not block"))
+    monkeypatch.setattr(metadata, "refresh_in_background", lambda: None)
+
+    assert general.get_lf_session_url("session") is None
+
+    metadata.project_id = "project"
+    base_url = env_settings.langfuse_base_url
+
+    assert general.get_lf_session_url("session") == (
+        f"{base_url}/project/project/sessions/session"
+    )
+    assert general.get_lf_trace_url("trace") == (
+        f"{base_url}/project/project/traces/trace"
+    )
+
+
+def test_trace_id_is_derived_from_run_id() -> None:
+    """The trace id of a run should be known before the trace is sent."""
+    trace_id = general.get_lf_trace_id("run")
+
+    assert trace_id == general.get_lf_trace_id("run")
+    assert trace_id != general.get_lf_trace_id("other-run")
+    assert len(trace_id) == len("0" * 32)
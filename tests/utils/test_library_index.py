@@ -0,0 +1,195 @@
+"""Tests for the sharded library index."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from podflix.utils.general import is_module_installed
+from podflix.utils.library_index import (
+    LibraryChunk,
+    ShardedLibraryIndex,
+    chunk_segments,
+)
+
+USE_HNSW_PARAMS = [
+    False,
+    pytest.param(
+        True,
+        marks=pytest.mark.skipif(
+            not is_module_installed("hnswlib"), reason="hnswlib is not installed"
+        ),
+    ),
+]
+
+
+def _chunk(
+    text: str, show: str, user_id: str = "admin", published_at: str = "2025-01-01"
+) -> LibraryChunk:
+    return LibraryChunk(
+        chunk_id=-1,
+        episode_id=f"{show}-{text}",
+        show=show,
+        user_id=user_id,
+        published_at=published_at,
+        text=text,
+        start=0.0,
+        end=1.0,
+    )
+
+
+def _build_index(use_hnsw: bool, directory: Path | None = None) -> ShardedLibraryIndex:
+    library_index = ShardedLibraryIndex(directory=directory, use_hnsw=use_hnsw)
+    library_index.add_chunks(
+        "show-a",
+        [_chunk("rag", "show-a"), _chunk("llm", "show-a", user_id="guest")],
+        [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]],
+    )
+    library_index.add_chunks(
+        "show-b",
+        [_chunk("rag again", "show-b", published_at="2025-06-01")],
+        [[0.9, 0.1, 0.0]],
+    )
+    library_index.flush()
+    return library_index
+
+
+def test_chunk_segments_merges_up_to_max_chars() -> None:
+    """Consecutive segments should be merged until the chunk size is reached."""
+    segments = [
+        {"start": float(index), "end": index + 1.0, "text": "word " * 5}
+        for index in range(4)
+    ]
+
+    chunks = chunk_segments(segments, max_chars=60)
+
+    assert [(chunk["start"], chunk["end"]) for chunk in chunks] == [
+        (0.0, 2.0),
+        (2.0, 4.0),
+    ]
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_search_merges_all_shards(use_hnsw: bool) -> None:
+    """Without a show filter all shards should be searched."""
+    library_index = _build_index(use_hnsw)
+
+    results = library_index.search([1.0, 0.0, 0.0], k=2)
+
+    assert [chunk.text for chunk, _ in results] == ["rag", "rag again"]
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+@pytest.mark.parametrize(
+    ("filters", "expected_texts"),
+    [
+        ({"show": "show-b"}, ["rag again"]),
+        ({"user_id": "guest"}, ["llm"]),
+        ({"date_from": "2025-03-01"}, ["rag again"]),
+        ({"date_to": "2025-03-01", "user_id": "admin"}, ["rag"]),
+    ],
+)
+def test_search_applies_metadata_filters(
+    use_hnsw: bool, filters: dict, expected_texts: list[str]
+) -> None:
+    """Only chunks matching the metadata filters should be returned."""
+    library_index = _build_index(use_hnsw)
+
+    results = library_index.search([1.0, 0.0, 0.0], k=1, **filters)
+
+    assert [chunk.text for chunk, _ in results] == expected_texts
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_persisted_index_is_loaded(use_hnsw: bool, tmp_path: Path) -> None:
+    """Shards saved on ingest should be loaded by a new index."""
+    _build_index(use_hnsw, directory=tmp_path)
+
+    library_index = ShardedLibraryIndex(directory=tmp_path, use_hnsw=use_hnsw)
+    library_index.load()
+
+    assert len(library_index) == len(["rag", "llm", "rag again"])
+    assert library_index.has_episode("show-b-rag again")
+    assert library_index.search([0.0, 1.0, 0.0], k=1)[0][0].text == "llm"
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_episode_ingested_again_is_owned_by_both_users(
+    use_hnsw: bool, tmp_path: Path
+) -> None:
+    """A second user ingesting an episode should find it without a new embedding."""
+    library_index = _build_index(use_hnsw, directory=tmp_path)
+
+    assert not library_index.has_episode("show-a-llm", user_id="admin")
+    assert library_index.add_owner("show-a-llm", "admin") is True
+    assert library_index.add_owner("unknown", "admin") is False
+    assert len(library_index) == len(["rag", "llm", "rag again"])
+
+    reloaded_index = ShardedLibraryIndex(directory=tmp_path, use_hnsw=use_hnsw)
+    reloaded_index.load()
+
+    assert reloaded_index.has_episode("show-a-llm", user_id="admin")
+    assert reloaded_index.has_episode("show-a-llm", user_id="guest")
+    assert not reloaded_index.has_episode("show-a-rag", user_id="guest")
+    assert [
+        chunk.text
+        for chunk, _ in reloaded_index.search([0.0, 1.0, 0.0], k=1, user_id="admin")
+    ] == ["llm"]
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_search_widens_until_enough_chunks_match(use_hnsw: bool) -> None:
+    """A user owning few episodes of a large shard should still get k results."""
+    library_index = ShardedLibraryIndex(use_hnsw=use_hnsw, overfetch=2)
+    chunks = [_chunk(f"admin {index}", "show-a") for index in range(100)] + [
+        _chunk("guest 1", "show-a", user_id="guest"),
+        _chunk("guest 2", "show-a", user_id="guest"),
+    ]
+    vectors = [[1.0, index / 100, 0.0] for index in range(100)] + [
+        [0.0, 0.0, 1.0],
+        [0.1, 0.0, 1.0],
+    ]
+    library_index.add_chunks("show-a", chunks, vectors)
+
+    results = library_index.search([1.0, 0.0, 0.0], k=2, user_id="guest")
+
+    assert sorted(chunk.text for chunk, _ in results) == ["guest 1", "guest 2"]
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_unsaved_chunks_are_dropped_on_load(use_hnsw: bool, tmp_path: Path) -> None:
+    """Appended shards should load without a flush, unsaved HNSW chunks are dropped."""
+    library_index = ShardedLibraryIndex(
+        directory=tmp_path, use_hnsw=use_hnsw, save_delay=3600
+    )
+    library_index.add_chunks("show-a", [_chunk("rag", "show-a")], [[1.0, 0.0, 0.0]])
+
+    reloaded_index = ShardedLibraryIndex(directory=tmp_path, use_hnsw=use_hnsw)
+    reloaded_index.load()
+
+    assert reloaded_index.has_episode("show-a-rag") is not use_hnsw
+
+    library_index.flush()
+    reloaded_index = ShardedLibraryIndex(directory=tmp_path, use_hnsw=use_hnsw)
+    reloaded_index.load()
+
+    assert reloaded_index.has_episode("show-a-rag")
+
+
+@pytest.mark.parametrize("use_hnsw", USE_HNSW_PARAMS)
+def test_owners_of_dropped_episodes_are_not_loaded(
+    use_hnsw: bool, tmp_path: Path
+) -> None:
+    """An episode whose unsaved chunks were dropped should be ingested again."""
+    library_index = ShardedLibraryIndex(
+        directory=tmp_path, use_hnsw=use_hnsw, save_delay=3600
+    )
+    library_index.add_chunks("show-a", [_chunk("rag", "show-a")], [[1.0, 0.0, 0.0]])
+    library_index.add_owner("show-a-rag", "guest")
+
+    reloaded_index = ShardedLibraryIndex(directory=tmp_path, use_hnsw=use_hnsw)
+    reloaded_index.load()
+
+    assert reloaded_index.has_episode("show-a-rag", user_id="guest") is not use_hnsw
+    assert reloaded_index.add_owner("show-a-rag", "guest") is not use_hnsw
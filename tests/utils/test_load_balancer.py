@@ -0,0 +1,148 @@
+"""Tests for the client side load balancing of the model backends."""
+
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+
+from podflix.utils.load_balancer import EndpointPool, LoadBalancingTransport
+
+
+def _build_client(
+    pool: EndpointPool, handler, hedge_delay_ms: int = 0
+) -> httpx.AsyncClient:
+    transport = LoadBalancingTransport(
+        pool=pool,
+        hedge_delay_ms=hedge_delay_ms,
+        transport=httpx.MockTransport(handler),
+    )
+    return httpx.AsyncClient(transport=transport, base_url=pool.primary_url)
+
+
+async def test_request_fails_over_to_healthy_endpoint() -> None:
+    """A connection error should be retried on the next endpoint."""
+    pool = EndpointPool(["http://a", "http://b"], failure_threshold=1)
+    hosts: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if request.url.host == "a":
+            raise httpx.ConnectError("down", request=request)
+        return httpx.Response(200, json={"path": request.url.path})
+
+    async with _build_client(pool, handler) as client:
+        responses = [
+            await client.post("/v1/chat/completions", json={}) for _ in range(3)
+        ]
+
+    assert [response.json()["path"] for response in responses] == [
+        "/v1/chat/completions"
+    ] * len(responses)
+    # NOTE: The circuit of `a` is open after its first failure
+    assert hosts.count("a") <= 1
+    assert hosts.count("b") == len(responses)
+    assert all(endpoint.in_flight == 0 for endpoint in pool.endpoints)
+
+
+async def test_retryable_status_fails_over() -> None:
+    """A 503 answer should be retried on another endpoint."""
+    pool = EndpointPool(["http://a", "http://b"])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "a":
+            return httpx.Response(503)
+        return httpx.Response(200, text="ok")
+
+    async with _build_client(pool, handler) as client:
+        responses = [await client.get("/v1/models") for _ in range(4)]
+
+    assert [response.text for response in responses] == ["ok"] * 4
+
+
+def test_choose_prefers_less_loaded_endpoint() -> None:
+    """The power of two choices should pick the endpoint with the lower score."""
+    pool = EndpointPool(["http://a", "http://b"])
+    fast, slow = pool.endpoints
+    pool.record_success(fast, latency=0.1)
+    pool.record_success(slow, latency=1.0)
+
+    assert {pool.choose().url for _ in range(10)} == {"http://a"}
+
+    fast.in_flight = 20
+
+    assert pool.choose().url == "http://b"
+
+
+def test_open_circuit_removes_endpoint_until_success() -> None:
+    """An endpoint over the failure threshold should leave the rotation."""
+    pool = EndpointPool(["http://a", "http://b"], failure_threshold=2, cooldown=60)
+    broken = pool.endpoints[0]
+
+    pool.record_failure(broken)
+    pool.record_failure(broken)
+
+    assert {pool.choose().url for _ in range(10)} == {"http://b"}
+
+    pool.record_success(broken)
+
+    assert broken.consecutive_failures == 0
+    assert broken.open_until == 0.0
+
+
+async def test_slow_request_is_hedged_to_second_endpoint() -> None:
+    """A request without a first chunk after the hedge delay should be duplicated."""
+    pool = EndpointPool(["http://a", "http://b"])
+    pool.record_success(pool.endpoints[0], latency=0.01)
+    pool.record_success(pool.endpoints[1], latency=1.0)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "a":
+            await asyncio.sleep(1)
+        return httpx.Response(200, text=request.url.host)
+
+    async with _build_client(pool, handler, hedge_delay_ms=20) as client:
+        response = await asyncio.wait_for(client.get("/v1/models"), timeout=0.5)
+
+    assert response.text == "b"
+
+
+async def test_hedged_responses_finishing_together_are_all_released() -> None:
+    """The response not returned by a hedged request should release its endpoint."""
+    pool = EndpointPool(["http://a", "http://b"])
+    pool.record_success(pool.endpoints[0], latency=0.01)
+    pool.record_success(pool.endpoints[1], latency=1.0)
+    both_started = asyncio.Event()
+    hosts: list[str] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if len(hosts) == len(pool.endpoints):
+            both_started.set()
+
+        # NOTE: Both requests finish in the same round of the hedging loop
+        await both_started.wait()
+
+        if request.url.host == "a":
+            return httpx.Response(503)
+        return httpx.Response(200, text=request.url.host)
+
+    async with _build_client(pool, handler, hedge_delay_ms=20) as client:
+        response = await asyncio.wait_for(client.get("/v1/models"), timeout=0.5)
+        await asyncio.sleep(0.05)
+
+    assert response.text == "b"
+    assert all(endpoint.in_flight == 0 for endpoint in pool.endpoints)
+
+
+@pytest.mark.parametrize("url", ["http://a/", "http://a"])
+def test_rewrite_request_keeps_path_and_body(url: str) -> None:
+    """Rewriting should only swap the base URL of the request."""
+    pool = EndpointPool([url, "http://b:8000"])
+    request = httpx.Request("POST", "http://a/v1/audio", content=b"data")
+
+    rewritten = pool.rewrite_request(request, pool.endpoints[1])
+
+    assert str(rewritten.url) == "http://b:8000/v1/audio"
+    assert rewritten.content == b"data"
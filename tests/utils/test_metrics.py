@@ -0,0 +1,73 @@
+"""Tests for the chat turn instrumentation."""
+
+from __future__ import annotations
+
+from typing import TypedDict
+
+import pytest
+from langgraph.graph import END, StateGraph
+
+from podflix.utils import metrics
+from podflix.utils.metrics import (
+    NodeTimingCallbackHandler,
+    TurnMetrics,
+    get_metrics_payload,
+    observe_duration,
+)
+
+
+def test_turn_metrics_summary(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The turn summary should contain the latency and throughput measurements."""
+    now = {"value": 100.0}
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: now["value"])
+
+    turn_metrics = TurnMetrics(model="model", profile="test")
+    now["value"] += 0.5
+    for _ in range(11):
+        turn_metrics.mark_token()
+    now["value"] += 2.0
+
+    summary = turn_metrics.finish()
+
+    assert summary["time_to_first_token"] == pytest.approx(0.5)
+    assert summary["turn_duration"] == pytest.approx(2.5)
+    assert summary["tokens_per_second"] == pytest.approx(10 / 2.0)
+
+
+def test_turn_without_tokens_has_no_latency_measurements() -> None:
+    """A turn without generated tokens should only record its duration."""
+    summary = TurnMetrics(model="model", profile="test").finish(status="cancelled")
+
+    assert set(summary) == {"turn_duration", "tokens"}
+
+
+def test_durations_are_exposed_as_prometheus_histograms() -> None:
+    """Observed durations should be part of the Prometheus exposition."""
+    with observe_duration("transcription_duration", source="test-source"):
+        pass
+
+    payload, _ = get_metrics_payload()
+
+    assert b'podflix_transcription_duration_seconds_count{source="test-source"}' in (
+        payload
+    )
+
+
+def test_node_durations_are_recorded_from_graph_callbacks() -> None:
+    """Every graph node run should be recorded under its node name."""
+
+    class State(TypedDict):
+        value: int
+
+    graph = StateGraph(State)
+    graph.add_node("timed_node", lambda state: {"value": state["value"] + 1})
+    graph.add_edge("timed_node", END)
+    graph.set_entry_point("timed_node")
+
+    graph.compile().invoke(
+        {"value": 0}, config={"callbacks": [NodeTimingCallbackHandler()]}
+    )
+
+    payload, _ = get_metrics_payload()
+
+    assert b'podflix_node_duration_seconds_count{node="timed_node"} 1.0' in payload
@@ -0,0 +1,98 @@
+"""Tests for the prompt/model pipeline registry."""
+
+from __future__ import annotations
+
+import gc
+
+import pytest
+from langchain_core.load import dumps
+from langchain_core.prompts import ChatPromptTemplate
+
+from podflix.utils import pipeline_registry
+from podflix.utils.pipeline_registry import PipelineRegistry, get_prompt_key
+
+PROMPT = ChatPromptTemplate.from_messages([("human", "{question}")])
+
+
+def test_pipeline_is_reused_for_same_configuration() -> None:
+    """The same pipeline name and model configuration should share one runnable."""
+    registry = PipelineRegistry()
+
+    first = registry.get_pipeline("rag", PROMPT, chat_model_kwargs={"temperature": 0})
+    second = registry.get_pipeline("rag", PROMPT, chat_model_kwargs={"temperature": 0})
+
+    assert first is second
+
+
+def test_distinct_configurations_build_distinct_pipelines() -> None:
+    """A different model configuration should build its own pipeline and model."""
+    registry = PipelineRegistry()
+
+    default_pipeline = registry.get_pipeline("rag", PROMPT)
+    tuned_pipeline = registry.get_pipeline(
+        "rag", PROMPT, chat_model_kwargs={"temperature": 0}
+    )
+
+    assert default_pipeline is not tuned_pipeline
+    assert registry.get_chat_model() is not registry.get_chat_model(
+        chat_model_kwargs={"temperature": 0}
+    )
+
+
+def test_chat_model_is_shared_between_pipelines() -> None:
+    """Pipelines with the same model configuration should share the chat model."""
+    registry = PipelineRegistry()
+
+    registry.get_pipeline("first", PROMPT)
+    registry.get_pipeline("second", PROMPT)
+
+    assert len(registry._models) == 1
+
+
+def test_distinct_prompts_build_distinct_pipelines() -> None:
+    """A different prompt under the same name should not reuse the old pipeline."""
+    registry = PipelineRegistry()
+    other_prompt = ChatPromptTemplate.from_messages([("human", "Answer: {question}")])
+
+    first = registry.get_pipeline("rag", PROMPT)
+    second = registry.get_pipeline("rag", other_prompt)
+
+    assert first is not second
+    assert second.first is other_prompt
+    assert (
+        registry.get_pipeline(
+            "rag", ChatPromptTemplate.from_messages([("human", "{question}")])
+        )
+        is first
+    )
+
+
+def test_prompt_is_serialized_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Repeated lookups of the same prompt object should not serialize it again."""
+    calls = []
+    monkeypatch.setattr(
+        pipeline_registry,
+        "dumps",
+        lambda prompt, **kwargs: calls.append(prompt) or dumps(prompt, **kwargs),
+    )
+    registry = PipelineRegistry()
+    prompt = ChatPromptTemplate.from_messages([("human", "Once: {question}")])
+
+    for _ in range(3):
+        registry.get_pipeline("rag", prompt)
+
+    assert calls == [prompt]
+
+
+def test_prompt_key_is_forgotten_with_the_prompt() -> None:
+    """A garbage collected prompt should not keep its cached key alive."""
+    prompt = ChatPromptTemplate.from_messages([("human", "Ad-hoc: {question}")])
+    prompt_id = id(prompt)
+
+    get_prompt_key(prompt)
+    assert prompt_id in pipeline_registry._prompt_keys
+
+    del prompt
+    gc.collect()
+
+    assert prompt_id not in pipeline_registry._prompt_keys
@@ -0,0 +1,97 @@
+"""Tests for the sampled and buffered Langfuse tracing."""
+
+from __future__ import annotations
+
+import threading
+from typing import TypedDict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.graph import END, StateGraph
+
+from podflix.utils.tracing import TraceBuffer, TracingCallbackHandler, TracingPolicy
+
+
+class State(TypedDict):
+    """State of the test graph."""
+
+    value: int
+
+
+class RecordingHandler(BaseCallbackHandler):
+    """Langfuse stand-in recording the received events."""
+
+    def __init__(self) -> None:
+        self.events: list[str] = []
+        self.last_trace_id = "trace"
+
+    def on_chain_start(self, serialized, inputs, **kwargs) -> None:  # noqa: D102
+        self.events.append("on_chain_start")
+
+    def on_chain_end(self, outputs, **kwargs) -> None:  # noqa: D102
+        self.events.append("on_chain_end")
+
+
+def _build_graph():
+    graph = StateGraph(State)
+    graph.add_node("increment", lambda state: {"value": state["value"] + 1})
+    graph.add_edge("increment", END)
+    graph.set_entry_point("increment")
+
+    return graph.compile()
+
+
+def _run_turn(sampled: bool, status: str, duration: float) -> RecordingHandler:
+    recording_handler = RecordingHandler()
+    buffer = TraceBuffer(max_size=100)
+    handler = TracingCallbackHandler(
+        sampled=sampled,
+        policy=TracingPolicy(slow_turn_seconds=5),
+        buffer=buffer,
+        handler_factory=lambda: recording_handler,
+    )
+
+    _build_graph().invoke({"value": 0}, config={"callbacks": [handler]})
+    handler.finish(status=status, duration=duration)
+    buffer.flush()
+
+    return recording_handler
+
+
+def test_sampled_turn_is_traced() -> None:
+    """A sampled turn should forward its events to the Langfuse handler."""
+    events = _run_turn(sampled=True, status="success", duration=1).events
+
+    assert events.count("on_chain_start") == events.count("on_chain_end") > 0
+
+
+def test_unsampled_turn_is_only_traced_on_error_or_when_slow() -> None:
+    """Unsampled turns should only be traced when they fail or are slow."""
+    assert _run_turn(sampled=False, status="success", duration=1).events == []
+    assert _run_turn(sampled=False, status="error", duration=1).events != []
+    assert _run_turn(sampled=False, status="success", duration=6).events != []
+
+
+def test_sample_rate_per_app_type() -> None:
+    """The sample rate of the app type should override the default rate."""
+    policy = TracingPolicy(sample_rates={"audio": 0.0}, default_sample_rate=1.0)
+
+    assert not any(policy.sample("audio") for _ in range(10))
+    assert all(policy.sample("mock") for _ in range(10))
+
+
+def test_full_buffer_drops_oldest_work() -> None:
+    """A blocked worker should never block adding work, the oldest work is dropped."""
+    buffer = TraceBuffer(max_size=2)
+    started, release = threading.Event(), threading.Event()
+    processed: list[int] = []
+
+    buffer.put(lambda: started.set() or release.wait())
+    started.wait(timeout=1)
+    for item in range(4):
+        buffer.put(lambda item=item: processed.append(item))
+
+    release.set()
+    assert buffer.flush(timeout=1) is True
+
+    assert processed == [2, 3]
+    assert buffer.dropped == len([0, 1])
@@ -0,0 +1,54 @@
+"""Tests for the shared transcript store."""
+
+from __future__ import annotations
+
+from podflix.utils.transcript_store import TranscriptStore
+
+SEGMENTS = [{"id": 0, "start": 0.0, "end": 1.5, "text": "Hello world"}]
+
+
+def test_acquire_deduplicates_transcripts_of_the_same_episode() -> None:
+    """Sessions of the same episode should share a single copy of its transcript."""
+    store = TranscriptStore()
+
+    first = store.acquire("episode", "Hello world", SEGMENTS)
+    second = store.acquire("episode", " ".join(["Hello", "world"]), list(SEGMENTS))
+
+    assert len(store) == 1
+    assert second.text is first.text
+    assert second.segments is first.segments
+    assert second.segment_index is first.segment_index
+
+
+def test_only_unused_transcripts_are_evicted_in_lru_order() -> None:
+    """Transcripts used by a session should survive the eviction of the others."""
+    store = TranscriptStore(max_entries=2)
+
+    in_use = store.acquire("in-use", "a", SEGMENTS)
+    store.acquire("old", "b", SEGMENTS).release()
+    store.acquire("recent", "c", SEGMENTS).release()
+
+    assert "in-use" in store
+    assert "old" not in store
+    assert "recent" in store
+
+    store.acquire("other", "d", SEGMENTS)
+
+    assert "in-use" in store
+    assert "recent" not in store
+    assert in_use.text == "a"
+
+
+def test_release_is_idempotent() -> None:
+    """Releasing a handle twice should release a single reference."""
+    store = TranscriptStore(max_entries=1)
+
+    first = store.acquire("episode", "a", SEGMENTS)
+    second = store.acquire("episode", "a", SEGMENTS)
+    first.release()
+    first.release()
+
+    store.acquire("other", "b", SEGMENTS)
+
+    assert "episode" in store
+    assert second.text == "a"